@@ -0,0 +1,71 @@
+"""
+Import-time budget check for the plugin module.
+
+Usage: python benchmarks/bench_import.py [--budget MS] [--repeat N]
+
+Runs ``python -X importtime`` in a fresh interpreter that has already imported
+OctoPrint and Flask, so only the plugin's own import cost is measured. Fails
+when the best cumulative time of ``octoprint_hologram`` exceeds the budget or
+when importing it pulls in one of the heavy dependencies that must only be
+loaded on first use.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Packages that must not be imported until rendering, calibration, stats or SSIM need them
+LAZY_PACKAGES = ("matplotlib", "mpl_toolkits", "scipy", "skimage", "pandas", "seaborn", "PIL", "requests")
+
+SCRIPT = """
+import sys
+import flask
+import octoprint.plugin
+before = set(sys.modules)
+import octoprint_hologram
+loaded = {m.split('.')[0] for m in set(sys.modules) - before}
+print(','.join(sorted(loaded)))
+"""
+
+
+def measure():
+    """Return (cumulative import time in ms, top-level packages newly loaded by the import)."""
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", SCRIPT],
+                            capture_output=True, text=True, env=env, check=True)
+
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == "octoprint_hologram":
+            cumulative_us = int(parts[1].strip())
+    if cumulative_us is None:
+        raise RuntimeError("octoprint_hologram not found in -X importtime output")
+
+    loaded = set(result.stdout.strip().split(",")) if result.stdout.strip() else set()
+    return cumulative_us / 1000, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plugin import-time budget")
+    parser.add_argument("--budget", type=float, default=250.0, help="maximum import time in milliseconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.repeat)]
+    best = min(t for t, _ in runs)
+    heavy = sorted(set().union(*(loaded for _, loaded in runs)) & set(LAZY_PACKAGES))
+
+    print(f"import octoprint_hologram: {best:.1f} ms (budget {args.budget:.0f} ms)")
+    if heavy:
+        print(f"eagerly imported: {', '.join(heavy)}")
+
+    if best > args.budget or heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
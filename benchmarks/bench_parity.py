@@ -0,0 +1,259 @@
+"""
+Golden-image parity of the fast render backends against the reference matplotlib render.
+
+Usage: python benchmarks/bench_parity.py [--gcode FILE] [--quick] [--repeat N]
+       [--min-iou X] [--min-ssim X] [--max-anchor-px X] [--max-roi-px N] [--output FILE]
+
+For every camera of a grid of slider values, the toolpath is rendered by the reference
+path (plot_layers of the unsimplified subpaths and savefig) and by each backend:
+
+- lod: render.render_toolpath, simplified subpaths on a cached CameraView.
+- pil: simplified vertices projected with CameraView.project and drawn with PIL, the
+  render.render_views path at full size.
+- client: simplified vertices decoded from render.toolpath_buffer and projected with
+  CameraView.projection_matrix, what the browser draws.
+- atlas: the overlay served by SpriteAtlas.lookup once the atlas is built.
+
+Each backend is compared on the anchor of the bed center (utils.get_pixel_coords), the ROI
+box (utils.find_non_transparent_roi), the IoU of the overlay masks and the SSIM of their alpha
+channels inside the reference ROI. Masks are dilated by --dilate pixels before the IoU so
+antialiasing differences of one pixel do not count as misses. The report puts the speedup over the reference next to the accuracy;
+the script exits with status 1 when a backend misses a threshold.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_gcode  # noqa: E402
+from octoprint_hologram import gcode_reader, render, sprite_atlas, utils  # noqa: E402
+from octoprint_hologram.fast_ssim import ReferenceSSIM  # noqa: E402
+
+PRINTER_DIMS = (220, 220, 250)
+COLOR = "white"
+
+# Grid of (elevation, azimuth, roll, focal length, scale) slider values
+GRID = {
+    "elevation": (20.0, 45.0),
+    "azimuth": (-75.0, -40.0),
+    "roll": (0.0, 5.0),
+    "focal": (0.4, 0.8),
+    "scale": (0.8, 1.3),
+}
+QUICK_GRID = {
+    "elevation": (30.0,),
+    "azimuth": (-60.0,),
+    "roll": (0.0,),
+    "focal": (0.5,),
+    "scale": (0.8, 1.3),
+}
+
+# Matplotlib's default line width, in points
+LINE_WIDTH_PT = 1.5
+
+
+def settings_for(values):
+    return render.RenderSettings(printer_dims=PRINTER_DIMS, slider_values=tuple(values), color=COLOR)
+
+
+def output_image(png):
+    png.seek(0)
+    return Image.open(png).convert("RGBA")
+
+
+def reference_backend(reader, settings):
+    """plot_layers of the unsimplified subpaths on a fresh figure, the render every backend is held to."""
+    view = render.CameraView(settings.printer_dims, settings.slider_values, dpi=render.BASE_DPI * settings.slider_values[4])
+    reader.plot_layers(min_layer=1, max_layer=reader.n_layers + 1, color=settings.color, ax=view.ax)
+    anchor = utils.get_pixel_coords(view.ax, PRINTER_DIMS[0] / 2, PRINTER_DIMS[1] / 2, 0)
+    return view.save_png(), anchor
+
+
+def lod_backend(reader, settings):
+    png, anchor, _ = render.render_toolpath(reader, settings)
+    return png, anchor
+
+
+def _draw_polylines(size, pixels, path_bars, dpi):
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    width = max(1, round(LINE_WIDTH_PT * dpi / 72))
+    for left, right in zip(path_bars[:-1], path_bars[1:]):
+        draw.line(pixels[left:right].ravel().tolist(), fill=COLOR, width=width, joint="curve")
+    png = io.BytesIO()
+    overlay.save(png, format="PNG")
+    return png
+
+
+def pil_backend(reader, settings):
+    view = render.camera_view(settings)
+    points, path_bars, _ = reader.lod_vertices(0.5 * view.mm_per_pixel)
+    png = _draw_polylines(render.output_size(settings.slider_values[4]), view.project(points), path_bars, view.fig.dpi)
+    return png, view.anchor
+
+
+def client_backend(reader, settings):
+    view = render.camera_view(settings)
+    buffer = render.toolpath_buffer(reader, 0.5 * view.mm_per_pixel)
+
+    # Decode like hologram.js
+    _, _, n_layers, n_paths, n_points, *scales = render.TOOLPATH_HEADER.unpack_from(buffer)
+    offset = render.TOOLPATH_HEADER.size + 4 * (n_layers + 1)
+    path_bars = np.frombuffer(buffer, "<u4", n_paths + 1, offset)
+    offset += 4 * (n_paths + 1)
+    quantized = np.frombuffer(buffer, "<i2", 3 * n_points, offset).reshape(3, n_points)
+    points = np.asarray(scales[:3])[:, None] + (quantized + 32768.0) * np.asarray(scales[3:])[:, None]
+
+    projected = view.projection_matrix() @ np.vstack((points, np.ones(n_points)))
+    pixels = (projected[:2] / projected[2]).T
+    anchor = view.projection_matrix() @ np.array([PRINTER_DIMS[0] / 2, PRINTER_DIMS[1] / 2, 0, 1])
+    png = _draw_polylines(render.output_size(settings.slider_values[4]), pixels, path_bars, view.fig.dpi)
+    return png, tuple(anchor[:2] / anchor[2])
+
+
+class AtlasBackend:
+    """Serves overlays from a SpriteAtlas, built outside the timing on the first call for each camera."""
+
+    def __init__(self, folder, gcode_path):
+        self.atlas = sprite_atlas.SpriteAtlas(folder, stride=1 << 30)
+        self.gcode_path = gcode_path
+
+    def prepare(self, reader, settings):
+        self.atlas.build(self.atlas.key(self.atlas.resolve(self.gcode_path), settings), reader, settings)
+
+    def __call__(self, reader, settings):
+        image, anchor, _, _ = self.atlas.lookup(self.gcode_path, settings)
+        return image, anchor
+
+
+def mask_of(image, dilate=0):
+    from scipy.ndimage import binary_dilation
+
+    mask = np.asarray(image)[:, :, 3] > 0
+    if dilate:
+        mask = binary_dilation(mask, iterations=dilate)
+    return mask
+
+
+def compare(reference, candidate, dilate):
+    """Accuracy of a candidate (image, anchor, roi) against the reference one."""
+    ref_image, ref_anchor, ref_roi = reference
+    image, anchor, roi = candidate
+
+    if image.size != ref_image.size:
+        return {"size_mismatch": [image.size, ref_image.size]}
+
+    ref_mask, mask = mask_of(ref_image, dilate), mask_of(image, dilate)
+    union = np.logical_or(ref_mask, mask).sum()
+    iou = float(np.logical_and(ref_mask, mask).sum() / union) if union else 1.0
+
+    # SSIM of the alpha channels over the reference ROI, the empty margins would inflate it
+    min_x, min_y, max_x, max_y = ref_roi
+    ref_alpha = np.asarray(ref_image)[min_y:max_y + 1, min_x:max_x + 1, 3].astype(np.float32) / 255
+    alpha = np.asarray(image)[min_y:max_y + 1, min_x:max_x + 1, 3].astype(np.float32) / 255
+    ssim = ReferenceSSIM(ref_alpha).compare(alpha)
+
+    return {
+        "anchor_px": float(np.hypot(*np.subtract(anchor, ref_anchor))),
+        "roi_px": int(np.max(np.abs(np.subtract(roi, ref_roi)))),
+        "iou": iou,
+        "ssim": ssim,
+    }
+
+
+def run_backend(backend, reader, settings, repeat):
+    """Best time of repeat renders, with the (image, anchor, roi) of the last one."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        png, anchor = backend(reader, settings)
+        times.append(time.perf_counter() - started)
+    image = output_image(png)
+    png.seek(0)
+    return min(times), (image, tuple(float(v) for v in anchor), utils.find_non_transparent_roi(png))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity of the fast render backends with the reference render")
+    parser.add_argument("--gcode", help="G-code file to render, a synthetic PrusaSlicer-style file by default")
+    parser.add_argument("--quick", action="store_true", help="Two cameras and a small fixture, for a smoke run")
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--dilate", type=int, default=1, help="Pixels the masks are dilated by before the IoU")
+    parser.add_argument("--min-iou", type=float, default=0.9)
+    parser.add_argument("--min-ssim", type=float, default=0.85)
+    parser.add_argument("--max-anchor-px", type=float, default=0.01)
+    parser.add_argument("--max-roi-px", type=int, default=3)
+    parser.add_argument("--output", help="JSON file receiving every measurement")
+    args = parser.parse_args()
+
+    grid = QUICK_GRID if args.quick else GRID
+    cameras = list(itertools.product(*grid.values()))
+
+    with tempfile.TemporaryDirectory(prefix="hologram-parity-") as folder:
+        gcode_path = args.gcode
+        if gcode_path is None:
+            layers, segments = (15, 100) if args.quick else (60, 300)
+            gcode_path = synthetic_gcode.generate(os.path.join(folder, "fixture.gcode"), flavor="prusa",
+                                                  layers=layers, segments=segments, arcs=0.2)
+        reader = gcode_reader.GcodeReader(gcode_path)
+        reader._compute_subpaths()
+
+        atlas = AtlasBackend(os.path.join(folder, "atlas"), gcode_path)
+        backends = {"lod": lod_backend, "pil": pil_backend, "client": client_backend, "atlas": atlas}
+
+        records = []
+        for values in cameras:
+            settings = settings_for(values)
+            ref_time, reference = run_backend(reference_backend, reader, settings, args.repeat)
+            for name, backend in backends.items():
+                if backend is atlas:
+                    atlas.prepare(reader, settings)
+                backend_time, candidate = run_backend(backend, reader, settings, args.repeat)
+                record = {"backend": name, "slider_values": list(values), "reference_s": ref_time,
+                          "backend_s": backend_time, "speedup": ref_time / backend_time}
+                record.update(compare(reference, candidate, args.dilate))
+                records.append(record)
+
+    failed = False
+    print(f"{len(cameras)} cameras, {reader.n_layers} layers, {len(reader.segs)} segments\n")
+    print(f"{'backend':8} {'speedup':>9} {'anchor px':>10} {'roi px':>7} {'min IoU':>8} {'min SSIM':>9}")
+    for name in backends:
+        rows = [record for record in records if record["backend"] == name]
+        if any("size_mismatch" in row for row in rows):
+            print(f"{name:8} overlay size differs from the reference")
+            failed = True
+            continue
+        speedup = float(np.median([row["speedup"] for row in rows]))
+        anchor = max(row["anchor_px"] for row in rows)
+        roi = max(row["roi_px"] for row in rows)
+        iou = min(row["iou"] for row in rows)
+        ssim = min(row["ssim"] for row in rows)
+        ok = (anchor <= args.max_anchor_px and roi <= args.max_roi_px
+              and iou >= args.min_iou and ssim >= args.min_ssim)
+        failed |= not ok
+        print(f"{name:8} {speedup:8.1f}x {anchor:10.4f} {roi:7d} {iou:8.3f} {ssim:9.3f}  {'ok' if ok else 'FAIL'}")
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump({"thresholds": {"min_iou": args.min_iou, "min_ssim": args.min_ssim,
+                                      "max_anchor_px": args.max_anchor_px, "max_roi_px": args.max_roi_px,
+                                      "dilate": args.dilate},
+                       "records": records}, outfile, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
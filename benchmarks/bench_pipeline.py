@@ -0,0 +1,215 @@
+"""
+Timings of every stage of the render pipeline on synthetic G-code, written to JSON.
+
+Usage: python benchmarks/bench_pipeline.py [--output FILE] [--compare BASELINE] [--repeat N]
+       [--quick] [--only NAME ...]
+
+Fixtures are generated by synthetic_gcode.py into a temporary folder, so two runs of the
+same commit measure the same input. Each benchmark reports the best, median and every
+time of --repeat runs; --compare prints the ratio of the best times to a previous output,
+which makes regressions between commits visible when both runs are on the same machine.
+
+Benchmarks:
+- parse: GcodeReader on each fixture.
+- compute_subpaths: GcodeReader._compute_subpaths on each fixture.
+- plot_savefig: plot_layers of the whole toolpath and savefig, unsimplified and simplified.
+- overlay_images, find_non_transparent_roi: on the rendered overlay and a 1280x720 frame.
+- calculate_ssim: on two 1280x720 frames.
+- optimize_projection: one full calibration.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_gcode  # noqa: E402
+from octoprint_hologram import gcode_reader, render, utils  # noqa: E402
+
+PRINTER_DIMS = (220, 220, 250)
+SLIDER_VALUES = (30.0, -60.0, 0.0, 0.5, 1.0)
+FRAME_SIZE = (1280, 720)
+CALIBRATION_POINTS = [(430, 210), (850, 215), (905, 520), (380, 515)]
+
+# name -> synthetic_gcode.generate arguments
+FIXTURES = {
+    "generic": dict(flavor="generic", layers=100, segments=200),
+    "prusa": dict(flavor="prusa", layers=100, segments=200, comments=0.2),
+    "cura": dict(flavor="cura", layers=100, segments=200, comments=0.1),
+    "simplify3d": dict(flavor="simplify3d", layers=100, segments=200),
+    "arcs": dict(flavor="prusa", layers=100, segments=200, arcs=0.5),
+    "large": dict(flavor="prusa", segments=400, size=8 << 20),
+}
+QUICK_FIXTURES = {
+    "generic": dict(flavor="generic", layers=20, segments=100),
+    "arcs": dict(flavor="prusa", layers=20, segments=100, arcs=0.5),
+}
+
+
+def measure(fn, repeat, setup=None):
+    """Run fn repeat times, calling setup before each run outside the timing."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return {"best": min(times), "median": statistics.median(times), "times": times}
+
+
+def make_frame(seed=0):
+    """Webcam-like frame: noisy background with a bright bed quadrilateral."""
+    rng = np.random.default_rng(seed)
+    frame = Image.fromarray(rng.integers(30, 70, size=(FRAME_SIZE[1], FRAME_SIZE[0], 3), dtype=np.uint8))
+    ImageDraw.Draw(frame).polygon(CALIBRATION_POINTS, fill=(150, 150, 150))
+    return frame
+
+
+def render_png(reader, tolerance=None):
+    """plot_layers of every layer on the calibrated camera and savefig, as render.render_toolpath draws."""
+    view = render.CameraView(PRINTER_DIMS, SLIDER_VALUES, dpi=render.BASE_DPI * SLIDER_VALUES[4])
+    reader.plot_layers(min_layer=1, max_layer=reader.n_layers + 1, color="white", ax=view.ax, tolerance=tolerance)
+    return view.save_png(), view
+
+
+def bench_gcode(fixtures, repeat, results):
+    for name, path in fixtures.items():
+        size = os.path.getsize(path)
+        timing = measure(lambda: gcode_reader.GcodeReader(path), repeat)
+        timing["bytes"] = size
+        results[f"parse/{name}"] = timing
+
+        reader = gcode_reader.GcodeReader(path)
+
+        def reset():
+            reader.subpaths = []
+            reader.subpath_index_bars = []
+
+        timing = measure(reader._compute_subpaths, repeat, setup=reset)
+        timing["segments"] = len(reader.segs)
+        results[f"compute_subpaths/{name}"] = timing
+
+
+def bench_render(path, repeat, results):
+    reader = gcode_reader.GcodeReader(path)
+    reader._compute_subpaths()
+    results["plot_savefig/full"] = measure(lambda: render_png(reader), repeat)
+
+    _, view = render_png(reader)
+    tolerance = 0.5 * view.mm_per_pixel
+    reader.lod_subpaths(tolerance)
+    results["plot_savefig/lod"] = measure(lambda: render_png(reader, tolerance), repeat)
+
+    overlay, view = render_png(reader)
+    frame = make_frame().convert("RGBA")
+    base_anchor = utils.center_of_quadrilateral(CALIBRATION_POINTS)
+
+    def overlay_once():
+        overlay.seek(0)
+        utils.overlay_images(frame, overlay, base_anchor, view.anchor)
+
+    def roi_once():
+        overlay.seek(0)
+        utils.find_non_transparent_roi(overlay)
+
+    results["overlay_images"] = measure(overlay_once, repeat)
+    results["find_non_transparent_roi"] = measure(roi_once, repeat)
+
+
+def bench_images(repeat, results):
+    expected = make_frame(0)
+    live = make_frame(1)
+    results["calculate_ssim"] = measure(lambda: utils.calculate_ssim(expected, live), repeat)
+
+
+def bench_calibration(repeat, results):
+    results["optimize_projection"] = measure(lambda: utils.optimize_projection(CALIBRATION_POINTS, PRINTER_DIMS),
+                                             repeat)
+
+
+def environment():
+    """Machine and library versions the timings were taken with."""
+    import matplotlib
+    import PIL
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "matplotlib": matplotlib.__version__,
+        "pillow": PIL.__version__,
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as infile:
+        baseline = json.load(infile)
+    print(f"\nCompared with {baseline_path} (commit {baseline['environment'].get('commit')}):")
+    for name, timing in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            print(f"  {name:32} new")
+            continue
+        ratio = timing["best"] / previous["best"]
+        print(f"  {name:32} {previous['best'] * 1000:10.2f} -> {timing['best'] * 1000:10.2f} ms ({ratio:5.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render pipeline benchmark")
+    parser.add_argument("--output", help="JSON file receiving the results")
+    parser.add_argument("--compare", help="JSON output of a previous run to compare with")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="Small fixtures and a single calibration, for a smoke run")
+    parser.add_argument("--only", nargs="+", choices=("gcode", "render", "images", "calibration"),
+                        help="Groups of benchmarks to run, all by default")
+    args = parser.parse_args()
+
+    groups = set(args.only or ("gcode", "render", "images", "calibration"))
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="hologram-bench-") as folder:
+        fixtures = {}
+        for name, params in (QUICK_FIXTURES if args.quick else FIXTURES).items():
+            fixtures[name] = synthetic_gcode.generate(os.path.join(folder, f"{name}.gcode"), **params)
+
+        if "gcode" in groups:
+            bench_gcode(fixtures, args.repeat, results)
+        if "render" in groups:
+            bench_render(fixtures["generic"], args.repeat, results)
+        if "images" in groups:
+            bench_images(args.repeat, results)
+        if "calibration" in groups:
+            bench_calibration(1 if args.quick else args.repeat, results)
+
+    for name, timing in results.items():
+        print(f"{name:34} best {timing['best'] * 1000:10.2f} ms  median {timing['median'] * 1000:10.2f} ms")
+
+    output = {"environment": environment(), "repeat": args.repeat, "quick": args.quick, "results": results}
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(output, outfile, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark of the ROI SSIM engine against the skimage path used by utils.calculate_ssim.
+
+Usage: python benchmarks/bench_ssim.py [--repeat N]
+
+Checks that ReferenceSSIM at full resolution stays within ACCURACY_BOUND of
+skimage's structural_similarity on the same crop, then reports the time of a
+full-frame calculate_ssim call against a cached-reference ROI comparison at a
+few downscale factors.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+from PIL import Image, ImageDraw
+from skimage.metrics import structural_similarity
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from octoprint_hologram import utils  # noqa: E402
+from octoprint_hologram.fast_ssim import ReferenceSSIM  # noqa: E402
+
+# Maximum absolute difference allowed between ReferenceSSIM and skimage on the same input
+ACCURACY_BOUND = 1e-4
+
+FRAME_SIZE = (1280, 720)
+ROI = (420, 180, 859, 539)
+
+
+def make_frames(seed=0):
+    """Expected frame with a rendered part and a noisy, slightly shifted live frame."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(30, 60, size=(FRAME_SIZE[1], FRAME_SIZE[0], 3), dtype=np.uint8)
+
+    expected = Image.fromarray(base)
+    draw = ImageDraw.Draw(expected)
+    for i in range(40):
+        draw.line((470, 200 + 8 * i, 810, 200 + 8 * i), fill=(230, 230, 230), width=3)
+
+    live = Image.fromarray(base)
+    draw = ImageDraw.Draw(live)
+    for i in range(36):
+        draw.line((472, 202 + 8 * i, 812, 202 + 8 * i), fill=(210, 210, 210), width=3)
+    noise = rng.normal(0, 6, size=(FRAME_SIZE[1], FRAME_SIZE[0], 3))
+    live = Image.fromarray(np.clip(np.asarray(live) + noise, 0, 255).astype(np.uint8))
+    return expected, live
+
+
+def check_accuracy(expected, live):
+    reference = utils.roi_grayscale(expected, ROI)
+    frame = utils.roi_grayscale(live, ROI)
+    exact = structural_similarity(reference.astype(np.float64), frame.astype(np.float64), data_range=1.0)
+    fast = ReferenceSSIM(expected, roi=ROI).compare(live)
+    error = abs(exact - fast)
+    print(f"skimage ROI SSIM {exact:.6f}, ReferenceSSIM {fast:.6f}, |error| {error:.2e} (bound {ACCURACY_BOUND:.0e})")
+    return error <= ACCURACY_BOUND
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ReferenceSSIM benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    expected, live = make_frames()
+    if not check_accuracy(expected, live):
+        print("Accuracy bound exceeded")
+        sys.exit(1)
+
+    skimage_time = min(timeit.repeat(lambda: utils.calculate_ssim(expected, live), number=1, repeat=args.repeat))
+    print(f"calculate_ssim full frame: {skimage_time * 1000:8.2f} ms")
+
+    for downscale in (1.0, 0.5, 0.25):
+        engine = ReferenceSSIM(expected, roi=ROI, downscale=downscale)
+        fast_time = min(timeit.repeat(lambda: engine.compare(live), number=1, repeat=args.repeat))
+        print(f"ReferenceSSIM ROI x{downscale:<4}: {fast_time * 1000:8.2f} ms "
+              f"({skimage_time / fast_time:5.1f}x, ssim {engine.compare(live):.4f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Parity of GcodeReader.mesh and compute_nearest_neighbors with their original loops.
+
+Usage: python benchmarks/check_neighbors_parity.py [--gcode FILE] [--layers N] [--segments N]
+
+The reference meshes segments one slice at a time with running sums and compares every
+pair of elements of a layer with the pairwise helpers of GcodeReader, as the reader did
+before both were vectorized. Element coordinates and the left and right neighbours of
+every element must be identical, not merely close: a difference in the last bits of a
+coordinate is enough to change which of two equally distant elements is the nearest.
+The reference is quadratic in the elements of a layer, keep the fixture small.
+Exits with status 1 on any mismatch.
+"""
+import argparse
+import collections
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_gcode  # noqa: E402
+from octoprint_hologram import gcode_reader  # noqa: E402
+
+Element = collections.namedtuple("Element", ["x0", "y0", "x1", "y1", "z"])
+
+
+def reference_mesh(reader, max_length):
+    """Elements and layer bars of the original mesh loop."""
+    elements = []
+    index_bars = []
+    bar = 0
+    n_eles = 0
+    powers = getattr(reader, "powers", [gcode_reader.POWER_ZERO + 10] * len(reader.segs))
+    for i, (x0, y0, x1, y1, z) in enumerate(np.asarray(reader.segs, dtype=float).reshape(-1, 5).tolist()):
+        if i == reader.seg_index_bars[bar]:
+            bar += 1
+            index_bars.append(n_eles)
+        if powers[i] < gcode_reader.POWER_ZERO:
+            continue
+        length = np.hypot(x0 - x1, y0 - y1)
+        n_slices = int(np.ceil(length / max_length))
+        n_eles += n_slices
+        dx = (x1 - x0) / n_slices
+        dy = (y1 - y0) / n_slices
+        for _ in range(n_slices - 1):
+            elements.append(Element(x0, y0, x0 + dx, y0 + dy, z))
+            x0, y0 = x0 + dx, y0 + dy
+        elements.append(Element(x0, y0, x1, y1, z))
+    index_bars.append(n_eles)
+    return elements, index_bars
+
+
+def reference_neighbors(reader, layer):
+    """Left and right neighbours of the original O(n^2) loop, reader.elements being a list of Element."""
+    start_idx, end_idx = reader.elements_index_bars[layer - 1:layer + 1]
+    half_width = gcode_reader.HALF_WIDTH
+    left_neis = []
+    right_neis = []
+    for i in range(start_idx, end_idx):
+        left_mn = right_mn = math.inf
+        left_idx = right_idx = -1
+        for j in range(start_idx, end_idx):
+            if j == i:
+                continue
+            if (reader._is_element_nearly_parallel(i, j, 0.0001) and
+                    reader._compute_center_distance(i, j) < 2.0 * half_width * 2):
+                is_left = reader._is_element_left(i, j)
+                distance = reader._compute_parallel_distance(i, j)
+                if distance < 0.4 * half_width * 2:
+                    continue
+                if is_left == 1:
+                    if distance < left_mn:
+                        left_idx, left_mn = j, distance
+                elif is_left == -1:
+                    if distance < right_mn:
+                        right_idx, right_mn = j, distance
+        left_neis.append((left_idx, left_mn))
+        right_neis.append((right_idx, right_mn))
+    return left_neis, right_neis
+
+
+def differences(a, b):
+    return sum(x != y for x, y in zip(a, b)) + abs(len(a) - len(b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity of mesh and compute_nearest_neighbors with the original loops")
+    parser.add_argument("--gcode", help="G-code file, a synthetic Simplify3D-style file by default")
+    parser.add_argument("--layers", type=int, default=3)
+    parser.add_argument("--segments", type=int, default=120)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="hologram-neighbors-") as folder:
+        gcode_path = args.gcode or synthetic_gcode.generate(os.path.join(folder, "fixture.gcode"),
+                                                            flavor="simplify3d", layers=args.layers,
+                                                            segments=args.segments)
+        reader = gcode_reader.GcodeReader(gcode_path)
+        reference = gcode_reader.GcodeReader(gcode_path)
+
+        reader.mesh(gcode_reader.MAX_ELEMENT_LENGTH)
+        reference.elements, reference.elements_index_bars = reference_mesh(reference,
+                                                                           gcode_reader.MAX_ELEMENT_LENGTH)
+        same_elements = (reader.elements_index_bars == reference.elements_index_bars
+                         and reader.element_coords().tolist() == [list(e) for e in reference.elements])
+        failed |= not same_elements
+        print(f"mesh         {len(reference.elements)} elements  {'ok' if same_elements else 'FAIL'}")
+
+        for layer in range(1, reader.n_layers + 1):
+            started = time.perf_counter()
+            left, right = reader.compute_nearest_neighbors(layer)
+            fast = time.perf_counter() - started
+            started = time.perf_counter()
+            ref_left, ref_right = reference_neighbors(reference, layer)
+            slow = time.perf_counter() - started
+            n_left, n_right = differences(left, ref_left), differences(right, ref_right)
+            failed |= bool(n_left or n_right)
+            print(f"layer {layer:<6} {len(ref_left)} elements  left {n_left} differ  right {n_right} differ  "
+                  f"{slow / max(fast, 1e-9):.0f}x  {'ok' if not (n_left or n_right) else 'FAIL'}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
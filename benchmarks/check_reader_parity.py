@@ -0,0 +1,166 @@
+"""
+Parity of the G-code reader across positioning modes and read paths.
+
+Usage: python benchmarks/check_reader_parity.py [--layers N] [--workers N]
+
+The same synthetic toolpath is written four ways, which must all parse to the segments
+of the absolute one:
+
+- absolute: G90 and absolute extrusion (M82), Simplify3D style with G1 travels.
+- relative_e: G90 and relative extrusion (M83), PrusaSlicer style.
+- g91_m82: relative positioning (G91) with absolute extrusion, travels repeating the
+  current E, which must not be taken for extrusion.
+- g91_m83: relative positioning and relative extrusion.
+
+Homing is written with words without a number (G28 X Y). Each file is also read in
+parallel chunks and by layer ranges, which must match the sequential read of the same file. Exits with status 1 on any mismatch.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_gcode  # noqa: E402
+from octoprint_hologram import gcode_reader  # noqa: E402
+
+# Segment coordinates differ by the rounding of relative moves summed up
+TOLERANCE = 1e-6
+
+
+def to_relative_positioning(src, dst):
+    """
+    Rewrite the moves of a G90 file after its header as G91 moves.
+
+    Under M82, travels without E get the current E so a parser treating E as relative
+    would see them extrude. A G28 with words without a number follows the G91.
+    """
+    with open(src) as infile:
+        lines = infile.read().split("\n")
+
+    out = []
+    position = None
+    relative_e = False
+    e = 0.0
+    for line in lines:
+        if line.startswith("M83"):
+            relative_e = True
+        elif line.startswith("M82"):
+            relative_e = False
+        if position is None:
+            if line.startswith((";LAYER", "; layer")):
+                # Known position from which every move is written as an offset
+                # Words without a number are skipped by the parser, relative ones too
+                out += ["G1 X0 Y0 Z0", "G91", "G28 X Y"]
+                position = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+            else:
+                out.append(line)
+                continue
+
+        code, _, comment = line.partition(";")
+        tokens = code.split()
+        if not tokens or tokens[0] not in ("G0", "G1", "G2", "G3", "G92"):
+            out.append(line)
+            continue
+        if tokens[0] == "G92":
+            for token in tokens[1:]:
+                if token[0] == "E":
+                    e = float(token[1:])
+            out.append(line)
+            continue
+
+        words = []
+        has_e = False
+        for token in tokens[1:]:
+            axis = token[0]
+            if axis in position:
+                value = float(token[1:])
+                words.append(f"{axis}{value - position[axis]:.6f}")
+                position[axis] = value
+            else:
+                if axis == "E":
+                    has_e = True
+                    if not relative_e:
+                        e = float(token[1:])
+                words.append(token)
+        if not has_e and not relative_e and any(word[0] in "XY" for word in words):
+            words.append(f"E{e:.5f}")
+        out.append(" ".join([tokens[0]] + words) + (f" ;{comment}" if comment else ""))
+
+    with open(dst, "w") as outfile:
+        outfile.write("\n".join(out))
+    return dst
+
+
+def with_bare_homing(path):
+    """Write the G28 of the header as G28 X Y, which the backward scans of a range starting at layer 1 reach."""
+    with open(path) as infile:
+        lines = infile.read().split("\n")
+    lines[lines.index("G28")] = "G28 X Y"
+    with open(path, "w") as outfile:
+        outfile.write("\n".join(lines))
+    return path
+
+
+def segments(reader):
+    return np.asarray(reader.segs[:], dtype=np.float64).reshape(-1, 5), list(reader.seg_index_bars)
+
+
+def same(a, b):
+    (segs_a, bars_a), (segs_b, bars_b) = a, b
+    return segs_a.shape == segs_b.shape and bars_a == bars_b and np.allclose(segs_a, segs_b, rtol=0, atol=TOLERANCE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="G-code reader parity across positioning modes")
+    parser.add_argument("--layers", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=3)
+    args = parser.parse_args()
+
+    # Chunked parsing is only used for large files, the fixtures are small
+    gcode_reader.PARALLEL_MIN_BYTES = 0
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="hologram-reader-") as folder:
+        absolute = with_bare_homing(synthetic_gcode.generate(os.path.join(folder, "absolute.gcode"),
+                                                             flavor="simplify3d", layers=args.layers,
+                                                             segments=150, arcs=0.2))
+        relative_e = with_bare_homing(synthetic_gcode.generate(os.path.join(folder, "relative_e.gcode"),
+                                                               flavor="prusa", layers=args.layers,
+                                                               segments=150, arcs=0.2))
+        files = {
+            "absolute": absolute,
+            "relative_e": relative_e,
+            "g91_m82": to_relative_positioning(absolute, os.path.join(folder, "g91_m82.gcode")),
+            "g91_m83": to_relative_positioning(relative_e, os.path.join(folder, "g91_m83.gcode")),
+        }
+
+        reference = segments(gcode_reader.GcodeReader(absolute))
+        ranges = [(1, args.layers // 3), (args.layers // 3, 2 * args.layers // 3)]
+        for name, path in files.items():
+            full = gcode_reader.GcodeReader(path)
+            sequential = segments(full)
+            in_ranges = True
+            for first, last in ranges:
+                left, right = full.seg_index_bars[first - 1], full.seg_index_bars[last - 1]
+                expected = (sequential[0][left:right], [bar - left for bar in full.seg_index_bars[first - 1:last]])
+                in_ranges &= same(segments(gcode_reader.GcodeReader(path, layer_range=(first, last))), expected)
+            checks = {
+                "sequential": same(sequential, reference),
+                "parallel": same(segments(gcode_reader.GcodeReader(path, workers=args.workers)), sequential),
+                "layer_range": in_ranges,
+            }
+            failed |= not all(checks.values())
+            print(f"{name:12} " + "  ".join(f"{check} {'ok' if ok else 'FAIL'}" for check, ok in checks.items()))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
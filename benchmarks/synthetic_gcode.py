@@ -0,0 +1,210 @@
+"""
+Deterministic synthetic G-code for benchmarks.
+
+Usage: python benchmarks/synthetic_gcode.py OUTPUT [--flavor NAME] [--layers N]
+       [--segments N] [--arcs FRACTION] [--comments FRACTION] [--size BYTES] [--seed N]
+
+Every layer is a ring of perimeters around a rectilinear infill, travel moves between
+them and retractions at each layer change, written the way one of a few slicers writes
+it:
+
+- generic: absolute extrusion, no comments besides the ones requested.
+- prusa: PrusaSlicer style, relative extrusion (M83), ;LAYER_CHANGE / ;Z: / ;TYPE: comments.
+- cura: Cura style, absolute extrusion reset per layer, G0 travels, ;LAYER: / ;TYPE: comments.
+- simplify3d: Simplify3D style, absolute extrusion, "; layer N, Z = ..." comments and G92 E0.
+
+The same arguments always produce the same file, byte for byte, so timings of two commits
+are taken on identical input.
+"""
+import argparse
+import math
+import random
+
+FLAVORS = ("generic", "prusa", "cura", "simplify3d")
+
+LAYER_HEIGHT = 0.2
+BED_CENTER = (110.0, 110.0)
+
+# Filament length extruded per millimetre of path
+EXTRUSION_PER_MM = 0.033
+
+
+class _Writer:
+    """Tracks position and extrusion while writing moves for one flavor."""
+
+    def __init__(self, flavor, rng, comments):
+        self.flavor = flavor
+        self.rng = rng
+        self.comments = comments
+        self.lines = []
+        self.x, self.y = BED_CENTER
+        self.e = 0.0
+
+    @property
+    def relative_e(self):
+        return self.flavor == "prusa"
+
+    def comment(self):
+        if self.comments and self.rng.random() < self.comments:
+            return " ; move"
+        return ""
+
+    def travel(self, x, y):
+        command = "G0" if self.flavor == "cura" else "G1"
+        self.lines.append(f"{command} X{x:.3f} Y{y:.3f} F9000{self.comment()}")
+        self.x, self.y = x, y
+
+    def _extrusion(self, length):
+        amount = length * EXTRUSION_PER_MM
+        if self.relative_e:
+            return amount
+        self.e += amount
+        return self.e
+
+    def extrude(self, x, y):
+        e = self._extrusion(math.hypot(x - self.x, y - self.y))
+        self.lines.append(f"G1 X{x:.3f} Y{y:.3f} E{e:.5f}{self.comment()}")
+        self.x, self.y = x, y
+
+    def arc(self, x, y, cx, cy, clockwise):
+        # Length of the arc for the extrusion amount, the sweep is at most a half turn here
+        radius = math.hypot(self.x - cx, self.y - cy)
+        sweep = abs(math.atan2(y - cy, x - cx) - math.atan2(self.y - cy, self.x - cx))
+        sweep = min(sweep, 2 * math.pi - sweep)
+        e = self._extrusion(radius * sweep)
+        command = "G2" if clockwise else "G3"
+        self.lines.append(f"{command} X{x:.3f} Y{y:.3f} I{cx - self.x:.3f} J{cy - self.y:.3f} E{e:.5f}{self.comment()}")
+        self.x, self.y = x, y
+
+    def retract(self):
+        if self.relative_e:
+            self.lines.append("G1 E-0.8 F2100")
+            self.lines.append("G1 E0.8 F2100")
+        else:
+            self.lines.append(f"G1 E{self.e - 0.8:.5f} F2100")
+            self.lines.append(f"G1 E{self.e:.5f} F2100")
+
+
+def _header(flavor):
+    if flavor == "prusa":
+        return ["; generated by PrusaSlicer (synthetic)", "M83 ; use relative distances for extrusion",
+                "G21", "G90", "G28", "G1 Z0.2 F7800"]
+    if flavor == "cura":
+        return [";FLAVOR:Marlin", ";Generated with Cura (synthetic)", "M82 ;absolute extrusion mode",
+                "G21", "G90", "G28", "G92 E0"]
+    if flavor == "simplify3d":
+        return ["; G-Code generated by Simplify3D(R) (synthetic)", "G90", "M82", "G21", "G28", "G92 E0"]
+    return ["G21", "G90", "M82", "G28", "G92 E0"]
+
+
+def _layer_header(writer, layer, z):
+    flavor = writer.flavor
+    if flavor == "prusa":
+        writer.lines += [";LAYER_CHANGE", f";Z:{z:.2f}", f";HEIGHT:{LAYER_HEIGHT:.2f}"]
+    elif flavor == "cura":
+        writer.lines.append(f";LAYER:{layer}")
+        writer.lines.append("G92 E0")
+        writer.e = 0.0
+    elif flavor == "simplify3d":
+        writer.lines.append(f"; layer {layer + 1}, Z = {z:.3f}")
+        writer.lines.append("G92 E0")
+        writer.e = 0.0
+    writer.retract()
+    writer.lines.append(f"G1 Z{z:.3f} F7800")
+
+
+def _type(writer, name):
+    if writer.flavor == "prusa":
+        writer.lines.append(f";TYPE:{name}")
+    elif writer.flavor == "cura":
+        writer.lines.append(f";TYPE:{name.upper().replace(' ', '-')}")
+    elif writer.flavor == "simplify3d":
+        writer.lines.append(f"; feature {name.lower()}")
+
+
+def _layer(writer, layer, segments, arcs):
+    """Write one layer with about segments extruding moves, arcs being that fraction of the perimeter moves."""
+    z = LAYER_HEIGHT * (layer + 1)
+    _layer_header(writer, layer, z)
+
+    rng = writer.rng
+    cx, cy = BED_CENTER
+    radius = 30 + 10 * math.sin(layer / 7)
+
+    # Half the budget on the perimeter, half on the infill
+    perimeter = max(4, segments // 2)
+    infill = max(2, segments - perimeter)
+
+    _type(writer, "External perimeter")
+    writer.travel(cx + radius, cy)
+    step = 2 * math.pi / perimeter
+    for k in range(1, perimeter + 1):
+        angle = k * step
+        x, y = cx + radius * math.cos(angle), cy + radius * math.sin(angle)
+        if arcs and rng.random() < arcs:
+            writer.arc(x, y, cx, cy, clockwise=False)
+        else:
+            writer.extrude(x, y)
+
+    _type(writer, "Solid infill")
+    rows = max(1, infill // 2)
+    half = radius * 0.7
+    spacing = 2 * half / rows
+    writer.travel(cx - half, cy - half)
+    for row in range(rows):
+        y = cy - half + row * spacing
+        jitter = rng.uniform(-0.05, 0.05)
+        if row % 2 == 0:
+            writer.extrude(cx + half + jitter, y)
+        else:
+            writer.extrude(cx - half + jitter, y)
+        writer.extrude(writer.x, y + spacing)
+
+
+def generate_lines(flavor="generic", layers=50, segments=200, arcs=0.0, comments=0.0, seed=0):
+    """Lines of a synthetic G-code file, see the module docstring for the arguments."""
+    if flavor not in FLAVORS:
+        raise ValueError(f"Unknown flavor {flavor}, expected one of {', '.join(FLAVORS)}")
+    writer = _Writer(flavor, random.Random(seed), comments)
+    writer.lines += _header(flavor)
+    for layer in range(layers):
+        _layer(writer, layer, segments, arcs)
+    writer.lines += ["M107", "G1 Z{:.3f} F600".format(LAYER_HEIGHT * layers + 10), "M84"]
+    return writer.lines
+
+
+def generate(path, flavor="generic", layers=50, segments=200, arcs=0.0, comments=0.0, size=None, seed=0):
+    """
+    Write a synthetic G-code file and return its path.
+
+    When size is given (in bytes), the layer count is chosen so the file is about that size
+    and layers is ignored.
+    """
+    if size is not None:
+        sample = "\n".join(generate_lines(flavor, 2, segments, arcs, comments, seed)) + "\n"
+        header = "\n".join(generate_lines(flavor, 0, segments, arcs, comments, seed)) + "\n"
+        per_layer = max(1, (len(sample) - len(header)) / 2)
+        layers = max(1, round((size - len(header)) / per_layer))
+
+    with open(path, "w") as outfile:
+        outfile.write("\n".join(generate_lines(flavor, layers, segments, arcs, comments, seed)))
+        outfile.write("\n")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic synthetic G-code generator")
+    parser.add_argument("output")
+    parser.add_argument("--flavor", choices=FLAVORS, default="generic")
+    parser.add_argument("--layers", type=int, default=50)
+    parser.add_argument("--segments", type=int, default=200, help="Extruding moves per layer")
+    parser.add_argument("--arcs", type=float, default=0.0, help="Fraction of perimeter moves written as G2/G3")
+    parser.add_argument("--comments", type=float, default=0.0, help="Fraction of moves with a trailing comment")
+    parser.add_argument("--size", type=int, help="Approximate file size in bytes, overrides --layers")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.output, args.flavor, args.layers, args.segments, args.arcs, args.comments, args.size, args.seed)
+
+
+if __name__ == "__main__":
+    main()
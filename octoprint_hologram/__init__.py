@@ -1,19 +1,26 @@
 import base64
+import gzip
 import io
 import math
 import os
-import matplotlib; matplotlib.use('Agg')
+import threading
 import numpy as np
 from io import BytesIO
-from matplotlib import pyplot as plt
 from octoprint.events import Events
-import requests
-from PIL import Image, ImageDraw
 import flask
 import octoprint.plugin
-from scipy.spatial import ConvexHull
 
-from octoprint_hologram import utils, gcode_reader
+# Rendering, calibration and image dependencies (matplotlib, scipy, scikit-image, PIL, requests)
+# are imported on first use so they do not slow down OctoPrint startup
+
+from octoprint_hologram import utils, gcode_reader, monitor, render, sprite_atlas, timeseries, toolpath_store
+from octoprint_hologram.metrics import REGISTRY as metrics
+
+# Bounds of the (elevation, azimuth, roll, focal length, scale) calibration values
+SLIDER_LIMITS = [(-360, 360), (-360, 360), (-179, 179), (0.075, 1), (0.1, 5)]
+
+# Largest number of candidate views rendered by one render_views request
+MAX_PREVIEW_VIEWS = 64
 
 class HologramPlugin(octoprint.plugin.StartupPlugin,
                      octoprint.plugin.SettingsPlugin,
@@ -22,15 +29,25 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
                      octoprint.plugin.SimpleApiPlugin,
                      octoprint.plugin.ProgressPlugin,
                      octoprint.plugin.EventHandlerPlugin,
-                     octoprint.plugin.BlueprintPlugin):
+                     octoprint.plugin.BlueprintPlugin,
+                     octoprint.plugin.ShutdownPlugin):
     """
     An OctoPrint plugin to enhance 3D printing with holographic projections.
     """
     
     def __init__(self):
-        self.max_height = 0
-        self.max_layer = 0
-        self.gcode_path = ""
+        self.gcode_path = ""  # Storage path of the selected file
+        self._render_pool = None
+        self._reader_cache = None  # ((path, mtime), GcodeReader)
+        self._reader_lock = threading.Lock()
+        self._toolpaths = None  # SharedToolpaths, when shared_toolpaths is enabled
+        self._atlas = None  # SpriteAtlas, when atlas_enabled is enabled
+        self._toolpath_buffer_cache = None  # ((path, mtime, tolerance), gzipped toolpath_buffer)
+        self._monitor = None
+        self._monitor_store = None
+        self._monitor_gcode_path = None
+        self._monitor_baseline = None
+        self._monitor_layer_z = None
 
     def get_settings_defaults(self):
         """Define default settings for the plugin."""
@@ -40,13 +57,63 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
             "colorHex": "white",
             "printerLength": 0,
             "printerWidth": 0,
-            "printerDepth": 0
+            "printerDepth": 0,
+            "monitor_enabled": True,
+            "monitor_interval": 30,  # Seconds between comparisons
+            "monitor_downscale": 0.25,  # Downscale factor applied to the ROI before comparison
+            "monitor_cpu_budget": 0.1,  # Fraction of wall time the monitor may spend working
+            "monitor_history": 4096,  # Number of records kept per print job
+            "render_workers": 1,  # Renders running at the same time
+            "render_queue_limit": 2,  # Renders allowed to wait before requests are rejected with 503
+            "shared_toolpaths": False,  # Keep parsed toolpaths in memory-mapped files shared by all renderers
+            "parse_workers": 1,  # Processes parsing a large G-code file, 1 parses it in the plugin process
+            "atlas_enabled": False,  # Pre-render overlays of uploaded files for the calibrated camera
+            "atlas_layer_stride": 10,  # Layers between two pre-rendered overlays
+            "atlas_max_mb": 256,  # Disk space of the pre-rendered overlays, least recently used ones are removed
+            "metrics_log": False  # Also log every pipeline stage duration, see the /metrics route
         }
 
     def on_after_startup(self):
         """Log startup message."""
         self._logger.info("Hologram plugin started!")
         self._storage_interface = self._file_manager._storage("local")
+        self._render_pool = render.RenderPool(workers=int(self._settings.get(["render_workers"])),
+                                              max_queue=int(self._settings.get(["render_queue_limit"])))
+        self._monitor = monitor.PrintMonitor(self._monitor_snapshot, self._monitor_reference, logger=self._logger)
+
+        if self._settings.get_boolean(["shared_toolpaths"]):
+            self._toolpaths = toolpath_store.SharedToolpaths(os.path.join(self.get_plugin_data_folder(), "toolpaths"),
+                                                             workers=int(self._settings.get(["parse_workers"])))
+            # Leftovers of a previous run that did not shut down cleanly
+            self._toolpaths.clear()
+
+        if self._settings.get_boolean(["atlas_enabled"]):
+            self._atlas = sprite_atlas.SpriteAtlas(os.path.join(self.get_plugin_data_folder(), "atlas"),
+                                                   stride=int(self._settings.get(["atlas_layer_stride"])),
+                                                   max_bytes=int(self._settings.get(["atlas_max_mb"])) << 20,
+                                                   logger=self._logger)
+
+        if self._settings.get_boolean(["metrics_log"]):
+            metrics.logger = self._logger
+        metrics.gauge("queue_depth", lambda: self._render_pool.pending, queue="render")
+        metrics.gauge("queue_depth", lambda: self._atlas.pending if self._atlas is not None else None, queue="atlas")
+
+        # Keep showing the chart of the last monitored print after a restart
+        latest = timeseries.latest_buffer_path(self._monitor_folder())
+        if latest is not None:
+            try:
+                self._monitor_store = timeseries.MetricRingBuffer(latest, capacity=int(self._settings.get(["monitor_history"])))
+            except Exception as e:
+                self._logger.error(f"Failed to open monitoring history: {e}")
+
+    def on_shutdown(self):
+        self._stop_monitor()
+        if self._render_pool is not None:
+            self._render_pool.shutdown()
+        if self._atlas is not None:
+            self._atlas.stop()
+        if self._toolpaths is not None:
+            self._toolpaths.clear()
 
     def get_template_configs(self):
         """Define plugin template configurations."""
@@ -64,6 +131,18 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
         if event == Events.FILE_SELECTED:
             # self._logger.info("File Selected: {}".format(payload["path"]))
             self.gcode_path = payload["path"]
+            self._toolpath_buffer_cache = None
+            self._release_toolpaths()
+            self._schedule_atlas(payload["path"])
+        elif event == Events.UPLOAD:
+            if payload.get("target") == "local":
+                self._schedule_atlas(payload.get("path"))
+        elif event == Events.PRINT_STARTED:
+            self._start_monitor(payload)
+        elif event in (Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED):
+            self._stop_monitor()
+        elif event == Events.Z_CHANGE:
+            self._update_monitor_layer(payload.get("new"))
 
     def get_api_commands(self):
         """Define API commands the plugin responds to."""
@@ -73,7 +152,10 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
             'fetchRender': ['gcodeFilePath'],  # Expects the path to the G-code file
             'update_printer_dimensions': ['printerLength', 'printerWidth', 'printerDepth'],  # Printer dimensions
             'update_image': ['value1', 'value2', 'value3', 'value4', 'value5'],
-            'save_off_set': ['value1', 'value2', 'value3', 'value4', 'value5']
+            'save_off_set': ['value1', 'value2', 'value3', 'value4', 'value5'],
+            'get_stats': [],  # Statistics of the selected G-code file
+            'render_views': ['views'],  # Expects a list of (elev, azim, roll, focal, scale) tuples
+            'get_projection': []  # Optional value1 to value5 offsets, like update_image
         }
     
     def on_api_command(self, command, data):
@@ -81,6 +163,11 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
         
         # self._logger.info(f"Command: {command} Data: {data}")
         
+        # OctoPrint only calls this for the commands of get_api_commands, so labels stay bounded
+        with metrics.timer("request_seconds", command=command):
+            return self._dispatch_api_command(command, data)
+
+    def _dispatch_api_command(self, command, data):
         if command == "get_snapshot":
             return self.handle_get_snapshot()
         elif command == "update_printer_dimensions":
@@ -93,6 +180,12 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
             return self.save_off_set(data)
         elif command == "fetchRender":
             return self.fetch_render(data)
+        elif command == "get_stats":
+            return self.get_stats()
+        elif command == "render_views":
+            return self.render_views(data)
+        elif command == "get_projection":
+            return self.get_projection(data)
         else:
             self._logger.error(f"Unknown command: {command}")
             return flask.jsonify({"error": "Unknown command"}), 400
@@ -103,7 +196,8 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
             if image_data is None:
                 raise Exception("No image data returned.")
 
-            encoded_string = base64.b64encode(image_data).decode('utf-8')
+            with metrics.stage("base64"):
+                encoded_string = base64.b64encode(image_data).decode('utf-8')
             return flask.jsonify(image_data=f"data:image/jpeg;base64,{encoded_string}")
         except Exception as e:
             self._logger.error(f"Failed to encode image: {e}")
@@ -134,7 +228,8 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
         
         self._plugin_manager.send_plugin_message(self._identifier, "Optimizing parameters may take a few minutes. An alert will be sent when complete.")
         
-        elevation, azimuth, roll, focal_length, scale = utils.optimize_projection(converted_points, printer_dims)
+        with metrics.stage("calibration"):
+            elevation, azimuth, roll, focal_length, scale = utils.optimize_projection(converted_points, printer_dims)
         
         values = [float(elevation), float(azimuth), float(roll), float(focal_length), float(scale)]
         
@@ -145,8 +240,9 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
 
     def update_image(self, data):
         """Update the image based on given slider values."""
+        from PIL import Image
         
-        limits = [(-360, 360), (-360, 360), (-179, 179), (0.075, 1), (0.1, 5)]
+        limits = SLIDER_LIMITS
 
         # Retrieve current slider values
         current_values = self._settings.get(["slider_values"])
@@ -154,13 +250,11 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
         # Calculate new slider values by adding offsets from the data and clipping them within individual limits
         values = [max(limits[i][0], min(limits[i][1], current_values[i] + float(data.get(f'value{i+1}', 0)))) for i in range(5)]
 
-        # Assuming plot_arrow generates an image based on the printer dimensions and slider values
-        printer_dims = [0, int(self._settings.get(["printerLength"])),
-                        0, int(self._settings.get(["printerWidth"])),
-                        0, int(self._settings.get(["printerDepth"]))]
-        
-        # Generate an arrow image based on the current settings (this function must be implemented)
-        arrow_img, pixel_coords = utils.plot_arrow(printer_dims, *values[:4])
+        # Generate an arrow image based on the printer dimensions and the new slider values
+        try:
+            arrow_img, pixel_coords = self._render_pool.run(render.render_arrow, self._render_settings(values))
+        except render.RenderPoolBusy:
+            return flask.make_response("Renderer is busy, please try again", 503)
 
         # Fetch base snapshot for overlay
         data_folder = self.get_plugin_data_folder()  # Replace with the actual method to get the data folder
@@ -171,25 +265,29 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
         
         base_anchor = utils.center_of_quadrilateral(converted_points)
         
-        snapshot_img = Image.open(snapshot_path).convert("RGBA")
+        with metrics.stage("snapshot_decode"):
+            snapshot_img = Image.open(snapshot_path).convert("RGBA")
         
-        result_image = utils.overlay_images(snapshot_img, arrow_img, base_anchor, pixel_coords, scale=(values[4]))
+        with metrics.stage("overlay"):
+            result_image = utils.overlay_images(snapshot_img, arrow_img, base_anchor, pixel_coords)
 
-        rgb_image = Image.new("RGB", result_image.size)
+        with metrics.stage("jpeg_encode"):
+            rgb_image = Image.new("RGB", result_image.size)
 
-        rgb_image.paste(result_image, mask=result_image.split()[3])
-        result_image = rgb_image
+            rgb_image.paste(result_image, mask=result_image.split()[3])
+            result_image = rgb_image
         
-        img_byte_arr = BytesIO()
-        result_image.save(img_byte_arr, format='JPEG')
-        img_byte_arr = img_byte_arr.getvalue()
+            img_byte_arr = BytesIO()
+            result_image.save(img_byte_arr, format='JPEG')
+            img_byte_arr = img_byte_arr.getvalue()
         
-        encoded_string = base64.b64encode(img_byte_arr).decode('utf-8')
+        with metrics.stage("base64"):
+            encoded_string = base64.b64encode(img_byte_arr).decode('utf-8')
 
         return flask.jsonify(image_data=f"data:image/jpeg;base64,{encoded_string}")
     
     def save_off_set(self, data):        
-        limits = [(-360, 360), (-360, 360), (-179, 179), (0.075, 1), (0.1, 5)]
+        limits = SLIDER_LIMITS
 
         # Retrieve current slider values
         current_values = self._settings.get(["slider_values"])
@@ -203,20 +301,21 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
     
     def fetch_render(self, data):
         """Render a visualization from a G-code file and overlay it onto the snapshot."""
+        from PIL import Image
         gcode_path = data.get("gcodeFilePath", "")
         
         gcode_path = self.gcode_path
         
-        if not gcode_path.endswith('.gcode'):
+        if not gcode_path.endswith(gcode_reader.GCODE_SUFFIXES):
             return flask.make_response("Failed to locate file", 500)
         
-        if not self._storage_interface.file_exists(gcode_path):
+        gcode_path = self._resolve_gcode_path(gcode_path)
+        if gcode_path is None:
             return flask.make_response("Failed to locate file", 400)
         
-        gcode_path = self._storage_interface.path_on_disk(gcode_path)
-        
-        self.gcode_path = gcode_path
-        
+        # Settings are read once so a concurrent calibration change cannot mix into this render
+        settings = self._render_settings()
+
         # Fetch base snapshot for overlay        
         image_data = self._take_snapshot(save=False)
 
@@ -224,7 +323,8 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
         image_data_io = BytesIO(image_data)
 
         # Now, you can use this file-like object with PIL as if it was a file
-        snapshot_path = Image.open(image_data_io).convert("RGBA")
+        with metrics.stage("snapshot_decode"):
+            snapshot_path = Image.open(image_data_io).convert("RGBA")
 
         # Load G-code and generate a plot
         p = self._settings.get(["pixels"])
@@ -232,36 +332,191 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
         # Convert pixel information to coordinate pairs
         converted_points = [(point['x'], point['y']) for point in p]
         
-        v = self._settings.get(["slider_values"])
-        v = [float(val) for val in v]
-        
         # Calculate the center point for the overlay
         base_anchor = utils.center_of_quadrilateral(converted_points)
         
-        overlay_img, pixel_coords = self._create_render(layer=-1)
+        sprite = self._atlas_lookup(gcode_path, settings)
+        if sprite is not None:
+            overlay_img, pixel_coords = sprite[0], sprite[1]
+        else:
+            try:
+                overlay_img, pixel_coords, _ = self._render_pool.run(render.render_toolpath, self._get_reader(gcode_path), settings)
+            except render.RenderPoolBusy:
+                return flask.make_response("Renderer is busy, please try again", 503)
 
-        result_image = utils.overlay_images(snapshot_path, overlay_img, base_anchor, pixel_coords, scale=(v[4]))
+        with metrics.stage("overlay"):
+            result_image = utils.overlay_images(snapshot_path, overlay_img, base_anchor, pixel_coords)
         
-        rgb_image = Image.new("RGB", result_image.size)
+        with metrics.stage("jpeg_encode"):
+            rgb_image = Image.new("RGB", result_image.size)
 
-        rgb_image.paste(result_image, mask=result_image.split()[3])
-        result_image = rgb_image
+            rgb_image.paste(result_image, mask=result_image.split()[3])
+            result_image = rgb_image
         
-        img_byte_arr = BytesIO()
-        result_image.save(img_byte_arr, format='JPEG')
-        img_byte_arr = img_byte_arr.getvalue()
+            img_byte_arr = BytesIO()
+            result_image.save(img_byte_arr, format='JPEG')
+            img_byte_arr = img_byte_arr.getvalue()
         
         try:
-            encoded_string = base64.b64encode(img_byte_arr).decode('utf-8')
+            with metrics.stage("base64"):
+                encoded_string = base64.b64encode(img_byte_arr).decode('utf-8')
             return flask.jsonify(image_data=f"data:image/jpeg;base64,{encoded_string}")
         except Exception as e:
             self._logger.error(f"Failed to encode image: {e}")
             return flask.make_response("Failed to process image", 500)
 
+    def get_stats(self):
+        """Return the toolpath statistics of the selected G-code file."""
+        gcode_path = self._resolve_gcode_path(self.gcode_path)
+        if gcode_path is None:
+            return flask.make_response("Failed to locate file", 400)
+
+        try:
+            stats = self._get_reader(gcode_path).stats
+        except Exception as e:
+            self._logger.error(f"Failed to read G-code file: {e}")
+            return flask.make_response("Failed to read file", 500)
+        return flask.jsonify(stats)
+
+    def render_views(self, data):
+        """
+        Preview several candidate calibrations in one request.
+
+        Expects "views", a list of (elev, azim, roll, focal, scale) tuples, taken as offsets from the
+        saved slider values when "relative" is true. The toolpath of the selected job (or only the bed
+        outline when no job is selected) is drawn onto thumbnails of the calibration snapshot, returned
+        as one contact sheet or, with "layout": "thumbnails", as a list of images.
+        """
+        from PIL import Image
+
+        try:
+            views = [tuple(float(value) for value in view) for view in data.get("views", [])]
+        except (TypeError, ValueError):
+            return flask.make_response("Views must be lists of numbers", 400)
+        if not views or len(views) > MAX_PREVIEW_VIEWS or any(len(view) != 5 for view in views):
+            return flask.make_response(f"Expected 1 to {MAX_PREVIEW_VIEWS} views of 5 values", 400)
+        try:
+            thumbnail_width = int(data.get("thumbnailWidth", 240))
+            columns = int(data.get("columns") or math.ceil(math.sqrt(len(views))))
+        except (TypeError, ValueError):
+            return flask.make_response("Thumbnail width and columns must be integers", 400)
+        if columns < 1:
+            return flask.make_response("Columns must be at least 1", 400)
+        # Empty columns would only widen the sheet
+        columns = min(columns, len(views))
+
+        points = self._settings.get(["pixels"])
+        if len(points) != 4:
+            return flask.make_response("Lock in the plate area first", 400)
+
+        current_values = self._settings.get(["slider_values"])
+        if data.get("relative", False):
+            views = [tuple(current_values[i] + view[i] for i in range(5)) for view in views]
+        views = [tuple(max(SLIDER_LIMITS[i][0], min(SLIDER_LIMITS[i][1], view[i])) for i in range(5)) for view in views]
+
+        snapshot_path = os.path.join(self.get_plugin_data_folder(), 'snapshot.jpg')
+        if not os.path.exists(snapshot_path):
+            return flask.make_response("Take a snapshot first", 400)
+        snapshot_img = Image.open(snapshot_path)
+
+        thumbnail_width = max(32, min(thumbnail_width, snapshot_img.width))
+        factor = thumbnail_width / snapshot_img.width
+        base_image = snapshot_img.convert("RGB").resize(
+            (thumbnail_width, max(1, round(snapshot_img.height * factor))), Image.Resampling.BOX)
+
+        base_anchor = utils.center_of_quadrilateral([(point['x'], point['y']) for point in points])
+
+        gcode_path = self._resolve_gcode_path(self.gcode_path)
+        try:
+            reader = self._get_reader(gcode_path) if gcode_path is not None else None
+        except Exception as e:
+            self._logger.error(f"Failed to read G-code file: {e}")
+            return flask.make_response("Failed to read file", 500)
+
+        # Split the views over the render workers
+        settings = self._render_settings()
+        chunks = [list(chunk) for chunk in np.array_split(np.arange(len(views)), min(self._render_pool.workers, len(views)))]
+        futures = []
+        try:
+            for chunk in chunks:
+                futures.append(self._render_pool.submit(
+                    render.render_views, reader, settings, [views[i] for i in chunk], base_image, base_anchor, factor))
+        except render.RenderPoolBusy:
+            for future in futures:
+                future.cancel()
+            return flask.make_response("Renderer is busy, please try again", 503)
+        thumbnails = [thumbnail for future in futures for thumbnail in future.result()]
+
+        def encode(image):
+            image_bytes = BytesIO()
+            with metrics.stage("jpeg_encode"):
+                image.save(image_bytes, format='JPEG')
+            return "data:image/jpeg;base64," + base64.b64encode(image_bytes.getvalue()).decode('utf-8')
+
+        if data.get("layout") == "thumbnails":
+            return flask.jsonify(thumbnails=[encode(thumbnail) for thumbnail in thumbnails], views=views)
+
+        sheet = utils.contact_sheet(thumbnails, columns=columns, labels=[str(i + 1) for i in range(len(thumbnails))])
+        return flask.jsonify(image_data=encode(sheet), views=views, columns=columns)
+
+    def get_projection(self, data):
+        """
+        Camera of the calibration for drawing the toolpath in the browser.
+
+        Slider values are the saved ones plus the optional value1 to value5 offsets, as in update_image.
+        Returns the 3x4 matrix taking bed coordinates (x, y, z, 1) to homogeneous pixels of the snapshot,
+        the overlay being pasted at the bed center of the calibration points like fetch_render does,
+        along with the millimetres per pixel the toolpath should be simplified to and the snapshot size
+        the browser sizes its canvas to.
+        """
+        from PIL import Image
+
+        points = self._settings.get(["pixels"])
+        if len(points) != 4:
+            return flask.make_response("Lock in the plate area first", 400)
+
+        current_values = self._settings.get(["slider_values"])
+        try:
+            values = [max(SLIDER_LIMITS[i][0], min(SLIDER_LIMITS[i][1], current_values[i] + float(data.get(f'value{i+1}', 0))))
+                      for i in range(5)]
+        except (TypeError, ValueError):
+            return flask.make_response("Offsets must be numbers", 400)
+
+        snapshot_path = os.path.join(self.get_plugin_data_folder(), 'snapshot.jpg')
+        if not os.path.exists(snapshot_path):
+            return flask.make_response("Take a snapshot first", 400)
+        # Only the header is read
+        with Image.open(snapshot_path) as snapshot_img:
+            snapshot_size = snapshot_img.size
+
+        # Computed on the request thread, the render pool is left to the server renders
+        matrix, pixel_coords, mm_per_pixel = render.camera_projection(self._render_settings(values))
+
+        base_anchor = utils.center_of_quadrilateral([(point['x'], point['y']) for point in points])
+        paste_x, paste_y = utils.paste_offset(base_anchor, pixel_coords)
+        translation = np.array([[1.0, 0.0, paste_x], [0.0, 1.0, paste_y], [0.0, 0.0, 1.0]])
+
+        return flask.jsonify(matrix=(translation @ matrix).tolist(), mm_per_pixel=float(mm_per_pixel),
+                             snapshot_size=list(snapshot_size), slider_values=values,
+                             color=self._settings.get(["colorHex"]))
+
+    def _resolve_gcode_path(self, gcode_path):
+        """Map a path in local storage (or already on disk) to a path on disk, None if it does not exist."""
+        if not gcode_path:
+            return None
+        if self._storage_interface.file_exists(gcode_path):
+            return self._storage_interface.path_on_disk(gcode_path)
+        if os.path.isabs(gcode_path) and os.path.exists(gcode_path):
+            return gcode_path
+        return None
+
     def _take_snapshot(self, save=False):
+        import requests
+
         snapshot_url = self._settings.global_get(["webcam", "snapshot"])
         try:
-            response = requests.get(snapshot_url, timeout=10)
+            with metrics.stage("snapshot_fetch"):
+                response = requests.get(snapshot_url, timeout=10)
             response.raise_for_status()
 
             if save:
@@ -276,60 +531,231 @@ class HologramPlugin(octoprint.plugin.StartupPlugin,
             self._logger.error(f"Failed to fetch snapshot: {e}")
             raise Exception(f"Failed to fetch snapshot due to request exception: {e}")
     
-    def _create_render(self, layer=-1):
-        gcode_R = gcode_reader.GcodeReader(self.gcode_path)
-
-        # Inject the getter functions directly into GcodeReader class
-        gcode_reader.GcodeReader.get_layer = lambda self: self.n_layers + 1
-        gcode_reader.GcodeReader.get_limits = lambda self: self.xyzlimits
-        
-        _, _, _, _, _, self.max_height = gcode_R.get_limits()
-        self.max_layer = gcode_R.get_layer()
-
-        if layer == -1 or layer > self.max_layer:
-            layer = self.max_layer
-
-        color = self._settings.get(["colorHex"])
-        fig, ax = gcode_R.plot_layers(min_layer=1, max_layer=layer, color=color)
-
-        v = [float(val) for val in self._settings.get(["slider_values"])]
+    def _get_reader(self, gcode_path):
+        """Return a parsed GcodeReader for a file on disk, reusing the last one if the file is unchanged."""
+        key = (gcode_path, os.path.getmtime(gcode_path))
+        with self._reader_lock:
+            hit = self._reader_cache is not None and self._reader_cache[0] == key
+            metrics.cache("reader", hit)
+            if not hit:
+                self._reader_cache = (key, self._load_reader(gcode_path))
+            return self._reader_cache[1]
+
+    def _load_reader(self, gcode_path):
+        """Parse a file on disk, or attach to its shared toolpath when shared_toolpaths is enabled."""
+        with metrics.stage("parse"):
+            if self._toolpaths is not None:
+                return self._toolpaths.get(gcode_path)
+            return gcode_reader.GcodeReader(gcode_path, workers=int(self._settings.get(["parse_workers"])))
+
+    def _schedule_atlas(self, storage_path):
+        """Pre-render the overlays of a file in the background once the camera is calibrated."""
+        if self._atlas is None or len(self._settings.get(["pixels"])) != 4:
+            return
+        gcode_path = self._resolve_gcode_path(storage_path)
+        if gcode_path is None or not gcode_path.endswith(gcode_reader.GCODE_SUFFIXES):
+            return
+        try:
+            # The atlas worker parses its own copy, the reader cache keeps serving the selected file
+            self._atlas.schedule(gcode_path, self._render_settings(), self._load_reader)
+        except Exception as e:
+            self._logger.error(f"Failed to schedule sprite atlas: {e}")
 
-        # Set axis limits and view
-        printer_length = int(self._settings.get(["printerLength"]))
-        printer_width = int(self._settings.get(["printerWidth"]))
-        printer_depth = int(self._settings.get(["printerDepth"]))
+    def _atlas_lookup(self, gcode_path, settings, layer=-1):
+        """Pre-rendered overlay of layers [1, layer) for settings (see SpriteAtlas.lookup), or None."""
+        if self._atlas is None:
+            return None
+        try:
+            sprite = self._atlas.lookup(gcode_path, settings, layer)
+        except Exception as e:
+            self._logger.error(f"Failed to read sprite atlas: {e}")
+            sprite = None
+        metrics.cache("atlas", sprite is not None)
+        return sprite
+
+    def _release_toolpaths(self):
+        """Remove the shared toolpaths of every file except the selected one and the one being monitored."""
+        if self._toolpaths is None:
+            return
+        try:
+            self._toolpaths.retain([self._resolve_gcode_path(self.gcode_path), self._monitor_gcode_path])
+        except Exception as e:
+            self._logger.error(f"Failed to release shared toolpaths: {e}")
+
+    def _render_settings(self, slider_values=None):
+        """Copy the settings a render depends on."""
+        if slider_values is None:
+            slider_values = self._settings.get(["slider_values"])
+        return render.RenderSettings(
+            printer_dims=(int(self._settings.get(["printerLength"])),
+                          int(self._settings.get(["printerWidth"])),
+                          int(self._settings.get(["printerDepth"]))),
+            slider_values=tuple(float(val) for val in slider_values),
+            color=self._settings.get(["colorHex"]))
+
+    def _start_monitor(self, payload):
+        """Start the print deviation monitor for a print of a local file."""
+        if self._monitor is None or not self._settings.get_boolean(["monitor_enabled"]):
+            return
+        if payload.get("origin") != "local" or len(self._settings.get(["pixels"])) != 4:
+            return
 
-        max_range = max(printer_length, printer_width, printer_depth)
-        ax.set_box_aspect([printer_length / max_range, printer_width / max_range, printer_depth / max_range])
+        try:
+            gcode_path = self._storage_interface.path_on_disk(payload["path"])
+            reader = self._get_reader(gcode_path)
 
-        ax.set_xlim(0, printer_length)
-        ax.set_ylim(0, printer_width)
-        ax.set_zlim(0, printer_depth)
-        
-        
-        ax.set_proj_type(proj_type='persp', focal_length=v[3])
-        ax.view_init(elev=v[0], azim=v[1], roll=v[2])
-        
-        ax.set_axis_off()
-        
-        fig.set_size_inches(6.4, 4.8)
-        
-        pixel_coords = utils.get_pixel_coords(ax, printer_length / 2, printer_width / 2, 0)
+            # Z height of the first segment of each layer, used to map Z changes to layers
+            self._monitor_layer_z = reader.segs[reader.seg_index_bars[:-1], 4]
+            self._monitor_gcode_path = gcode_path
 
-        if layer != self.max_layer:  # Skip masking for the maximum layer
-            # self._logger.info("Applying mask for extruder points")
-            self.apply_mask(ax, fig, layer)
+            # Frame of the bed at print start, the expected renders are composited onto it
+            from PIL import Image
+            self._monitor_baseline = Image.open(BytesIO(self._take_snapshot(save=False))).convert("RGBA")
+        except Exception as e:
+            self._logger.error(f"Failed to start print monitor: {e}")
+            return
+
+        self._monitor.interval = float(self._settings.get(["monitor_interval"]))
+        self._monitor.downscale = float(self._settings.get(["monitor_downscale"]))
+        self._monitor.cpu_budget = float(self._settings.get(["monitor_cpu_budget"]))
+
+        # One ring buffer per job, cleared when the job is printed again
+        self._monitor_store = timeseries.MetricRingBuffer(
+            timeseries.job_buffer_path(self._monitor_folder(), gcode_path),
+            capacity=int(self._settings.get(["monitor_history"])))
+        self._monitor_store.clear()
+        self._monitor.start(self._monitor_store)
+
+    def _monitor_folder(self):
+        return os.path.join(self.get_plugin_data_folder(), "monitoring")
+
+    def _stop_monitor(self):
+        if self._monitor is not None:
+            self._monitor.stop()
+
+    def _update_monitor_layer(self, z):
+        if self._monitor is None or not self._monitor.running or z is None or self._monitor_layer_z is None:
+            return
+        # Number of layers starting at or below the current Z, with a margin for layer heights
+        # read back from float32 toolpath stores
+        layer = int(np.searchsorted(self._monitor_layer_z, float(z) + 1e-3, side="right"))
+        self._monitor.set_layer(layer)
+
+    def _monitor_snapshot(self):
+        from PIL import Image
+        return Image.open(BytesIO(self._take_snapshot(save=False))).convert("RGB")
+
+    def _monitor_reference(self, layer):
+        """Expected frame after the layers below the current one are printed, with its ROI in frame coordinates."""
+        if layer <= 1:
+            return None
+
+        settings = self._render_settings()
+        converted_points = [(point['x'], point['y']) for point in self._settings.get(["pixels"])]
+        base_anchor = utils.center_of_quadrilateral(converted_points)
 
-        overlay_img = io.BytesIO()
-        fig.savefig(overlay_img, format='png', transparent=True)
-        plt.close()
-        
-        overlay_img.seek(0)
-        
-        self.roi_coords = utils.find_non_transparent_roi(overlay_img)
+        # The closest pre-rendered layer bound when the job has an atlas, a render otherwise
+        sprite = self._atlas_lookup(self._monitor_gcode_path, settings, layer)
+        if sprite is not None:
+            overlay_img, pixel_coords, roi_coords, _ = sprite
+        else:
+            # Raises RenderPoolBusy when the UI is rendering, the monitor then retries on its next tick
+            overlay_img, pixel_coords, roi_coords = self._render_pool.run(
+                render.render_toolpath, self._get_reader(self._monitor_gcode_path), settings, layer)
+
+        expected = utils.overlay_images(self._monitor_baseline, overlay_img, base_anchor, pixel_coords)
+        roi = utils.roi_on_base(roi_coords, base_anchor, pixel_coords, expected.size)
+        if roi is None:
+            return None
+        return expected, roi
+
+    @octoprint.plugin.BlueprintPlugin.route("/ssim_chart", methods=["GET"])
+    def ssim_chart(self):
+        """Serve a PNG chart of the SSIM scores recorded by the print monitor."""
+        from matplotlib.figure import Figure
+
+        records = self._monitor_store.query(max_points=300) if self._monitor_store is not None else []
+
+        fig = Figure(figsize=(6.4, 3.2))
+        ax = fig.add_subplot(111)
+        if len(records):
+            ax.plot((records["timestamp"] - records["timestamp"][0]) / 60, records["ssim"], color='tab:blue')
+        else:
+            ax.text(0.5, 0.5, "No data", ha='center', va='center', transform=ax.transAxes)
+        ax.set_ylim(-1, 1)
+        ax.set_xlabel("Minutes")
+        ax.set_ylabel("SSIM")
+        fig.tight_layout()
+
+        chart = BytesIO()
+        fig.savefig(chart, format='png')
+        chart.seek(0)
+        return flask.send_file(chart, mimetype='image/png')
+
+    @octoprint.plugin.BlueprintPlugin.route("/toolpath", methods=["GET"])
+    def toolpath(self):
+        """
+        Serve the simplified toolpath of the selected job as a binary buffer (see render.toolpath_buffer).
+
+        The optional "tolerance" query argument is the simplification in millimetres, browsers pass
+        half the mm_per_pixel of get_projection. Buffers are gzipped and the last one is kept, so
+        every viewer of a job after the first costs the server a copy.
+        """
+        gcode_path = self._resolve_gcode_path(self.gcode_path)
+        if gcode_path is None or not gcode_path.endswith(gcode_reader.GCODE_SUFFIXES):
+            return flask.make_response("Failed to locate file", 400)
 
-        overlay_img.seek(0)
-        return overlay_img, pixel_coords
+        try:
+            tolerance = min(10.0, max(0.01, float(flask.request.args.get("tolerance", 0.5))))
+        except ValueError:
+            return flask.make_response("Tolerance must be a number", 400)
+
+        key = (gcode_path, os.path.getmtime(gcode_path), tolerance)
+        cached = self._toolpath_buffer_cache
+        metrics.cache("toolpath_buffer", cached is not None and cached[0] == key)
+        if cached is not None and cached[0] == key:
+            buffer = cached[1]
+        else:
+            try:
+                reader = self._get_reader(gcode_path)
+                with metrics.stage("toolpath_encode"):
+                    buffer = gzip.compress(self._render_pool.run(render.toolpath_buffer, reader, tolerance), compresslevel=6)
+            except render.RenderPoolBusy:
+                return flask.make_response("Renderer is busy, please try again", 503)
+            except Exception as e:
+                self._logger.error(f"Failed to read G-code file: {e}")
+                return flask.make_response("Failed to read file", 500)
+            self._toolpath_buffer_cache = (key, buffer)
+
+        if "gzip" in flask.request.headers.get("Accept-Encoding", ""):
+            response = flask.make_response(buffer)
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = flask.make_response(gzip.decompress(buffer))
+        response.headers["Content-Type"] = "application/octet-stream"
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    @octoprint.plugin.BlueprintPlugin.route("/metrics", methods=["GET"])
+    def prometheus_metrics(self):
+        """Serve the pipeline durations, cache counters and queue depths in the Prometheus text format."""
+        response = flask.make_response(metrics.prometheus())
+        response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+        return response
+
+    def is_blueprint_csrf_protected(self):
+        return True
+
+    def get_extension_tree(self, *args, **kwargs):
+        """
+        Accept uploads of compressed G-code (.gcode.gz, .gcode.bz2, .gcode.xz) for the reader.
+
+        They are stored under a type of their own rather than as machinecode, which OctoPrint would
+        stream to the printer compressed; the upload pre-renders their atlas, and they are rendered
+        when selected through a plugin registering them as machinecode.
+        """
+        compressions = [suffix.rsplit(".", 1)[1] for suffix in gcode_reader.GCODE_SUFFIXES if suffix.count(".") > 1]
+        return {"compressed": {"gcode": compressions}}
 
     def get_update_information(self):
         return {
@@ -349,5 +775,6 @@ __plugin_name__ = "Hologram"
 __plugin_pythoncompat__ = ">=3.7,<4"
 __plugin_implementation__ = HologramPlugin()
 __plugin_hooks__ = {
-    "octoprint.plugin.softwareupdate.check_config": __plugin_implementation__.get_update_information
+    "octoprint.plugin.softwareupdate.check_config": __plugin_implementation__.get_update_information,
+    "octoprint.filemanager.extension_tree": __plugin_implementation__.get_extension_tree
 }
@@ -0,0 +1,92 @@
+import numpy as np
+
+from octoprint_hologram import utils
+
+
+def _box_sums(image, win_size):
+    """
+    Sums over every win_size x win_size window that fits inside the image, using an integral image.
+
+    Returns an array of shape (H - win_size + 1, W - win_size + 1), matching the region
+    structural_similarity keeps after cropping its filter borders.
+    """
+    # Accumulate in float64, a float32 integral image loses precision on large crops
+    integral = np.zeros((image.shape[0] + 1, image.shape[1] + 1), dtype=np.float64)
+    np.cumsum(image, axis=0, dtype=np.float64, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+
+    w = win_size
+    return integral[w:, w:] - integral[:-w, w:] - integral[w:, :-w] + integral[:-w, :-w]
+
+
+class ReferenceSSIM:
+    """
+    SSIM against a fixed reference image, restricted to a region of interest.
+
+    The reference is cropped, downscaled and converted to float32 grayscale once and its
+    local mean and variance maps are cached, so each comparison only computes the
+    statistics of the live frame and the cross term. Windows are uniform box filters
+    evaluated through integral images, which gives the same result as skimage's
+    structural_similarity with its default 7x7 uniform window and sample covariance.
+    """
+
+    def __init__(self, reference, roi=None, downscale=1.0, win_size=7, data_range=1.0, K1=0.01, K2=0.03):
+        """
+        Args:
+        - reference: PIL image of the expected frame, or a 2D grayscale array already prepared.
+        - roi: Tuple of (min_x, min_y, max_x, max_y) to compare, defaults to the whole image.
+        - downscale: Factor applied to the ROI crop before comparison.
+        - win_size: Side of the square comparison window, must be odd.
+        - data_range: Range of the grayscale values, 1.0 for images prepared by roi_grayscale.
+        """
+        if win_size % 2 != 1:
+            raise ValueError("Window size must be odd.")
+
+        self.roi = roi
+        self.downscale = downscale
+        self.win_size = win_size
+        self.C1 = (K1 * data_range) ** 2
+        self.C2 = (K2 * data_range) ** 2
+
+        reference_gray = self.prepare(reference)
+        if min(reference_gray.shape) < win_size:
+            raise ValueError("Region of interest is smaller than the comparison window.")
+        self.shape = reference_gray.shape
+
+        n = win_size * win_size
+        self._n = n
+        self._cov_norm = n / (n - 1)
+
+        # Cached reference statistics
+        self._reference = reference_gray
+        self._ux = (_box_sums(reference_gray, win_size) / n).astype(np.float32)
+        uxx = (_box_sums(reference_gray * reference_gray, win_size) / n).astype(np.float32)
+        self._vx = self._cov_norm * (uxx - self._ux * self._ux)
+        self._ux2_C1 = self._ux * self._ux + self.C1
+
+    def prepare(self, image):
+        """Crop, downscale and convert a PIL image the same way as the reference."""
+        if isinstance(image, np.ndarray):
+            # Arrays are taken as already cropped and downscaled
+            return image.astype(np.float32, copy=False)
+
+        roi = self.roi if self.roi is not None else (0, 0, image.width - 1, image.height - 1)
+        return utils.roi_grayscale(image, roi, self.downscale)
+
+    def compare(self, image):
+        """Return the mean SSIM between the reference and an image (PIL image or 2D grayscale array)."""
+        frame = self.prepare(image)
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match reference shape {self.shape}.")
+
+        n, w = self._n, self.win_size
+        uy = (_box_sums(frame, w) / n).astype(np.float32)
+        uyy = (_box_sums(frame * frame, w) / n).astype(np.float32)
+        uxy = (_box_sums(self._reference * frame, w) / n).astype(np.float32)
+
+        vy = self._cov_norm * (uyy - uy * uy)
+        vxy = self._cov_norm * (uxy - self._ux * uy)
+
+        numerator = (2 * self._ux * uy + self.C1) * (2 * vxy + self.C2)
+        denominator = (self._ux2_C1 + uy * uy) * (self._vx + vy + self.C2)
+        return float(np.mean(numerator / denominator, dtype=np.float64))
@@ -19,9 +19,15 @@ It supports the following functionalities
 
 # standard library
 import argparse
+import bz2
 import collections
 from enum import Enum
+import gzip
+from itertools import repeat
+import json
+import lzma
 import math
+import mmap
 import os.path
 import pprint
 import statistics
@@ -29,14 +35,9 @@ import sys
 
 
 # third party library
+# matplotlib is imported inside the functions that plot, so that reading
+# and analysing G-code does not pay for it
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as manimation
-from mpl_toolkits.mplot3d import Axes3D
-import pandas as pd
-import seaborn as sns
-
-# sns.set()  # use seaborn style
 
 # maximum element length in meshing
 MAX_ELEMENT_LENGTH = 1 # FDM regular
@@ -58,8 +59,9 @@ PLOT_POWER = True
 POWER_ZERO = 1
 IGNORE_ZERO_POWER = True
 
-# Element namedtuple
-Element = collections.namedtuple('Element', ['x0', 'y0', 'x1', 'y1', 'z'])
+# Element record dtype, elements are stored in a numpy recarray
+ELEMENT_DTYPE = np.dtype([('x0', float), ('y0', float), ('x1', float),
+                          ('y1', float), ('z', float)])
 
 # set true to add axis-label and title
 FIG_INFO = False
@@ -131,6 +133,7 @@ def create_axis(figsize=(8, 8), projection='2d'):
     Returns:
         fig, ax
     """
+    import matplotlib.pyplot as plt
     projection = projection.lower()
     if projection not in ['2d', '3d']:
         raise ValueError
@@ -153,6 +156,7 @@ def create_movie_writer(title='Movie Writer', fps=15):
     Returns:
         movie writer
     """
+    import matplotlib.animation as manimation
     FFMpegWriter = manimation.writers['ffmpeg']
     metadata = dict(title=title, artist='Matplotlib',
                     comment='Movie Support')
@@ -176,6 +180,865 @@ def add_margin_to_axis_limits(min_v, max_v, margin_ratio=MARGIN_RATIO):
     return (min_v - dv, max_v + dv)
 
 
+def simplify_polyline(xs, ys, tolerance):
+    """
+    Douglas-Peucker simplification of a polyline
+
+    Args:
+        xs: x coordinates of the points
+        ys: y coordinates of the points
+        tolerance: maximum distance between the polyline and its simplification
+
+    Returns:
+        boolean mask of the points to keep, the end points are always kept
+    """
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    n = len(xs)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    if n < 3:
+        return keep
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = xs[last] - xs[first]
+        dy = ys[last] - ys[first]
+        px = xs[first + 1:last] - xs[first]
+        py = ys[first + 1:last] - ys[first]
+        norm = math.hypot(dx, dy)
+        if norm > 0:
+            dists = np.abs(dx * py - dy * px) / norm
+        else:  # closed loop, measure from the start point
+            dists = np.hypot(px, py)
+        idx = int(np.argmax(dists))
+        if dists[idx] > tolerance:
+            mid = first + 1 + idx
+            keep[mid] = True
+            stack.append((first, mid))
+            stack.append((mid, last))
+    return keep
+
+
+def summarize(values):
+    """
+    summary statistics of a 1D array, same fields as pandas describe()
+
+    Returns:
+        dict with count, mean, std, min, 25%, 50%, 75% and max
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return {'count': 0, 'mean': None, 'std': None, 'min': None,
+                '25%': None, '50%': None, '75%': None, 'max': None}
+    q = np.percentile(values, [0, 25, 50, 75, 100])
+    return {'count': len(values), 'mean': float(values.mean()),
+            'std': float(values.std(ddof=1)) if len(values) > 1 else None,
+            'min': float(q[0]), '25%': float(q[1]), '50%': float(q[2]),
+            '75%': float(q[3]), 'max': float(q[4])}
+
+
+def summarize_blocks(blocks, bins=1 << 16):
+    """
+    summarize() for more values than should be held in memory at once
+
+    Args:
+        blocks: callable returning a new iterator over 1D arrays of values,
+        it is called twice
+        bins: the quartiles are read from a histogram with this many bins,
+        so they are exact to within (max - min) / bins
+    """
+    count, total, total_sq = 0, 0.0, 0.0
+    low, high = math.inf, -math.inf
+    for values in blocks():
+        if len(values) == 0:
+            continue
+        count += len(values)
+        total += float(values.sum())
+        total_sq += float(np.square(values).sum())
+        low = min(low, float(values.min()))
+        high = max(high, float(values.max()))
+    if count == 0:
+        return summarize([])
+    mean = total / count
+    std = (math.sqrt(max(total_sq - count * mean * mean, 0.0) / (count - 1))
+           if count > 1 else None)
+
+    hist = np.zeros(bins, dtype=np.int64)
+    for values in blocks():
+        hist += np.histogram(values, bins=bins, range=(low, high))[0]
+    cumulative = np.cumsum(hist)
+    width = (high - low) / bins
+
+    def quantile(q):
+        # rank as in np.percentile, then interpolate inside its bin
+        rank = q * (count - 1)
+        i = int(np.searchsorted(cumulative, rank, side='right'))
+        i = min(i, bins - 1)
+        before = cumulative[i - 1] if i else 0
+        fraction = (rank - before + 0.5) / max(hist[i], 1)
+        return float(min(max(low + (i + fraction) * width, low), high))
+
+    return {'count': count, 'mean': mean, 'std': std,
+            'min': low, '25%': quantile(0.25), '50%': quantile(0.5),
+            '75%': quantile(0.75), 'max': high}
+
+
+def print_summary(summary):
+    """ print a summary computed by summarize() """
+    for key, value in summary.items():
+        if value is None or key == 'count':
+            print('{:<6s}{:>14}'.format(key, value if value is not None else 'NaN'))
+        else:
+            print('{:<6s}{:>14.6f}'.format(key, value))
+
+
+def print_layer_table(columns):
+    """ print per-layer counts, columns maps column name to counts """
+    names = list(columns)
+    print('layer ' + ' '.join('{:>12s}'.format(name) for name in names))
+    for i, row in enumerate(zip(*columns.values())):
+        print('{:<6d}'.format(i + 1) +
+              ' '.join('{:>12d}'.format(int(v)) for v in row))
+
+
+class SegmentGrid:
+    """
+    uniform grid over axis-aligned boxes for region queries
+
+    every box is registered in all the cells it overlaps, the cell lists
+    are stored as one array sorted by cell key so that building the grid
+    is a few vectorized passes
+    boxes of line segments are not registered whole: a long diagonal would
+    cover about as many cells as there are segments, each segment is only
+    registered in the cells its line crosses
+    """
+
+    def __init__(self, boxes, cell_size=None, segments=None):
+        """
+        Args:
+            boxes: array of shape (n, 4) with rows (xmin, ymin, xmax, ymax)
+            cell_size: side of a grid cell, by default chosen so that the
+            grid has about as many cells as boxes
+            segments: array of shape (n, 4) with rows (x0, y0, x1, y1) of
+            the segments the boxes bound, if any; cells and queries then
+            follow the segments rather than their boxes
+        """
+        self.boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self.segments = (None if segments is None else
+                         np.asarray(segments, dtype=float).reshape(-1, 4))
+        n = len(self.boxes)
+        if n == 0:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+        else:
+            self.origin = self.boxes[:, :2].min(axis=0)
+            extent = self.boxes[:, 2:].max(axis=0) - self.origin
+        if cell_size is None:
+            cell_size = math.sqrt(max(extent[0] * extent[1], 1e-12) /
+                                  max(n, 1))
+            cell_size = max(cell_size, extent.max() / 1024, 1e-9)
+        self.cell_size = cell_size
+        self.nx, self.ny = (np.floor(extent / cell_size).astype(int) + 1)
+
+        if self.segments is None:
+            owners, keys = self._box_cells()
+        else:
+            owners, keys = self._segment_cells()
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._items = owners[order]
+
+    def _box_cells(self):
+        """ (owner, cell key) of every cell overlapped by every box """
+        n = len(self.boxes)
+        ix0, iy0 = self._cells(self.boxes[:, 0], self.boxes[:, 1])
+        ix1, iy1 = self._cells(self.boxes[:, 2], self.boxes[:, 3])
+        widths = ix1 - ix0 + 1
+        counts = widths * (iy1 - iy0 + 1)
+        owners = np.repeat(np.arange(n), counts)
+        # position of each entry inside the block of cells of its box
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                     counts)
+        widths = np.repeat(widths, counts)
+        keys = ((np.repeat(iy0, counts) + local // widths) * self.nx +
+                np.repeat(ix0, counts) + local % widths)
+        return owners, keys
+
+    def _segment_cells(self):
+        """
+        (owner, cell key) of every cell crossed by every segment
+
+        a cell walk done for all segments at once: each crossing of a
+        vertical or horizontal grid line moves one cell along that axis,
+        the crossings of a segment are ordered by their parameter along it
+        """
+        n = len(self.segments)
+        x0, y0, x1, y1 = self.segments.T
+        ix0, iy0 = self._cells(x0, y0)
+        ix1, iy1 = self._cells(x1, y1)
+        owners = [np.arange(n)]
+        ts = [np.full(n, -1.0)]
+        steps_x = [np.zeros(n, dtype=int)]
+        steps_y = [np.zeros(n, dtype=int)]
+        for axis, (a0, a1, i0, i1, origin) in enumerate((
+                (x0, x1, ix0, ix1, self.origin[0]),
+                (y0, y1, iy0, iy1, self.origin[1]))):
+            counts = np.abs(i1 - i0)
+            step = np.sign(i1 - i0)
+            owner = np.repeat(np.arange(n), counts)
+            k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                    counts) + 1
+            # grid line crossed by the k-th step, counted from the start cell
+            line = (i0[owner] + np.where(step[owner] > 0, k, 1 - k)) * \
+                self.cell_size + origin
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = (line - a0[owner]) / (a1 - a0)[owner]
+            owners.append(owner)
+            ts.append(t)
+            moves = step[owner]
+            steps_x.append(moves if axis == 0 else np.zeros_like(moves))
+            steps_y.append(moves if axis == 1 else np.zeros_like(moves))
+        owners = np.concatenate(owners)
+        order = np.lexsort((np.concatenate(ts), owners))
+        owners = owners[order]
+        # cumulative steps restart at the start cell of every segment
+        bars = np.flatnonzero(np.diff(owners)) + 1
+        keys = []
+        for start, moves in ((ix0, np.concatenate(steps_x)[order]),
+                             (iy0, np.concatenate(steps_y)[order])):
+            total = np.cumsum(moves)
+            before = np.concatenate(([0], total[bars - 1]))
+            keys.append(start[owners] + total -
+                        np.repeat(before, np.diff(np.concatenate(
+                            ([0], bars, [len(owners)])))))
+        ix, iy = keys
+        return owners, iy * self.nx + ix
+
+    def _cells(self, xs, ys):
+        """ cell column and row of points, clipped to the grid """
+        ix = np.floor((np.asarray(xs) - self.origin[0]) / self.cell_size)
+        iy = np.floor((np.asarray(ys) - self.origin[1]) / self.cell_size)
+        return (np.clip(ix, 0, self.nx - 1).astype(int),
+                np.clip(iy, 0, self.ny - 1).astype(int))
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """
+        sorted indices of the boxes intersecting a query box, or of the
+        segments crossing it when the grid was built over segments
+        """
+        if len(self.boxes) == 0:
+            return np.zeros(0, dtype=int)
+        ix0, iy0 = self._cells(xmin, ymin)
+        ix1, iy1 = self._cells(xmax, ymax)
+        rows = np.arange(iy0, iy1 + 1) * self.nx
+        lefts = np.searchsorted(self._keys, rows + ix0, side='left')
+        rights = np.searchsorted(self._keys, rows + ix1, side='right')
+        candidates = np.unique(np.concatenate(
+            [self._items[l:r] for l, r in zip(lefts, rights)]))
+        boxes = self.boxes[candidates]
+        hit = ((boxes[:, 0] <= xmax) & (boxes[:, 2] >= xmin) &
+               (boxes[:, 1] <= ymax) & (boxes[:, 3] >= ymin))
+        if self.segments is not None:
+            hit[hit] = self._crosses(self.segments[candidates[hit]],
+                                     xmin, ymin, xmax, ymax)
+        return candidates[hit]
+
+    @staticmethod
+    def _crosses(segments, xmin, ymin, xmax, ymax):
+        """ clip segments to a box (Liang-Barsky), true where some part is left """
+        x0, y0, x1, y1 = segments.T
+        t_in = np.zeros(len(segments))
+        t_out = np.ones(len(segments))
+        inside = np.ones(len(segments), dtype=bool)
+        for a0, d, low, high in ((x0, x1 - x0, xmin, xmax),
+                                 (y0, y1 - y0, ymin, ymax)):
+            flat = d == 0
+            inside &= ~flat | ((a0 >= low) & (a0 <= high))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t_low = (low - a0) / d
+                t_high = (high - a0) / d
+            t_in = np.where(flat, t_in, np.maximum(t_in, np.minimum(t_low, t_high)))
+            t_out = np.where(flat, t_out, np.minimum(t_out, np.maximum(t_low, t_high)))
+        return inside & (t_in <= t_out)
+
+    def neighbor_pairs(self):
+        """
+        all pairs (i, j), i != j, of boxes registered in the same or in
+        adjacent cells
+        meant for point sets (degenerate boxes): with cell_size >= r it
+        includes every pair of points closer than r
+        """
+        n = len(self.boxes)
+        ix, iy = self._cells(self.boxes[:, 0], self.boxes[:, 1])
+        firsts, seconds = [], []
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                jx = ix + dx
+                jy = iy + dy
+                valid = (jx >= 0) & (jx < self.nx) & (jy >= 0) & (jy < self.ny)
+                keys = jy * self.nx + jx
+                lefts = np.searchsorted(self._keys, keys, side='left')
+                counts = np.searchsorted(self._keys, keys, side='right') - lefts
+                counts[~valid] = 0
+                local = np.arange(counts.sum()) - np.repeat(
+                    np.cumsum(counts) - counts, counts)
+                firsts.append(np.repeat(np.arange(n), counts))
+                seconds.append(self._items[np.repeat(lefts, counts) + local])
+        firsts = np.concatenate(firsts)
+        seconds = np.concatenate(seconds)
+        distinct = firsts != seconds
+        return firsts[distinct], seconds[distinct]
+
+
+# magic numbers of the compressed files the reader decompresses on the fly
+COMPRESSIONS = ((b'\x1f\x8b', gzip), (b'BZh', bz2), (b'\xfd7zXZ\x00', lzma))
+# suffixes of the G-code files the reader accepts
+GCODE_SUFFIXES = ('.gcode', '.gcode.gz', '.gcode.bz2', '.gcode.xz')
+# magic number of Prusa binary G-code (.bgcode)
+BGCODE_MAGIC = b'GCDE'
+
+
+def compression(filename):
+    """ module decompressing a file (gzip, bz2 or lzma), None if plain """
+    with open(filename, 'rb') as infile:
+        magic = infile.read(6)
+    for prefix, module in COMPRESSIONS:
+        if magic.startswith(prefix):
+            return module
+    return None
+
+
+def open_gcode(filename):
+    """
+    open a G-code file for reading text, decompressing gzip, bzip2 and xz
+    files incrementally while they are read, without a temporary copy
+    """
+    with open(filename, 'rb') as infile:
+        if infile.read(len(BGCODE_MAGIC)) == BGCODE_MAGIC:
+            raise ValueError("{} is binary G-code, export it as text G-code "
+                             "(optionally compressed) instead".format(filename))
+    module = compression(filename)
+    if module is not None:
+        return module.open(filename, 'rt')
+    return open(filename, 'r')
+
+
+# modal words tracked by the FDM regular parser, in the order of its state
+FDM_WORDS = 'GXYZEF'
+# the state also holds two flags after the words: X/Y/Z moves are relative
+# (G91) and E moves are relative (M83)
+RELATIVE_XYZ = len(FDM_WORDS)
+RELATIVE_E = RELATIVE_XYZ + 1
+
+# maximum distance between an arc (G2/G3) and the chords replacing it, in mm
+# a tenth of a pixel for a typical bed overlay, renders simplify the
+# toolpath to half a pixel anyway so arcs never cost more than lines
+ARC_TOLERANCE = 0.05
+
+
+def new_fdm_state():
+    """ state of the FDM regular parser at the start of a file """
+    temp = -float('inf')
+    return [temp, temp, temp, temp, temp, temp, False, False]
+
+
+def fdm_lines(lines):
+    """ G lines and E mode (M82/M83) lines of an FDM regular file, stripped of comments """
+    for line in lines:
+        line = line.strip()
+        # only keep line that starts with 'G' or sets the E mode
+        if line.startswith(('G', 'M82', 'M83')):
+            idx = line.find(';')
+            if idx != -1:
+                line = line[:idx]
+            yield line
+
+
+def arc_points(x0, y0, x1, y1, i, j, r, clockwise, tolerance):
+    """
+    points of the chords replacing a G2 (clockwise) or G3 arc from (x0, y0)
+    to (x1, y1), the center given by its offset (i, j) from the start or by
+    the radius r (negative for the long way round) as Marlin reads them;
+    the same start and end point make a full circle
+
+    returns xs, ys of the points after the start, the last one is exactly
+    (x1, y1), chords deviate from the arc by at most tolerance
+    """
+    if r is not None and i == 0 and j == 0:
+        dx, dy = x1 - x0, y1 - y0
+        d = math.hypot(dx, dy)
+        if d == 0:
+            return np.array([x1]), np.array([y1])
+        h = math.sqrt(max((r - 0.5 * d) * (r + 0.5 * d), 0.0))
+        e = -1 if clockwise != (r < 0) else 1
+        i = 0.5 * dx - e * h * dy / d
+        j = 0.5 * dy + e * h * dx / d
+    cx, cy = x0 + i, y0 + j
+    radius = math.hypot(i, j)
+    start = math.atan2(-j, -i)
+    sweep = math.atan2(y1 - cy, x1 - cx) - start
+    if clockwise and sweep >= 0:
+        sweep -= 2 * math.pi
+    elif not clockwise and sweep <= 0:
+        sweep += 2 * math.pi
+    if radius <= tolerance:
+        n = 1
+    else:
+        # largest angle whose chord stays within tolerance of the arc
+        step = 2 * math.acos(1 - tolerance / radius)
+        n = max(1, math.ceil(abs(sweep) / step))
+    angles = start + sweep * np.arange(1, n) / n
+    xs = np.append(cx + radius * np.cos(angles), x1)
+    ys = np.append(cy + radius * np.sin(angles), y1)
+    return xs, ys
+
+
+def parse_fdm_regular(lines, segs, state=None, mx_z=-math.inf,
+                      arc_tolerance=ARC_TOLERANCE):
+    """
+    parse lines of an FDM regular file given by fdm_lines, appending
+    (x0, y0, x1, y1, z) segments to segs
+
+    an extruding G1 move in the layer plane is a segment, an extruding
+    G2/G3 arc becomes chords within arc_tolerance; positions are tracked
+    in absolute coordinates through G90/G91 and G92, extrusion through
+    M82/M83
+
+    a new layer starts at the first extruding move above every previous
+    one; state (see new_fdm_state) and mx_z (highest layer so far) are
+    taken and returned so that parsing can resume at any line of a file,
+    pass mx_z=math.inf to not detect layers
+
+    returns layer_starts, state, mx_z where layer_starts are the indexes
+    into segs of the first segment of every new layer
+    """
+    state = new_fdm_state() if state is None else list(state)
+    # the words, then a slot other words are written to and never read
+    gxyzef = state[:RELATIVE_XYZ] + [0.0]
+    relative_xyz, relative_e = state[RELATIVE_XYZ:]
+    d = collections.defaultdict(lambda: RELATIVE_XYZ, zip(FDM_WORDS, range(6)))
+    seg_count = len(segs)
+    layer_starts = []
+    for line in lines:
+        if line[0] == 'M':
+            relative_e = line.startswith('M83')
+            continue
+        old_gxyzef = gxyzef[:]
+        try:
+            for token in line.split():
+                gxyzef[d[token[0]]] = float(token[1:])
+        except ValueError:
+            # words without a number, e.g. G28 W
+            for token in line.split():
+                try:
+                    gxyzef[d[token[0]]] = float(token[1:])
+                except ValueError:
+                    pass
+        g = gxyzef[0]
+        if g == 1 and not (relative_xyz or relative_e):
+            # absolute moves, the common case
+            if (gxyzef[1:3] != old_gxyzef[1:3]
+                    and gxyzef[3] == old_gxyzef[3]
+                    and gxyzef[4] > old_gxyzef[4]):
+                x0, y0, z = old_gxyzef[1:4]
+                # update layer here
+                if z > mx_z:
+                    mx_z = z
+                    layer_starts.append(seg_count)
+                segs.append((x0, y0, gxyzef[1], gxyzef[2], z))
+                seg_count += 1
+            continue
+        if g == 90 or g == 91:
+            relative_xyz = g == 91
+            continue
+        if relative_xyz and g != 92:
+            # positions stay absolute, relative words are added to them
+            for token in line.split():
+                k = d[token[0]]
+                if 0 < k < 4:
+                    try:
+                        gxyzef[k] = old_gxyzef[k] + float(token[1:])
+                    except ValueError:
+                        pass
+        if g not in (1, 2, 3) or gxyzef[3] != old_gxyzef[3]:
+            continue
+        # E keeps the last word whatever the XYZ mode: with M83 a move extrudes
+        # when its E is positive, with M82 when E grows
+        if relative_e:
+            extruding = 'E' in line and gxyzef[4] > 0
+        else:
+            extruding = gxyzef[4] > old_gxyzef[4]
+        if not extruding:
+            continue
+        x0, y0, z = old_gxyzef[1:4]
+        x1, y1 = gxyzef[1:3]
+        if g == 1 and (x1, y1) == (x0, y0):
+            continue
+        # update layer here
+        if z > mx_z:
+            mx_z = z
+            layer_starts.append(seg_count)
+        if g == 1:
+            segs.append((x0, y0, x1, y1, z))
+            seg_count += 1
+            continue
+        arc = {'I': 0.0, 'J': 0.0, 'R': None}
+        for token in line.split():
+            if token[0] in arc:
+                arc[token[0]] = float(token[1:])
+        xs, ys = arc_points(x0, y0, x1, y1, arc['I'], arc['J'], arc['R'],
+                            g == 2, arc_tolerance)
+        for x1, y1 in zip(xs.tolist(), ys.tolist()):
+            segs.append((x0, y0, x1, y1, z))
+            seg_count += 1
+            x0, y0 = x1, y1
+    return layer_starts, gxyzef[:RELATIVE_XYZ] + [relative_xyz, relative_e], mx_z
+
+
+def read_lines(infile, start, end):
+    """ decoded lines of a file opened in binary mode between two byte offsets """
+    infile.seek(start)
+    pos = start
+    while pos < end:
+        line = infile.readline()
+        if not line:
+            break
+        pos += len(line)
+        yield line.decode('utf-8', 'replace')
+
+
+def last_command(buffer, command, end):
+    """
+    offset of the last line before end starting with command (e.g. b'G91'
+    but not b'G91.1'), -1 if there is none
+    """
+    pos = end
+    while pos > 0:
+        pos = buffer.rfind(command, 0, pos)
+        if pos == -1:
+            break
+        after = buffer[pos + len(command):pos + len(command) + 1]
+        if (pos == 0 or buffer[pos - 1:pos] == b'\n') and (
+                not after or after not in b'0123456789.'):
+            return pos
+    return -1
+
+
+def _last_words(buffer, start, end, words, block_size):
+    """
+    last value of each of words set by the G lines of buffer[start:end],
+    scanning backwards until all are found, None for the ones never set
+    """
+    state = [None] * len(words)
+    tail = b''
+    while end > start and None in state:
+        block_start = max(start, end - block_size)
+        lines = (buffer[block_start:end] + tail).split(b'\n')
+        # the first piece is a partial line unless the range starts there
+        tail = lines.pop(0) if block_start > start else b''
+        for line in reversed(lines):
+            line = line.strip()
+            if not line.startswith(b'G'):
+                continue
+            line = line.split(b';', 1)[0]
+            # later words of a line override earlier ones
+            for token in reversed(line.split()):
+                i = words.find(chr(token[0]))
+                if i != -1 and state[i] is None:
+                    # words without a number (G28 X) leave the value as is,
+                    # as in parse_fdm_regular
+                    try:
+                        state[i] = float(token[1:])
+                    except ValueError:
+                        pass
+        end = block_start
+    return state
+
+
+def modal_state_before(buffer, offset, block_size=1 << 16):
+    """
+    parser state (see parse_fdm_regular) at a byte offset of an FDM regular
+    file, found by scanning G lines backwards from the offset until every
+    word has been seen; words never set are -inf, as for a fresh parse
+
+    returns None when relative moves (G91) make the positions depend on
+    the whole history, the state is only known by parsing up to the offset
+    """
+    relative = last_command(buffer, b'G91', offset)
+    absolute = last_command(buffer, b'G90', offset)
+    if relative > absolute:
+        return None
+    if relative != -1 and None in _last_words(buffer, absolute, offset, 'XYZ',
+                                              block_size):
+        # a position was last set by a relative move
+        return None
+    state = _last_words(buffer, 0, offset, FDM_WORDS, block_size)
+    relative_e = (last_command(buffer, b'M83', offset) >
+                  last_command(buffer, b'M82', offset))
+    return [-float('inf') if v is None else v for v in state] + [False, relative_e]
+
+
+class LayerIndex:
+    """
+    byte offsets of the layers of a G-code file, found from the comments
+    slicers write at layer changes (Cura ;LAYER:n, PrusaSlicer and
+    OrcaSlicer ;LAYER_CHANGE, or ;Z:z alone) with a byte search over a
+    memory map, without parsing the file
+
+    layer i (1-based) spans bytes [offsets[i - 1], offsets[i]); zs holds
+    the height given by ;Z: comments, NaN when the slicer does not write it
+    """
+
+    # comments starting a layer, tried in order; ;Z: only when none is found
+    LAYER_MARKERS = (b';LAYER:', b';LAYER_CHANGE')
+    Z_MARKER = b';Z:'
+
+    def __init__(self, offsets, zs):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.zs = np.asarray(zs, dtype=float)
+
+    @property
+    def n_layers(self):
+        return len(self.offsets) - 1
+
+    def byte_range(self, first, last):
+        """ byte range of layers [first, last), 1-based """
+        if not 1 <= first < last <= self.n_layers + 1:
+            raise LayerError("Layer number is invalid!")
+        return int(self.offsets[first - 1]), int(self.offsets[last - 1])
+
+    @staticmethod
+    def _find_lines(buffer, marker):
+        """ offsets of the lines of buffer starting with marker """
+        positions = [0] if buffer[:len(marker)] == marker else []
+        needle = b'\n' + marker
+        i = buffer.find(needle)
+        while i != -1:
+            positions.append(i + 1)
+            i = buffer.find(needle, i + 1)
+        return positions
+
+    @classmethod
+    def scan(cls, filename):
+        """
+        index the layers of a file, None if it has no layer comments or
+        is compressed, its bytes cannot be sought then
+        """
+        size = os.path.getsize(filename)
+        if size == 0 or compression(filename) is not None:
+            return None
+        with open(filename, 'rb') as infile, \
+                mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            starts = []
+            for marker in cls.LAYER_MARKERS:
+                starts = cls._find_lines(buffer, marker)
+                if starts:
+                    break
+            z_lines = cls._find_lines(buffer, cls.Z_MARKER)
+            if not starts:
+                starts = z_lines
+            if not starts:
+                return None
+            # height of a layer from the first ;Z: comment inside it
+            zs = np.full(len(starts), np.nan)
+            offsets = np.append(starts, size)
+            if z_lines:
+                owners = np.searchsorted(offsets, z_lines, side='right') - 1
+                for owner, pos in reversed(list(zip(owners, z_lines))):
+                    if 0 <= owner < len(starts):
+                        end = buffer.find(b'\n', pos)
+                        try:
+                            zs[owner] = float(buffer[pos + len(cls.Z_MARKER):
+                                                     end if end != -1 else size])
+                        except ValueError:
+                            pass
+        return cls(offsets, zs)
+
+
+def layer_count(filename):
+    """
+    number of layers of an FDM regular file, from its layer comments when
+    it has them, otherwise by parsing it
+    """
+    index = LayerIndex.scan(filename)
+    if index is not None:
+        return index.n_layers
+    return GcodeReader(filename).n_layers
+
+
+# files smaller than this are parsed in the calling process even when
+# workers are allowed, starting the processes would cost more than it saves
+PARALLEL_MIN_BYTES = 1 << 22
+
+
+def chunk_offsets(filename, n_chunks, layer_index=None):
+    """
+    byte offsets splitting a file into about n_chunks ranges of similar
+    size, cut at the layer starts of layer_index when given, otherwise at
+    line starts; the first offset is 0 and the last the file size
+    """
+    size = os.path.getsize(filename)
+    targets = np.linspace(0, size, n_chunks + 1)[1:-1]
+    if layer_index is not None:
+        # first layer start at or after each target
+        starts = layer_index.offsets
+        cuts = starts[np.searchsorted(starts, targets)]
+    else:
+        cuts = []
+        with open(filename, 'rb') as infile:
+            for target in targets:
+                infile.seek(int(target))
+                infile.readline()
+                cuts.append(infile.tell())
+    return np.unique(np.concatenate(([0], cuts, [size]))).astype(np.int64).tolist()
+
+
+def parse_fdm_chunk(filename, start, end, state=None,
+                    arc_tolerance=ARC_TOLERANCE):
+    """
+    parse bytes [start, end) of an FDM regular file, run by the workers of
+    a parallel read
+
+    the parser state is recovered from the bytes before start unless it
+    is given, and layers are detected as if nothing before start was
+    higher, the caller keeps the layer starts above every earlier chunk
+
+    returns the segments as an (n, 5) array, the indexes of the layer
+    starts among them and the parser state at end, or None when the state
+    at start cannot be recovered (see modal_state_before)
+    """
+    segs = []
+    with open(filename, 'rb') as infile:
+        if state is None:
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                state = modal_state_before(buffer, start)
+            if state is None:
+                return None
+        layer_starts, state, _ = parse_fdm_regular(
+            fdm_lines(read_lines(infile, start, end)), segs, state,
+            arc_tolerance=arc_tolerance)
+    return (np.array(segs, dtype=float).reshape(-1, 5),
+            np.array(layer_starts, dtype=np.int64), state)
+
+
+# columns of a segment store, in the order of a segment tuple
+SEGMENT_COLUMNS = ('x0', 'y0', 'x1', 'y1', 'z')
+
+
+class SegmentStoreWriter:
+    """
+    stream segments to an on-disk columnar store
+    segments are buffered chunk_size at a time and appended to one float32
+    file per column, so memory use does not grow with the G-code file
+    it is appended to like the list of segments it replaces
+    """
+
+    def __init__(self, path, chunk_size=1 << 16):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.n_written = 0
+        self._pending = []
+        self._files = [open(os.path.join(path, name + '.f32'), 'wb')
+                       for name in SEGMENT_COLUMNS]
+
+    def __len__(self):
+        return self.n_written + len(self._pending)
+
+    def append(self, seg):
+        self._pending.append(seg)
+        if len(self._pending) >= self.chunk_size:
+            self._flush()
+
+    def extend(self, segs):
+        """ append an (n, 5) array of segments """
+        self._flush()
+        self._write(np.asarray(segs, dtype=np.float32).reshape(-1, 5))
+
+    def _flush(self):
+        if self._pending:
+            self._write(np.array(self._pending, dtype=np.float32).reshape(-1, 5))
+            self._pending = []
+
+    def _write(self, chunk):
+        for column, outfile in zip(chunk.T, self._files):
+            np.ascontiguousarray(column).tofile(outfile)
+        self.n_written += len(chunk)
+
+    def close(self):
+        """ write the remaining segments and return the SegmentStore """
+        self._flush()
+        for outfile in self._files:
+            outfile.close()
+        return SegmentStore(self.path)
+
+
+class SegmentStore:
+    """
+    read-only columnar segments written by SegmentStoreWriter
+    each column is memory-mapped, so reading the segments of some layers
+    only touches the pages of those layers; supports the indexing used on
+    the (n, 5) segs array and converts to it with np.asarray
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = []
+        for name in SEGMENT_COLUMNS:
+            column_path = os.path.join(path, name + '.f32')
+            n = os.path.getsize(column_path) // 4
+            # np.memmap cannot map an empty file
+            self.columns.append(
+                np.memmap(column_path, dtype=np.float32, mode='r', shape=(n,))
+                if n else np.empty(0, dtype=np.float32))
+        self.shape = (len(self.columns[0]), len(SEGMENT_COLUMNS))
+        self.ndim = 2
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(cols, (int, np.integer)):
+            return self.columns[cols][rows]
+        return np.stack([np.asarray(column[rows]) for column in self.columns],
+                        axis=-1)[..., cols]
+
+    def __array__(self, dtype=None, copy=None):
+        segs = self[:]
+        return segs if dtype is None else segs.astype(dtype)
+
+    def blocks(self, block_size):
+        """
+        yield (start, segs) blocks of at most block_size segments as float64
+        arrays, read from the files rather than the maps so that a pass
+        over the whole store does not keep it resident
+        """
+        for start in range(0, len(self), block_size):
+            count = min(block_size, len(self) - start)
+            block = np.empty((count, len(SEGMENT_COLUMNS)))
+            for i, name in enumerate(SEGMENT_COLUMNS):
+                block[:, i] = np.fromfile(
+                    os.path.join(self.path, name + '.f32'), dtype=np.float32,
+                    count=count, offset=4 * start)
+            yield start, block
+
+    def close(self):
+        """ drop the maps, the files can be moved or removed afterwards """
+        self.columns = [np.empty(0, dtype=np.float32)] * len(SEGMENT_COLUMNS)
+
+
+def remove_arrays(path):
+    """ remove a folder written by GcodeReader.save_arrays """
+    for name in os.listdir(path):
+        os.remove(os.path.join(path, name))
+    os.rmdir(path)
+
+
 class LayerError(Exception):
     """ layer number error """
     pass
@@ -197,12 +1060,55 @@ class GcodeType(Enum):
 class GcodeReader:
     """ Gcode reader class """
 
-    def __init__(self, filename, filetype=GcodeType.FDM_REGULAR):
+    def __init__(self, filename, filetype=GcodeType.FDM_REGULAR,
+                 store_path=None, layer_range=None, workers=1,
+                 arc_tolerance=ARC_TOLERANCE):
+        """
+        if store_path is given, segments are streamed to a SegmentStore in
+        that folder instead of being kept in memory, and self.segs is the
+        store; memory use then does not grow with the file
+
+        gzip, bzip2 and xz files are decompressed while they are parsed
+
+        arcs (G2/G3) of FDM regular files are replaced by chords deviating
+        at most arc_tolerance (mm) from them
+
+        if workers > 1, uncompressed FDM regular files of at least PARALLEL_MIN_BYTES are
+        parsed by that many processes, in chunks cut at layer comments when
+        the file has them; the result is identical to a sequential read
+
+        if layer_range (first, last) is given, only layers [first, last)
+        (1-based) of an FDM regular file are read and become layers
+        1..last - first of the reader; when the file is uncompressed and
+        has slicer layer comments only their bytes are parsed and layers
+        are the slicer's, otherwise the whole file is parsed and trimmed
+        """
         if not os.path.exists(filename):
             print("{} does not exist!".format(filename))
             sys.exit(1)
+        if layer_range is not None and (
+                filetype != GcodeType.FDM_REGULAR or store_path is not None):
+            raise ValueError("layer_range needs an in-memory FDM regular reader")
+        self._init_state(filename, filetype)
+        self.store_path = store_path
+        self.layer_range = layer_range
+        self.workers = workers
+        self.arc_tolerance = arc_tolerance
+        # read file to populate variables
+        self._read()
+
+    def _init_state(self, filename, filetype):
+        """ initialize the attributes of a reader that has not read yet """
         self.filename = filename
         self.filetype = filetype
+        self.store_path = None
+        self.layer_range = None
+        self.workers = 1
+        self.arc_tolerance = ARC_TOLERANCE
+        # first layer of the file read, when only a layer range is read
+        self.first_layer = 1
+        # LayerIndex from slicer comments, set by ranged reads
+        self.layer_index = None
         # print(self.filetype)
         self.n_segs = 0  # number of line segments
         self.segs = None  # list of line segments [(x0, y0, x1, y1, z)]
@@ -214,57 +1120,168 @@ class GcodeReader:
         self.subpath_index_bars = []
         self.summary = None
         self.lengths = None
+        self.stats = None
         self.subpaths = None
         self.xyzlimits = None
         self.elements = None
         self.elements_index_bars = []
-        # read file to populate variables
-        self._read()
+        # level of detail cache, lod level -> {layer: subpaths}
+        self._lod_cache = {}
+        # lod level -> (points, path_bars, subpath_index_bars)
+        self._lod_vertex_cache = {}
+        # per-layer (xmin, xmax, ymin, ymax, zmin, zmax), same order as
+        # xyzlimits, and lazily built per-layer SegmentGrid
+        self.layer_bounds = None
+        self._segment_grids = {}
+        # folder of the memory-mapped arrays backing this reader, if any
+        self.array_path = None
+
+    def save_arrays(self, path):
+        """
+        write the parsed toolpath to a folder, as a SegmentStore plus layer
+        bars, layer bounds and a meta.json, so that other readers, in this
+        process or others, can attach to it with from_arrays instead of
+        parsing the file again
+
+        a reader created with a store_path moves its store into the folder,
+        others write theirs; the folder is written under a temporary name
+        and renamed, so attaching readers never see a partial toolpath
+        """
+        if isinstance(self.segs, SegmentStore):
+            tmp_path = self.segs.path
+        else:
+            tmp_path = '{}.tmp-{}'.format(path, os.getpid())
+            writer = SegmentStoreWriter(tmp_path)
+            writer.extend(self.segs)
+            writer.close()
+        np.save(os.path.join(tmp_path, 'seg_index_bars.npy'),
+                np.asarray(self.seg_index_bars, dtype=np.int64))
+        np.save(os.path.join(tmp_path, 'layer_bounds.npy'), self.layer_bounds)
+        if hasattr(self, 'powers'):
+            np.save(os.path.join(tmp_path, 'powers.npy'), np.asarray(self.powers))
+        meta = {
+            'filename': self.filename,
+            'filetype': self.filetype.value,
+            'n_layers': self.n_layers,
+            'n_segs': self.n_segs,
+            'xyzlimits': [float(v) for v in self.xyzlimits],
+            'stats': self.stats,
+        }
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as outfile:
+            json.dump(meta, outfile)
+        if isinstance(self.segs, SegmentStore):
+            self.segs.close()
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # another reader published the same toolpath first
+            remove_arrays(tmp_path)
+            if not os.path.isdir(path):
+                raise
+        if isinstance(self.segs, SegmentStore):
+            self.segs = SegmentStore(path)
+
+    @classmethod
+    def from_arrays(cls, path):
+        """
+        attach to a toolpath written by save_arrays
+        the segments are memory-mapped read-only, so attaching costs no
+        parsing, layers are only read when used and readers in different
+        processes share the same pages
+        """
+        with open(os.path.join(path, 'meta.json')) as infile:
+            meta = json.load(infile)
+        reader = cls.__new__(cls)
+        reader._init_state(meta['filename'], GcodeType(meta['filetype']))
+        reader.segs = SegmentStore(path)
+        reader.seg_index_bars = np.load(
+            os.path.join(path, 'seg_index_bars.npy')).tolist()
+        reader.layer_bounds = np.load(os.path.join(path, 'layer_bounds.npy'))
+        if os.path.exists(os.path.join(path, 'powers.npy')):
+            reader.powers = np.load(os.path.join(path, 'powers.npy'),
+                                    mmap_mode='r')
+        reader.n_layers = meta['n_layers']
+        reader.n_segs = meta['n_segs']
+        reader.xyzlimits = tuple(meta['xyzlimits'])
+        reader.stats = meta['stats']
+        reader.summary = reader.stats['segment_length']
+        reader.array_path = path
+        return reader
+
+    def __reduce_ex__(self, protocol):
+        # readers backed by arrays are pickled as the path of the arrays,
+        # so process pool workers attach to them instead of copying segs
+        if self.array_path is not None:
+            return (type(self).from_arrays, (self.array_path,))
+        return super().__reduce_ex__(protocol)
 
     def mesh(self, max_length):
-        """ mesh segments according to max_length """
-        self.elements = []
-        self.elements_index_bars = []
-        bar = 0
-        n_eles = 0
+        """
+        mesh segments according to max_length
+        self.elements becomes a recarray of ELEMENT_DTYPE with one record
+        per element, built with cumulative offsets instead of a python loop
+        and bit for bit equal to the elements of the loop
+        """
         if not hasattr(self, 'powers'):
             self.powers = [POWER_ZERO + 10] * len(self.segs)
-        for i, (x0, y0, x1, y1, z) in enumerate(self.segs):
-            if i == self.seg_index_bars[bar]:
-                bar += 1
-                self.elements_index_bars.append(n_eles)
-            power = self.powers[i]
-            if power < POWER_ZERO:
-                continue
-            length = np.hypot(x0 - x1, y0 - y1)
-            n_slices = int(np.ceil(length / max_length))
-            n_eles += n_slices
-            dx = (x1 - x0) / n_slices
-            dy = (y1 - y0) / n_slices
-            for _ in range(n_slices - 1):
-                # self.elements.append((x0, y0, x0 + dx, y0 + dy, z))
-                self.elements.append(Element(x0, y0, x0 + dx, y0 + dy, z))
-                x0, y0 = x0 + dx, y0 + dy
-            # self.elements.append((x0, y0, x1, y1, z))
-            self.elements.append(Element(x0, y0, x1, y1, z))
-        self.elements_index_bars.append(n_eles)
-        # print(self.elements_index_bars)
+        segs = np.asarray(self.segs, dtype=float).reshape(-1, 5)
+        x0, y0, x1, y1, z = segs.T
+        keep = np.asarray(self.powers, dtype=float) >= POWER_ZERO
+        lengths = np.hypot(x0 - x1, y0 - y1)
+        n_slices = np.where(keep, np.maximum(
+            np.ceil(lengths / max_length), 1), 0).astype(int)
+        offsets = np.concatenate(([0], np.cumsum(n_slices)))
+        n_eles = int(offsets[-1])
+
+        # segment and slice number of every element
+        seg_idx = np.repeat(np.arange(len(segs)), n_slices)
+        k = np.arange(n_eles) - offsets[seg_idx]
+        n = n_slices[seg_idx]
+        dx = (x1 - x0)[seg_idx] / n
+        dy = (y1 - y0)[seg_idx] / n
+        last = k == n - 1
+
+        # slice starts are running sums x0 + dx + dx ... like the original
+        # loop, x0 + k * dx differs in the last bits and changes which of
+        # equally distant neighbors wins; one step per slice rank, over all
+        # segments with that many slices at once
+        xs = x0[seg_idx]
+        ys = y0[seg_idx]
+        order = np.argsort(k, kind='stable')
+        rank_bars = np.concatenate(([0], np.cumsum(np.bincount(k))))
+        for rank in range(1, len(rank_bars) - 1):
+            idx = order[rank_bars[rank]:rank_bars[rank + 1]]
+            xs[idx] = xs[idx - 1] + dx[idx - 1]
+            ys[idx] = ys[idx - 1] + dy[idx - 1]
+
+        self.elements = np.recarray(n_eles, dtype=ELEMENT_DTYPE)
+        self.elements.x0 = xs
+        self.elements.y0 = ys
+        # the last slice ends exactly on the segment end point
+        self.elements.x1 = np.where(last, x1[seg_idx], xs + dx)
+        self.elements.y1 = np.where(last, y1[seg_idx], ys + dy)
+        self.elements.z = z[seg_idx]
+        self.elements_index_bars = offsets[self.seg_index_bars].tolist()
         print("Meshing finished, {:d} elements generated".
               format(len(self.elements)))
 
+    def element_coords(self, left=0, right=None):
+        """ elements in [left, right) as a float array of shape (n, 5) """
+        return self.elements[left:right].view(float).reshape(-1, 5)
+
     def plot_mesh_layer(self, layernum, ax=None):
         """ plot mesh in one layer """
-        if not self.elements:
+        if self.elements is None:
             self.mesh(max_length=MAX_ELEMENT_LENGTH)
         fig, ax = self.plot_layer(layer=layernum)
         # if not ax:
         #    fig, ax = create_axis(projection='2d')
         left, right = self.elements_index_bars[layernum - 1:layernum + 1]
         print(left, right)
-        for x0, y0, x1, y1, _ in self.elements[left:right]:
-            # ax.plot([x0, x1], [y0, y1], 'b-')
-            # ax.scatter(0.5 * (x0 + x1), 0.5 * (y0 + y1), s=4, color='r')
-            ax.plot([0.5 * (x0 + x1)], [0.5 * (y0 + y1)], 'ro', markersize=4)
+        es = self.element_coords(left, right)
+        # all element centers in a single draw call
+        ax.plot(0.5 * (es[:, 0] + es[:, 2]), 0.5 * (es[:, 1] + es[:, 3]),
+                'ro', markersize=4)
         return fig, ax
 
     def convert_to_scode(self):
@@ -296,14 +1313,19 @@ class GcodeReader:
 
     def plot_mesh(self, ax=None):
         """ plot mesh """
-        if not self.elements:
-            self.mesh()
+        from mpl_toolkits.mplot3d.art3d import Line3DCollection
+        if self.elements is None:
+            self.mesh(max_length=MAX_ELEMENT_LENGTH)
         if not ax:
             fig, ax = create_axis(projection='3d')
-        for x0, y0, x1, y1, z in self.elements:
-            ax.plot([x0, x1], [y0, y1], [z, z], 'b-')
-            ax.scatter(0.5 * (x0 + x1), 0.5 * (y0 + y1), z, 'r', s=4,
-                       color='r')
+        else:
+            fig = ax.figure
+        es = self.elements
+        lines = np.stack((np.column_stack((es.x0, es.y0, es.z)),
+                          np.column_stack((es.x1, es.y1, es.z))), axis=1)
+        ax.add_collection3d(Line3DCollection(lines, colors='b'))
+        ax.scatter(0.5 * (es.x0 + es.x1), 0.5 * (es.y0 + es.y1), es.z, s=4,
+                   color='r')
         return fig, ax
 
     def _read(self):
@@ -322,32 +1344,183 @@ class GcodeReader:
         else:
             print("file type is not supported")
             sys.exit(1)
-        self.xyzlimits = self._compute_xyzlimits(self.segs)
+        self._compute_aggregates()
+
+    def _new_segs(self):
+        """ container the parsers append segments to """
+        if self.store_path is not None:
+            return SegmentStoreWriter(self.store_path)
+        return []
+
+    def _finish_segs(self, segs):
+        """ turn the container filled by a parser into self.segs """
+        if isinstance(segs, SegmentStoreWriter):
+            return segs.close()
+        return np.array(segs)
 
     def _compute_xyzlimits(self, seg_list):
         """ compute axis limits of a segments list """
-        xmin, xmax = float('inf'), -float('inf')
-        ymin, ymax = float('inf'), -float('inf')
-        zmin, zmax = float('inf'), -float('inf')
-        for x0, y0, x1, y1, z in seg_list:
-            xmin = min(x0, x1) if min(x0, x1) < xmin else xmin
-            ymin = min(y0, y1) if min(y0, y1) < ymin else ymin
-            zmin = z if z < zmin else zmin
-            xmax = max(x0, x1) if max(x0, x1) > xmax else xmax
-            ymax = max(y0, y1) if max(y0, y1) > ymax else ymax
-            zmax = z if z > zmax else zmax
-        return (xmin, xmax, ymin, ymax, zmin, zmax)
+        segs = np.asarray(seg_list, dtype=float).reshape(-1, 5)
+        if len(segs) == 0:
+            inf = float('inf')
+            return (inf, -inf, inf, -inf, inf, -inf)
+        mins = segs.min(axis=0)
+        maxs = segs.max(axis=0)
+        return (min(mins[0], mins[2]), max(maxs[0], maxs[2]),
+                min(mins[1], mins[3]), max(maxs[1], maxs[3]),
+                mins[4], maxs[4])
+
+    def _segment_blocks(self, block_size=1 << 16):
+        """ yield (start, segs) blocks of self.segs as float64 (n, 5) arrays """
+        if isinstance(self.segs, SegmentStore):
+            yield from self.segs.blocks(block_size)
+        else:
+            yield 0, np.asarray(self.segs, dtype=float).reshape(-1, 5)
+
+    def _compute_aggregates(self):
+        """
+        compute xyzlimits, per-layer bounds and toolpath statistics in one
+        vectorized pass over self.segs, a block at a time, so that readers
+        backed by a SegmentStore never load the whole toolpath
+
+        layer_bounds is an array of shape (n_layers, 6) with the axis limits
+        of every layer in the order of xyzlimits, empty layers get inf/-inf
+        stats is a JSON serializable dict
+        """
+        bars = np.asarray(self.seg_index_bars)
+        bounds = np.empty((self.n_layers, 6))
+        bounds[:, 0::2] = np.inf
+        bounds[:, 1::2] = -np.inf
+        xyzlimits = np.array(self._compute_xyzlimits([]))
+        subpaths_per_layer = np.zeros(self.n_layers, dtype=int)
+        n_subpaths = 0
+        travel_length = 0.0
+        first_lengths = None
+        n_blocks = 0
+        prev = None
+        for start, segs in self._segment_blocks():
+            if len(segs) == 0:
+                continue
+            n_blocks += 1
+            block_limits = self._compute_xyzlimits(segs)
+            xyzlimits[0::2] = np.minimum(xyzlimits[0::2], block_limits[0::2])
+            xyzlimits[1::2] = np.maximum(xyzlimits[1::2], block_limits[1::2])
+            if n_blocks == 1:
+                first_lengths = np.hypot(segs[:, 2] - segs[:, 0],
+                                         segs[:, 3] - segs[:, 1])
+
+            # a segment starts a new subpath when it does not continue the
+            # previous one, the jump in between is a nozzle travel
+            ext = segs if prev is None else np.vstack((prev, segs))
+            breaks = ((ext[1:, 0] != ext[:-1, 2]) | (ext[1:, 1] != ext[:-1, 3])
+                      | (ext[1:, 4] != ext[:-1, 4]))
+            travel_length += float((np.abs(ext[1:, 0] - ext[:-1, 2]) +
+                                    np.abs(ext[1:, 1] - ext[:-1, 3]) +
+                                    np.abs(ext[1:, 4] - ext[:-1, 4]))[breaks].sum())
+            starts = breaks if prev is not None else np.concatenate(([True], breaks))
+            starts = starts.astype(int)
+            n_subpaths += int(starts.sum())
+            prev = segs[-1:]
+
+            # reduce over the parts of the layers that fall in this block
+            lefts = np.maximum(bars[:-1], start)
+            rights = np.minimum(bars[1:], start + len(segs))
+            inside = lefts < rights
+            if not inside.any():
+                continue
+            offsets = lefts[inside] - start
+            mins = np.column_stack((np.minimum(segs[:, 0], segs[:, 2]),
+                                    np.minimum(segs[:, 1], segs[:, 3]),
+                                    segs[:, 4]))
+            maxs = np.column_stack((np.maximum(segs[:, 0], segs[:, 2]),
+                                    np.maximum(segs[:, 1], segs[:, 3]),
+                                    segs[:, 4]))
+            bounds[inside, 0::2] = np.minimum(
+                bounds[inside, 0::2], np.minimum.reduceat(mins, offsets, axis=0))
+            bounds[inside, 1::2] = np.maximum(
+                bounds[inside, 1::2], np.maximum.reduceat(maxs, offsets, axis=0))
+            subpaths_per_layer[inside] += np.add.reduceat(starts, offsets)
+
+        if n_blocks <= 1:
+            self.lengths = first_lengths if n_blocks else np.empty(0)
+            self.summary = summarize(self.lengths)
+            path_length = float(self.lengths.sum())
+        else:
+            # too many segments to keep every length, summarize in passes
+            self.lengths = None
+            self.summary = summarize_blocks(
+                lambda: (np.hypot(segs[:, 2] - segs[:, 0], segs[:, 3] - segs[:, 1])
+                         for _, segs in self._segment_blocks()))
+            path_length = self.summary['mean'] * self.summary['count']
+
+        def finite(v):
+            return float(v) if np.isfinite(v) else None
+
+        self.xyzlimits = tuple(float(v) for v in xyzlimits)
+        self.layer_bounds = bounds
+        self.stats = {
+            'n_segments': int(len(self.segs)),
+            'n_layers': int(self.n_layers),
+            'n_subpaths': n_subpaths,
+            'path_length': path_length,
+            'travel_length': travel_length,
+            'segment_length': self.summary,
+            'segments_per_layer': np.diff(bars).tolist(),
+            'subpaths_per_layer': subpaths_per_layer.tolist(),
+            'xyzlimits': [finite(v) for v in self.xyzlimits],
+            'power_range': None,
+        }
+        if hasattr(self, 'powers') and len(self.powers):
+            self.stats['power_range'] = [float(np.min(self.powers)),
+                                         float(np.max(self.powers))]
+
+    def segment_grid(self, layer):
+        """ SegmentGrid over the segments of a layer, built on first use """
+        if layer < 1 or layer > self.n_layers:
+            raise LayerError("Layer number is invalid!")
+        if layer not in self._segment_grids:
+            left, right = self.seg_index_bars[layer - 1:layer + 1]
+            segs = np.asarray(self.segs[left:right], dtype=float).reshape(-1, 5)
+            boxes = np.column_stack((np.minimum(segs[:, 0], segs[:, 2]),
+                                     np.minimum(segs[:, 1], segs[:, 3]),
+                                     np.maximum(segs[:, 0], segs[:, 2]),
+                                     np.maximum(segs[:, 1], segs[:, 3])))
+            self._segment_grids[layer] = SegmentGrid(boxes,
+                                                     segments=segs[:, :4])
+        return self._segment_grids[layer]
+
+    def query_region(self, layer, xmin, ymin, xmax, ymax):
+        """
+        indexes into self.segs of the segments of a layer crossing the
+        region [xmin, xmax] X [ymin, ymax]
+        """
+        if not self.layer_intersects(layer, xmin, ymin, xmax, ymax):
+            return np.zeros(0, dtype=int)
+        left = self.seg_index_bars[layer - 1]
+        return left + self.segment_grid(layer).query(xmin, ymin, xmax, ymax)
+
+    def layer_intersects(self, layer, xmin, ymin, xmax, ymax):
+        """ check if the bounding box of a layer intersects a region """
+        lxmin, lxmax, lymin, lymax, _, _ = self.layer_bounds[layer - 1]
+        return lxmin <= xmax and lxmax >= xmin and lymin <= ymax and lymax >= ymin
+
+    def layers_in_region(self, xmin, ymin, xmax, ymax):
+        """ layer numbers whose bounding box intersects a region """
+        b = self.layer_bounds
+        hit = ((b[:, 0] <= xmax) & (b[:, 1] >= xmin) &
+               (b[:, 2] <= ymax) & (b[:, 3] >= ymin))
+        return np.flatnonzero(hit) + 1
 
     def _read_lpbf_regular(self):
         """ read regular LPBF gcode """
-        with open(self.filename, 'r') as infile:
+        with open_gcode(self.filename) as infile:
             # read nonempty lines
             lines = (line.strip() for line in infile.readlines()
                      if line.strip())
             # only keep line that starts with 'N'
             lines = (line for line in lines if line.startswith('N'))
         # pp.pprint(lines) # for debug
-        self.segs = []
+        self.segs = self._new_segs()
         self.powers = []
         temp = -float('inf')
         ngxyzfl = [temp, temp, temp, temp, temp, temp, temp]
@@ -370,7 +1543,7 @@ class GcodeReader:
                 self.powers.append(ngxyzfl[-1])
                 seg_count += 1
         self.n_segs = len(self.segs)
-        self.segs = np.array(self.segs)
+        self.segs = self._finish_segs(self.segs)
         self.seg_index_bars.append(self.n_segs)
         # print(self.n_layers)
         # print(self.powers)
@@ -378,14 +1551,14 @@ class GcodeReader:
 
     def _read_lpbf_scode(self):
         """ read LPBF scode """
-        with open(self.filename, 'r') as infile:
+        with open_gcode(self.filename) as infile:
             # read nonempty lines
             lines = (line.strip() for line in infile.readlines()
                     if line.strip())
             # only keep line that not starts with '#'
             lines = (line for line in lines if not line.startswith('#'))
         # pp.pprint(lines) # for debug
-        self.segs = []
+        self.segs = self._new_segs()
         self.powers = []
         seg_count = 0
         old_z = -np.inf
@@ -399,64 +1572,134 @@ class GcodeReader:
             self.powers.append(power)
             seg_count += 1
         self.n_segs = len(self.segs)
-        self.segs = np.array(self.segs)
+        self.segs = self._finish_segs(self.segs)
         # print(self.segs)
         self.seg_index_bars.append(self.n_segs)
         assert(len(self.seg_index_bars) - self.n_layers == 1)
 
     def _read_fdm_regular(self):
         """ read fDM regular gcode type """
-        with open(self.filename, 'r') as infile:
-            # read nonempty lines
-            lines = (line.strip() for line in infile.readlines()
-                     if line.strip())
-            # only keep line that starts with 'G'
-            # lines = (line for line in lines if line.startswith('G'))
-            new_lines = []
-            for line in lines:
-                if line.startswith('G'):
-                    idx = line.find(';')
-                    if idx != -1:
-                        line = line[:idx]
-                    new_lines.append(line)
-            lines = new_lines
-        # pp.pprint(lines) # for debug
-        self.segs = []
-        temp = -float('inf')
-        gxyzef = [temp, temp, temp, temp, temp, temp]
-        d = dict(zip(['G', 'X', 'Y', 'Z', 'E', 'F'], range(6)))
-        seg_count = 0
+        if self.layer_range is not None:
+            self.layer_index = LayerIndex.scan(self.filename)
+            if (self.layer_index is not None and
+                    self._read_fdm_regular_layers(*self.layer_range)):
+                return
+        if (self.workers > 1 and
+                os.path.getsize(self.filename) >= PARALLEL_MIN_BYTES and
+                compression(self.filename) is None):
+            self._read_fdm_regular_parallel()
+        else:
+            self.segs = self._new_segs()
+            with open_gcode(self.filename) as infile:
+                # parse lines one at a time instead of reading them all
+                layer_starts, _, _ = parse_fdm_regular(
+                    fdm_lines(infile), self.segs,
+                    arc_tolerance=self.arc_tolerance)
+            self.n_layers += len(layer_starts)
+            self.seg_index_bars.extend(layer_starts)
+            self.n_segs = len(self.segs)
+            self.segs = self._finish_segs(self.segs)
+        self.seg_index_bars.append(self.n_segs)
+        assert(len(self.seg_index_bars) - self.n_layers == 1)
+        if self.layer_range is not None:
+            # no layer comments or relative moves before the range, fall
+            # back to the layers found by parsing
+            self._trim_layers(*self.layer_range)
+
+    def _read_fdm_regular_parallel(self):
+        """
+        parse an FDM regular file with a pool of self.workers processes,
+        a few byte ranges per worker, and stitch the ranges in file order
+
+        a layer starts at the first extruding move above every earlier
+        one, so the layer starts of a chunk are the ones it found on its
+        own that are also above the highest layer of the chunks before it
+
+        a chunk whose start state cannot be recovered by its worker, after
+        relative moves, is parsed here from the end state of the previous one
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        # workers are not forked from the caller, a fork of a threaded
+        # process (OctoPrint) can inherit a lock held by another thread
+        # and deadlock on it
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            # workers fork from a server that has imported the reader once
+            context.set_forkserver_preload([__name__])
+        else:
+            context = multiprocessing.get_context('spawn')
+        offsets = chunk_offsets(self.filename, 4 * self.workers,
+                                self.layer_index or LayerIndex.scan(self.filename))
+        parts = self._new_segs()
         mx_z = -math.inf
-        for line in lines:
-            old_gxyzef = gxyzef[:]
-            for token in line.split():
-                gxyzef[d[token[0]]] = float(token[1:])
-            """
-            # if gxyzef[3] > old_gxyzef[3]:  # z value
-            # it may lift z in the beginning or during the printing process
-            if gxyzef[4] > old_gxyzef[4] and gxyzef[3] > mx_z:
-                mx_z = gxyzef[3]
-                # print(gxyzef[3], old_gxyzef[3])
+        state = None
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 mp_context=context) as executor:
+            results = executor.map(
+                parse_fdm_chunk, repeat(self.filename), offsets[:-1],
+                offsets[1:], repeat(None), repeat(self.arc_tolerance))
+            for start, end, result in zip(offsets[:-1], offsets[1:], results):
+                if result is None:
+                    result = parse_fdm_chunk(self.filename, start, end, state,
+                                             self.arc_tolerance)
+                segs, layer_starts, state = result
+                # layer starts of a chunk have increasing heights
+                zs = segs[layer_starts, 4]
+                self.seg_index_bars.extend(
+                    (layer_starts[zs > mx_z] + self.n_segs).tolist())
+                if len(zs):
+                    mx_z = max(mx_z, zs[-1])
+                self.n_segs += len(segs)
+                if isinstance(parts, SegmentStoreWriter):
+                    parts.extend(segs)
+                else:
+                    parts.append(segs)
+        self.n_layers = len(self.seg_index_bars)
+        if isinstance(parts, SegmentStoreWriter):
+            self.segs = parts.close()
+        else:
+            # same array as the sequential read, also when it is empty
+            self.segs = np.concatenate(parts) if self.n_segs else np.array([])
+
+    def _read_fdm_regular_layers(self, first, last):
+        """
+        read layers [first, last) of self.layer_index, parsing only their
+        bytes after recovering the parser state in effect where they start
+
+        returns False, without reading, when that state cannot be recovered
+        """
+        start, _ = self.layer_index.byte_range(first, last)
+        with open(self.filename, 'rb') as infile:
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                state = modal_state_before(buffer, start)
+            if state is None:
+                return False
+            self.segs = self._new_segs()
+            for layer in range(first, last):
                 self.n_layers += 1
-                self.seg_index_bars.append(seg_count)
-            """
-            if (gxyzef[0] == 1 and gxyzef[1:3] != old_gxyzef[1:3]
-                    and gxyzef[3] == old_gxyzef[3]
-                    and gxyzef[4] > old_gxyzef[4]):
-                # update layer here
-                # print(gxyzef[3], mx_z)
-                if gxyzef[3] > mx_z:
-                    mx_z = gxyzef[3]
-                    self.n_layers += 1
-                    self.seg_index_bars.append(seg_count)
-                x0, y0, z = old_gxyzef[1:4]
-                x1, y1 = gxyzef[1:3]
-                self.segs.append((x0, y0, x1, y1, z))
-                seg_count += 1
+                self.seg_index_bars.append(len(self.segs))
+                # layers come from the comments, not from Z increases
+                _, state, _ = parse_fdm_regular(
+                    fdm_lines(read_lines(infile, *self.layer_index.byte_range(layer, layer + 1))),
+                    self.segs, state, mx_z=math.inf,
+                    arc_tolerance=self.arc_tolerance)
         self.n_segs = len(self.segs)
-        self.segs = np.array(self.segs)
+        self.segs = self._finish_segs(self.segs)
         self.seg_index_bars.append(self.n_segs)
-        assert(len(self.seg_index_bars) - self.n_layers == 1)
+        self.first_layer = first
+        return True
+
+    def _trim_layers(self, first, last):
+        """ keep only layers [first, last) of a reader read in memory """
+        if not 1 <= first < last <= self.n_layers + 1:
+            raise LayerError("Layer number is invalid!")
+        left, right = self.seg_index_bars[first - 1], self.seg_index_bars[last - 1]
+        self.segs = self.segs[left:right]
+        self.seg_index_bars = [bar - left for bar in self.seg_index_bars[first - 1:last]]
+        self.n_layers = last - first
+        self.n_segs = right - left
+        self.first_layer = first
 
     def _read_fdm_stratasys(self):
         """ read stratasys fdm G-code file """
@@ -464,12 +1707,12 @@ class GcodeReader:
         self.is_supports = []
         self.styles = []
         self.deltTs = []
-        self.segs = []
+        self.segs = self._new_segs()
         temp = -float('inf')
         # x, y, z, area, deltaT, is_support, style
         xyzATPS = [temp, temp, temp, temp, temp, False, '']
         seg_count = 0
-        with open(self.filename, 'r') as in_file:
+        with open_gcode(self.filename) as in_file:
             lines = in_file.readlines()
             # means position denoted by the line is the start of subpath
             is_start = True
@@ -504,7 +1747,7 @@ class GcodeReader:
                     self.styles.append(xyzATPS[6])
                 start = False
             self.n_segs = len(self.segs)
-            self.segs = np.array(self.segs)
+            self.segs = self._finish_segs(self.segs)
             self.seg_index_bars.append(self.n_segs)
             # print(self.seg_index_bars)
 
@@ -538,6 +1781,84 @@ class GcodeReader:
             # print(self.segs)
 
 
+    def layer_subpaths(self, layer):
+        """
+        subpaths (xs, ys, zs) of one layer, found from the segments of that
+        layer only; same subpaths as _compute_subpaths, as numpy arrays
+        """
+        left, right = self.seg_index_bars[layer - 1], self.seg_index_bars[layer]
+        segs = np.asarray(self.segs[left:right], dtype=float).reshape(-1, 5)
+        if len(segs) == 0:
+            return []
+        breaks = np.flatnonzero((segs[1:, 0] != segs[:-1, 2]) |
+                                (segs[1:, 1] != segs[:-1, 3]) |
+                                (segs[1:, 4] != segs[:-1, 4])) + 1
+        bounds = np.concatenate(([0], breaks, [len(segs)]))
+        subpaths = []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            subpaths.append((np.append(segs[a, 0], segs[a:b, 2]),
+                             np.append(segs[a, 1], segs[a:b, 3]),
+                             np.full(b - a + 1, segs[a, 4])))
+        return subpaths
+
+    def lod_layer_subpaths(self, layer, tolerance):
+        """
+        subpaths of one layer simplified for drawing at a given tolerance
+
+        Args:
+            tolerance: size of one output pixel in path units; it is
+            rounded down to a power of two so that the result can be cached
+            per zoom level
+        """
+        level = math.floor(math.log2(tolerance))
+        layers = self._lod_cache.setdefault(level, {})
+        if layer not in layers:
+            tolerance = 2.0 ** level
+            subpaths = []
+            for xs, ys, zs in self.layer_subpaths(layer):
+                # drop detail that would fit inside one pixel
+                if (xs.max() - xs.min() < tolerance and
+                        ys.max() - ys.min() < tolerance):
+                    continue
+                keep = simplify_polyline(xs, ys, tolerance)
+                subpaths.append((xs[keep], ys[keep], zs[keep]))
+            layers[layer] = subpaths
+        return layers[layer]
+
+    def lod_subpaths(self, tolerance):
+        """
+        subpaths of every layer simplified for drawing at a given tolerance
+        returns subpaths, subpath_index_bars
+        """
+        subpaths = []
+        index_bars = [0]
+        for layer in range(1, self.n_layers + 1):
+            subpaths.extend(self.lod_layer_subpaths(layer, tolerance))
+            index_bars.append(len(subpaths))
+        return subpaths, index_bars
+
+    def lod_vertices(self, tolerance):
+        """
+        vertices of lod_subpaths stacked into one array, for projecting a
+        whole toolpath in one vectorized step
+        returns points, path_bars, subpath_index_bars
+
+        points is an (N, 3) array, subpath i spans
+        points[path_bars[i]: path_bars[i + 1]]
+        """
+        level = math.floor(math.log2(tolerance))
+        if level not in self._lod_vertex_cache:
+            subpaths, index_bars = self.lod_subpaths(tolerance)
+            if subpaths:
+                points = np.column_stack([np.concatenate(column)
+                                          for column in zip(*subpaths)])
+            else:
+                points = np.empty((0, 3))
+            lengths = [len(xs) for xs, _, _ in subpaths]
+            path_bars = np.concatenate(([0], np.cumsum(lengths)))
+            self._lod_vertex_cache[level] = (points, path_bars, index_bars)
+        return self._lod_vertex_cache[level]
+
     def _compute_center_distance(self, i, j):
         """compute center distance between element i and j."""
         n = len(self.elements)
@@ -596,71 +1917,96 @@ class GcodeReader:
 
 
     def compute_nearest_neighbors(self, layer=0):
-        """compute nearest neighbors for each element."""
-        if not self.elements:
+        """
+        compute nearest neighbors for each element.
+
+        candidates are limited to elements whose centers lie in adjacent
+        cells of a grid with cell size 2 * HALF_WIDTH * 2, the parallel,
+        distance and left tests are then evaluated for all candidates at once
+        and give the same result as the pairwise checks in
+        _is_element_nearly_parallel, _compute_center_distance,
+        _is_element_left and _compute_parallel_distance
+        """
+        if self.elements is None:
             self.mesh(max_length=MAX_ELEMENT_LENGTH)
         start_idx, end_idx = self.elements_index_bars[layer - 1:layer + 1]
-        INF = math.inf
-        left_neis = []
-        right_neis = []
-        print(start_idx, end_idx)
-        for i in range(start_idx, end_idx):
-            left_mn = INF
-            right_mn = INF
-            # left_is_left = 0
-            # right_is_left = 0
-            left_idx = -1
-            right_idx = -1
-            for j in range(start_idx, end_idx):
-                if j == i:
-                    continue
-                if (self._is_element_nearly_parallel(i, j, 0.0001) and
-                self._compute_center_distance(i, j) < 2.0 * HALF_WIDTH * 2):
-                    is_left = self._is_element_left(i, j)
-                    distance = self._compute_parallel_distance(i, j)
-                    if distance < 0.4 * HALF_WIDTH * 2:
-                        continue
-                    # print(distance, is_left)
-                    if is_left == 1:
-                        if distance < left_mn:
-                            left_idx = j
-                            left_mn = distance
-                    elif is_left == -1:
-                        if distance < right_mn:
-                            right_idx = j
-                            right_mn = distance
-            # print("{:d} {:f} {:f}".format(i, left_mn, right_mn))
-            # if left_mn > 5:
-            left_neis.append((left_idx, left_mn))
-            right_neis.append((right_idx, right_mn))
+        es = self.element_coords(start_idx, end_idx)
+        n = len(es)
+        radius = 2.0 * HALF_WIDTH * 2
+        cxs = 0.5 * (es[:, 0] + es[:, 2])
+        cys = 0.5 * (es[:, 1] + es[:, 3])
+        grid = SegmentGrid(np.column_stack((cxs, cys, cxs, cys)),
+                           cell_size=radius)
+        i, j = grid.neighbor_pairs()
+
+        # nearly parallel and close enough
+        dx1 = es[i, 2] - es[i, 0]
+        dy1 = es[i, 3] - es[i, 1]
+        dx2 = es[j, 2] - es[j, 0]
+        dy2 = es[j, 3] - es[j, 1]
+        cos_theta = np.abs((dx1 * dx2 + dy1 * dy2) / np.sqrt(
+            (dx1 * dx1 + dy1 * dy1) * (dx2 * dx2 + dy2 * dy2)))
+        center_distance = np.sqrt((cxs[i] - cxs[j]) ** 2 +
+                                  (cys[i] - cys[j]) ** 2)
+        close = (1 - cos_theta < 0.0001) & (center_distance < radius)
+        i, j = i[close], j[close]
+
+        # distance from the center of i to the line of j
+        ax, ay, bx, by = es[j, 0], es[j, 1], es[j, 2], es[j, 3]
+        x, y = cxs[i], cys[i]
+        distance = (np.abs((by - ay) * x - (bx - ax) * y + bx * ay - by * ax)
+                    / np.sqrt((ax - bx) ** 2 + (ay - by) ** 2))
+        far = distance >= 0.4 * HALF_WIDTH * 2
+        i, j, distance = i[far], j[far], distance[far]
+
+        # side of j relative to i
+        ax, ay, bx, by = es[i, 0], es[i, 1], es[i, 2], es[i, 3]
+        cross_product = (bx - ax) * (cys[j] - ay) - (cxs[j] - ax) * (by - ay)
+        is_left = np.where(np.abs(cross_product) < ZERO_TOLERANCE, 0,
+                           np.sign(cross_product))
+
+        def nearest(side):
+            # smallest distance per element, ties broken by the lowest index
+            mask = is_left == side
+            si, sj, sd = i[mask], j[mask], distance[mask]
+            order = np.lexsort((sj, sd, si))
+            si, sj, sd = si[order], sj[order], sd[order]
+            first = np.ones(len(si), dtype=bool)
+            first[1:] = si[1:] != si[:-1]
+            idxs = np.full(n, -1, dtype=int)
+            mns = np.full(n, math.inf)
+            idxs[si[first]] = sj[first] + start_idx
+            mns[si[first]] = sd[first]
+            return [(int(idx), float(mn)) for idx, mn in zip(idxs, mns)]
+
+        left_neis = nearest(1)
+        right_neis = nearest(-1)
         print("Finished computing left and right neighbors.")
         return left_neis, right_neis
 
 
     def plot_neighbors_layer(self, layer=0):
         """plot neighbors in a layer."""
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection
         left_neis, right_neis = self.compute_nearest_neighbors(layer)
         #"""
         fig, ax = self.plot_mesh_layer(layer)
         left, right = self.elements_index_bars[layer - 1:layer + 1]
         print(left, right)
-        es = self.elements
-        for idx, (x0, y0, x1, y1, _) in enumerate(self.elements[left:right]):
-            xc = 0.5 * (x0 + x1)
-            yc = 0.5 * (y0 + y1)
-            # ax.plot([0.5 * (x0 + x1)], [0.5 * (y0 + y1)], 'ro', markersize=1.5)
-            left_idx, left_mn = left_neis[idx]
-            if left_idx != -1:
-                lx = 0.5 * (es[left_idx].x0 + es[left_idx].x1)
-                ly = 0.5 * (es[left_idx].y0 + es[left_idx].y1)
-                # print(left_mn, math.sqrt((lx - xc) ** 2 + (ly - yc) ** 2),self._compute_parallel_distance(idx, left_idx))
-                ax.plot([xc, lx], [yc, ly], 'r-')
-            right_idx, right_mn = right_neis[idx]
-            if right_idx != -1:
-                rx = 0.5 * (es[right_idx].x0 + es[right_idx].x1)
-                ry = 0.5 * (es[right_idx].y0 + es[right_idx].y1)
-                # print(left_mn, math.sqrt((lx - xc) ** 2 + (ly - yc) ** 2),self._compute_parallel_distance(idx, left_idx))
-                ax.plot([xc, rx], [yc, ry], 'r-')
+        es = self.element_coords()
+        cxs = 0.5 * (es[:, 0] + es[:, 2])
+        cys = 0.5 * (es[:, 1] + es[:, 3])
+        links = []
+        for neis in (left_neis, right_neis):
+            idxs = np.array([idx for idx, _ in neis], dtype=int)
+            found = idxs != -1
+            src = np.arange(left, right)[found]
+            dst = idxs[found]
+            links.append(np.stack((np.column_stack((cxs[src], cys[src])),
+                                   np.column_stack((cxs[dst], cys[dst]))),
+                                  axis=1))
+        ax.add_collection(LineCollection(np.concatenate(links), colors='r'))
         #"""
         # plot histogram
         left_mns = [mn for idx, mn in left_neis if idx != -1]
@@ -680,39 +2026,31 @@ class GcodeReader:
 
     def plot_polygon_layer(self, layer):
         """plot element polygons in one layer. """
+        from matplotlib.collections import LineCollection
         left_neis, right_neis = self.compute_nearest_neighbors(layer)
         fig, ax = self.plot_mesh_layer(layer)
         left, right = self.elements_index_bars[layer - 1:layer + 1]
         # print(left, right)
-        es = self.elements
-        for idx, (sx, sy, ex, ey, _) in enumerate(self.elements[left:right]):
-            reverse = False
-            if sx > ex or ey < sy:
-                sx, sy, ex, ey = ex, ey, sx, sy
-                reverse = True
-            dx = ex - sx
-            dy = ey - sy
-            theta = np.arctan2(dy, dx)
-            beta = theta + np.pi / 2.0
-            lw = HALF_WIDTH
-            left_idx, left_mn = left_neis[idx]
-            if left_mn / 2 < lw:
-                lw = left_mn / 2
-            rw = HALF_WIDTH
-            right_idx, right_mn = right_neis[idx]
-            if right_mn / 2 < rw:
-                rw = right_mn / 2
-            if reverse:
-                lw, rw = rw, lw
-            x1 = sx - rw * np.cos(beta)
-            y1 = sy - rw * np.sin(beta)
-            x2 = ex - rw * np.cos(beta)
-            y2 = ey - rw * np.sin(beta)
-            x3 = ex + lw * np.cos(beta)
-            y3 = ey + lw * np.sin(beta)
-            x4 = sx + lw * np.cos(beta)
-            y4 = sy + lw * np.sin(beta)
-            ax.plot([x1, x2, x3, x4, x1], [y1, y2, y3, y4, y1], 'r-')
+        es = self.element_coords(left, right)
+        sx, sy, ex, ey = es[:, 0], es[:, 1], es[:, 2], es[:, 3]
+        reverse = (sx > ex) | (ey < sy)
+        sx, sy, ex, ey = (np.where(reverse, ex, sx), np.where(reverse, ey, sy),
+                          np.where(reverse, sx, ex), np.where(reverse, sy, ey))
+        theta = np.arctan2(ey - sy, ex - sx)
+        beta = theta + np.pi / 2.0
+        left_mns = np.array([mn for _, mn in left_neis])
+        right_mns = np.array([mn for _, mn in right_neis])
+        lw = np.minimum(HALF_WIDTH, left_mns / 2)
+        rw = np.minimum(HALF_WIDTH, right_mns / 2)
+        lw, rw = np.where(reverse, rw, lw), np.where(reverse, lw, rw)
+        cos_b, sin_b = np.cos(beta), np.sin(beta)
+        corners = [(sx - rw * cos_b, sy - rw * sin_b),
+                   (ex - rw * cos_b, ey - rw * sin_b),
+                   (ex + lw * cos_b, ey + lw * sin_b),
+                   (sx + lw * cos_b, sy + lw * sin_b)]
+        corners.append(corners[0])
+        polygons = np.stack([np.column_stack(c) for c in corners], axis=1)
+        ax.add_collection(LineCollection(polygons, colors='r'))
         return fig, ax
 
     def plot(self, color='blue', ax=None):
@@ -733,25 +2071,69 @@ class GcodeReader:
         ax.set_ylim(add_margin_to_axis_limits(ymin, ymax))
         return fig, ax
     
-    def plot_layers(self, min_layer, max_layer, color='white', ax=None):
-        """ plot the layers in [min_layer, max_layer) in 3D """
+    def plot_layers(self, min_layer, max_layer, color='white', ax=None,
+                    tolerance=None, region=None):
+        """
+        plot the layers in [min_layer, max_layer) in 3D
+        if tolerance is given, subpaths are simplified with lod_layer_subpaths
+        and drawn as one collection
+        if region (xmin, ymin, xmax, ymax) is given, layers outside of it
+        are culled
+        """
         if (min_layer >= max_layer or min_layer < 1 or max_layer >
                 self.n_layers + 1):
             raise LayerError("Layer number is invalid!")
-        self._compute_subpaths()
+        if not tolerance:
+            self._compute_subpaths()
         if not ax:
             fig, ax = create_axis(projection='3d')
-        left, right = (self.subpath_index_bars[min_layer - 1],
-                       self.subpath_index_bars[max_layer - 1])
-        for xs, ys, zs in self.subpaths[left: right]:
-            if SINGLE_COLOR:
-                ax.plot(xs, ys, zs, color=color)
-            else:
-                ax.plot(xs, ys, zs)
+        else:
+            fig = ax.figure
+        layers = range(min_layer, max_layer)
+        if region is not None:
+            layers = [layer for layer in layers
+                      if self.layer_intersects(layer, *region)]
+        if tolerance:
+            self._plot_lod_layers(layers, tolerance, color, ax)
+            return fig, ax
+        for layer in layers:
+            left, right = (self.subpath_index_bars[layer - 1],
+                           self.subpath_index_bars[layer])
+            for xs, ys, zs in self.subpaths[left: right]:
+                if SINGLE_COLOR:
+                    ax.plot(xs, ys, zs, color=color)
+                else:
+                    ax.plot(xs, ys, zs)
         return fig, ax
 
+    def _plot_lod_layers(self, layers, tolerance, color, ax):
+        """
+        draw the simplified subpaths of layers as a single Line3DCollection
+        matplotlib's cost per artist outweighs the drawing of a short line,
+        so one Line3D per subpath would hide the gain of the simplification;
+        lines keep the style and colors ax.plot gives them
+        """
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d.art3d import Line3DCollection
+        # simplified layers are built on demand, so that only the drawn
+        # layers are read from a SegmentStore
+        lines = [np.column_stack(subpath) for layer in layers
+                 for subpath in self.lod_layer_subpaths(layer, tolerance)]
+        if not lines:
+            return
+        if SINGLE_COLOR:
+            colors = color
+        else:
+            cycle = plt.rcParams['axes.prop_cycle'].by_key()['color']
+            colors = [cycle[k % len(cycle)] for k in range(len(lines))]
+        ax.add_collection3d(Line3DCollection(
+            lines, colors=colors, linewidths=plt.rcParams['lines.linewidth'],
+            capstyle=plt.rcParams['lines.solid_capstyle'],
+            joinstyle=plt.rcParams['lines.solid_joinstyle']))
+
     def plot_layer(self, layer=1, ax=None):
         """ plot a specific layer in 2D """
+        from matplotlib.collections import LineCollection
         # make sure layer is in [1, self.n_layers]
         # layer = max(layer, 1)
         # layer = min(self.n_layers, layer)
@@ -778,78 +2160,46 @@ class GcodeReader:
         else:
             left, right = (self.seg_index_bars[layer - 1],
                     self.seg_index_bars[layer])
-            for (x1, y1, x2, y2, z), power in zip(self.segs, self.powers):
-                if power > POWER_ZERO:
-                    ax.plot([x1, x2], [y1, y2], 'r-')
-                else:
-                    if not IGNORE_ZERO_POWER:
-                        ax.plot([x1, x2], [y1, y2], 'b-')
+            segs = np.asarray(self.segs[left:right], dtype=float)
+            powers = np.asarray(self.powers[left:right])
+            lines = segs[:, :4].reshape(-1, 2, 2)
+            ax.add_collection(LineCollection(lines[powers > POWER_ZERO],
+                                             colors='r'))
+            if not IGNORE_ZERO_POWER:
+                ax.add_collection(LineCollection(lines[powers <= POWER_ZERO],
+                                                 colors='b'))
+            ax.autoscale_view()
         ax.axis('equal')
         return fig, ax
 
     def describe_mesh(self, max_length):
         """print basic information of meshing"""
-        if not self.elements:
+        if self.elements is None:
             self.mesh(max_length)
-        self.mesh_lengths = [np.hypot(x1 - x0, y1 - y0) for x0, y0, x1, y1, _
-                             in self.elements]
-        series = pd.Series(self.mesh_lengths)
+        self.mesh_lengths = np.hypot(self.elements.x1 - self.elements.x0,
+                                     self.elements.y1 - self.elements.y0)
         print('1. Element length information:')
-        print(series.describe())
+        print_summary(summarize(self.mesh_lengths))
         print('2. Number of layers: {:d}'.format(self.n_layers))
-        data = {'# elements': np.array(self.elements_index_bars[1:]) -
-                np.array(self.elements_index_bars[:-1]),
-                'layer': np.arange(1, self.n_layers + 1),
-                }
-        df = pd.DataFrame(data)
-        df = df.set_index('layer')
-        print(df)
+        print_layer_table({'# elements': np.diff(self.elements_index_bars)})
 
     def describe(self):
-        """print basic information of process plan"""
-        if not self.summary:
-            self.lengths = [np.hypot(x1 - x0, y1 - y0) for x0, y0, x1, y1, _
-                            in self.segs]
-            series = pd.Series(self.lengths)
-            self.summary = series.describe()
+        """print basic information of process plan, see self.stats"""
+        stats = self.stats
         print('1. Line segments information: ')
-        print(self.summary)
-        print('2. Number of layers: {:d}'.format(self.n_layers))
-        self._compute_subpaths()
-        assert(len(self.seg_index_bars) == len(self.subpath_index_bars))
-        """
-        try:
-            assert(len(self.seg_index_bars) == len(self.subpath_index_bars))
-        except:
-            print(len(self.seg_index_bars))
-            print(len(self.subpath_index_bars))
-            print(self.n_layers)
-        """
-        data = {'# segments': np.array(self.seg_index_bars[1:]) -
-                np.array(self.seg_index_bars[:-1]),
-                'layer': np.arange(1, self.n_layers + 1),
-                '# subpaths': np.array(self.subpath_index_bars[1:]) -
-                np.array(self.subpath_index_bars[:-1]),
-                }
-        df = pd.DataFrame(data)
-        df = df.set_index('layer')
-        print(df)
+        print_summary(stats['segment_length'])
+        print('2. Number of layers: {:d}'.format(stats['n_layers']))
+        print_layer_table({'# segments': stats['segments_per_layer'],
+                           '# subpaths': stats['subpaths_per_layer']})
         print('3. Other information: ')
-        print('Total path length equals {:0.4f}.'.format(sum(self.lengths)))
-        # compute total travel lengths
-        travels = []
-        for i in range(len(self.subpaths) - 1):
-            xsi, ysi, zsi = self.subpaths[i]
-            xsj, ysj, zsj = self.subpaths[i + 1]
-            travels.append(abs(xsj[0] - xsi[-1]) + abs(ysj[0] - ysi[-1])
-                           + abs(zsj[0] - zsi[-1]))
-        print("Total travel length equals {:0.4f}.".format(sum(travels)))
+        print('Total path length equals {:0.4f}.'.format(stats['path_length']))
+        print("Total travel length equals {:0.4f}.".format(
+            stats['travel_length']))
         if self.filetype == GcodeType.LPBF_REGULAR or self.filetype == GcodeType.LPBF_SCODE:
-            print("Laser power range [{}, {}]".format(
-                min(self.powers), max(self.powers)))
+            print("Laser power range [{}, {}]".format(*stats['power_range']))
         print("Number of nozzle travels equals {:d}.".format(
-            len(self.subpaths)))
-        print("Number of subpaths equals {:d}.".format(len(self.subpaths)))
+            stats['n_subpaths']))
+        print("Number of subpaths equals {:d}.".format(stats['n_subpaths']))
         print("X, Y and Z limits: [{:0.2f}, {:0.2f}] X [{:0.2f}, {:0.2f}] X [{:0.2f}, {:0.2f}]".format(
             *self.xyzlimits))
 
@@ -857,6 +2207,7 @@ class GcodeReader:
         """
         animate the printing of a specific layer in 2D
         """
+        import matplotlib.pyplot as plt
         if layer < 1 or layer > self.n_layers:
             raise LayerError("Layer number is invalid!")
         fig, ax = create_axis(projection='2d')
@@ -901,6 +2252,7 @@ class GcodeReader:
         max_layer)
         implement with plt.pause() and plt.draw()
         """
+        import matplotlib.pyplot as plt
         if max_layer is None:
             max_layer = self.n_layers + 1
         if (min_layer >= max_layer or min_layer < 1 or max_layer >
@@ -946,6 +2298,9 @@ def get_parser():
                         type=int, help='plot the mesh of a layer in 2D')
     parser.add_argument('-p', '--plot', dest='plot3d', action='store_true',
                         help='plot the whole part')
+    parser.add_argument('-j', '--jobs', dest='workers', action='store',
+                        type=int, default=1,
+                        help='parse FDM regular files with this many processes')
     parser.add_argument('-s', '--save', dest='outfile', action='store',
                         help='specify the path of output file')
     ### below part is in construction
@@ -962,6 +2317,7 @@ def get_parser():
 
 def command_line_runner():
     """ command line runner """
+    import matplotlib.pyplot as plt
     # 1. parse arguments
     parser = get_parser()
     args = parser.parse_args()
@@ -977,7 +2333,8 @@ def command_line_runner():
     else:
         filetype = GcodeType(args.filetype)
     # construct Gcode Reader object
-    gcode_reader = GcodeReader(filename=args.gcode_file, filetype=filetype)
+    gcode_reader = GcodeReader(filename=args.gcode_file, filetype=filetype,
+                               workers=args.workers)
 
     # 3. print out some statistic information to standard output
     gcode_reader.describe()
@@ -0,0 +1,142 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# Upper bounds in seconds of the duration histogram buckets, from a cached lookup to a full
+# render of a large job on a Raspberry Pi
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                     for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metrics:
+    """
+    Durations, counters and gauges of the render pipeline, exported in the Prometheus text format.
+
+    Durations are histograms keyed by name and labels, counters only increase and gauges are read
+    from a callable when exported, so queue depths cost nothing between two scrapes. Recording takes
+    a lock and a few additions, it is cheap enough to stay on in production. When ``logger`` is set,
+    every duration is also logged as a line of key=value pairs.
+    """
+
+    def __init__(self, namespace="hologram", buckets=DURATION_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(buckets)
+        self.logger = None
+        self._lock = threading.Lock()
+        self._durations = {}  # (name, labels) -> [bucket counts..., overflow count, count, sum]
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}  # (name, labels) -> callable
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, seconds, **labels):
+        """Record a duration in the histogram name{labels}."""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._durations.get(key)
+            if histogram is None:
+                histogram = self._durations[key] = [0] * (len(self.buckets) + 3)
+            histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+        if self.logger is not None:
+            fields = " ".join(f"{label}={value}" for label, value in key[1])
+            self.logger.info(f"metric={self.namespace}_{name} {fields} seconds={seconds:.6f}")
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Context manager recording the duration of its block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def stage(self, stage):
+        """Timer of one stage of the render pipeline (snapshot fetch, parse, draw, encode...)."""
+        return self.timer("stage_seconds", stage=stage)
+
+    def count(self, name, amount=1, **labels):
+        """Increase the counter name{labels}."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def cache(self, cache, hit):
+        """Count a hit or a miss of one of the caches."""
+        self.count("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    def gauge(self, name, read, **labels):
+        """Register read, a callable returning the current value of the gauge name{labels}."""
+        with self._lock:
+            self._gauges[self._key(name, labels)] = read
+
+    def reset(self):
+        """Forget recorded durations and counters, registered gauges are kept."""
+        with self._lock:
+            self._durations.clear()
+            self._counters.clear()
+
+    def prometheus(self):
+        """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            durations = {key: list(histogram) for key, histogram in self._durations.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        lines = []
+        written = set()
+
+        def header(name, kind):
+            if name not in written:
+                written.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in sorted(durations.items()):
+            metric = f"{self.namespace}_{name}"
+            header(metric, "histogram")
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), histogram):
+                cumulative += bucket
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(f"{metric}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram[-2]}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {_format_value(histogram[-1])}")
+
+        for (name, labels), value in sorted(counters.items()):
+            metric = f"{self.namespace}_{name}"
+            header(metric, "counter")
+            lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), read in sorted(gauges.items(), key=lambda item: item[0]):
+            try:
+                value = read()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            metric = f"{self.namespace}_{name}"
+            header(metric, "gauge")
+            lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of the plugin process, shared by the request handlers and the render workers
+REGISTRY = Metrics()
@@ -0,0 +1,121 @@
+import threading
+import time
+
+from octoprint_hologram.fast_ssim import ReferenceSSIM
+
+
+class PrintMonitor:
+    """
+    Background loop that periodically compares the webcam frame against the
+    expected render of the layers printed so far.
+
+    The expected image for a layer is built once (through ``reference``) and
+    reduced to a ReferenceSSIM over its region of interest, so each tick only
+    has to fetch, crop and downsample the live frame.
+    """
+
+    def __init__(self, snapshot, reference, interval=30, downscale=0.25, cpu_budget=0.1, logger=None):
+        """
+        Args:
+        - snapshot: Callable returning the current webcam frame as a PIL image.
+        - reference: Callable taking a layer number and returning a tuple of
+          (expected PIL image, roi) where roi is (min_x, min_y, max_x, max_y)
+          in frame coordinates, or None when there is nothing to compare yet.
+        - interval: Minimum number of seconds between two comparisons.
+        - downscale: Factor applied to the ROI crops before comparison.
+        - cpu_budget: Fraction of wall time the loop may spend working.
+        """
+        self._snapshot = snapshot
+        self._reference = reference
+        self.interval = interval
+        self.downscale = downscale
+        self.cpu_budget = cpu_budget
+        self._logger = logger
+
+        self.layer = 0
+        self.store = None  # MetricRingBuffer receiving ssim and render_time records
+
+        self._cached_layer = None
+        self._pending_render_time = None
+        self._cached_reference = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, store):
+        """Start the monitoring thread, recording into store (a MetricRingBuffer)."""
+        self.stop()
+        with self._lock:
+            self.layer = 0
+            self.store = store
+            self._cached_layer = None
+            self._cached_reference = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="hologram-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the monitoring thread and wait for it to exit."""
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        if self.store is not None:
+            self.store.flush()
+
+    def set_layer(self, layer):
+        """Update the layer currently being printed."""
+        with self._lock:
+            self.layer = layer
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.compare_once()
+            except Exception as e:
+                if self._logger:
+                    self._logger.error(f"Print monitor comparison failed: {e}")
+            elapsed = time.monotonic() - started
+
+            # Stretch the wait when a comparison was slow so the loop stays within its CPU budget
+            wait = max(self.interval, elapsed / self.cpu_budget - elapsed) if self.cpu_budget > 0 else self.interval
+            self._stop_event.wait(wait)
+
+    def compare_once(self):
+        """Compare the current frame with the expected render, returning the SSIM or None."""
+        with self._lock:
+            layer = self.layer
+
+        reference = self._get_reference(layer)
+        if reference is None:
+            return None
+
+        score = reference.compare(self._snapshot())
+
+        # The render time is only known on the first comparison of a layer
+        render_time, self._pending_render_time = self._pending_render_time, None
+        if self.store is not None:
+            self.store.append(time.time(), layer, ssim=score,
+                              render_time=render_time if render_time is not None else float("nan"))
+        return score
+
+    def _get_reference(self, layer):
+        # The expected render only changes between layers, so build it once per layer
+        if layer == self._cached_layer:
+            return self._cached_reference
+
+        started = time.monotonic()
+        reference = self._reference(layer)
+        if reference is not None:
+            expected_image, roi = reference
+            reference = ReferenceSSIM(expected_image, roi=roi, downscale=self.downscale)
+            self._pending_render_time = time.monotonic() - started
+
+        self._cached_layer = layer
+        self._cached_reference = reference
+        return reference
@@ -0,0 +1,388 @@
+import collections
+import io
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from octoprint_hologram import utils
+from octoprint_hologram.metrics import REGISTRY as metrics
+
+# Settings a render depends on, copied from the plugin settings when a request arrives so a
+# render never sees values changed by a concurrent request
+RenderSettings = collections.namedtuple('RenderSettings', ['printer_dims', 'slider_values', 'color'])
+
+
+class RenderPoolBusy(Exception):
+    """Raised when the render queue is full."""
+    pass
+
+
+class RenderPool:
+    """
+    Bounded pool of render worker threads.
+
+    At most ``workers`` renders run at once and at most ``max_queue`` more wait for a worker;
+    further submissions raise RenderPoolBusy instead of piling up.
+    """
+
+    def __init__(self, workers=1, max_queue=2):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hologram-render")
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._pending = 0
+        self._futures = set()  # Submitted and not done, cancelled on shutdown
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Number of renders running or waiting."""
+        with self._lock:
+            return self._pending
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule fn on a worker and return its Future, raising RenderPoolBusy when the queue is full."""
+        if not self._slots.acquire(blocking=False):
+            raise RenderPoolBusy("Render queue is full.")
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn on a worker and wait for its result."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self):
+        """Cancel the waiting renders and stop the workers without waiting for the running ones."""
+        # Cancelled by hand, shutdown(cancel_futures=True) needs Python 3.9
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+
+_worker_state = threading.local()
+
+# Configured figures kept per worker thread, each one holds a full Agg canvas
+VIEW_CACHE_SIZE = 4
+
+# Canvas the calibration is fitted on (utils.optimize_projection): 6.4 x 4.8 inches at 100 DPI.
+# The calibrated scale is the size of the overlay on the snapshot relative to this canvas.
+BASE_SIZE = (6.4, 4.8)
+BASE_DPI = 100
+
+
+class CameraView:
+    """
+    Figure and 3D axes configured for one camera, reused across renders.
+
+    Axis limits, box aspect, projection and view angles only depend on the printer
+    dimensions and slider values, so they are set once; each render only removes
+    the data artists of the previous one and draws its own.
+
+    The figure is rendered at its final size on the snapshot: the calibration canvas
+    with its DPI multiplied by the calibrated scale, so the overlay is pasted without
+    resampling and the anchor is already in snapshot pixels.
+    """
+
+    def __init__(self, printer_dims, slider_values, size=BASE_SIZE, dpi=BASE_DPI):
+        self.fig = utils.new_figure()
+        self.fig.set_size_inches(*size)
+        self.fig.set_dpi(dpi)
+        self.ax = self.fig.add_subplot(111, projection='3d')
+
+        printer_length, printer_width, printer_depth = printer_dims
+        self.grid_limits = [0, printer_length, 0, printer_width, 0, printer_depth]
+        utils.configure_axes(self.ax, self.grid_limits, *slider_values[:4])
+
+        # Place the axes as drawing will, so the anchor matches the one the calibration measured
+        # after drawing its canvas
+        self.ax.apply_aspect()
+
+        # Anchor of the bed center and pixel footprint, also fixed by the camera
+        self.anchor = utils.get_pixel_coords(self.ax, printer_length / 2, printer_width / 2, 0)
+        self.mm_per_pixel = utils.bed_mm_per_pixel(self.ax, printer_length, printer_width)
+
+    def project(self, points):
+        """Pixel coordinates (origin top-left) of an (N, 3) array of points, see utils.get_pixel_coords_array."""
+        return utils.get_pixel_coords_array(self.ax, points)
+
+    def projection_matrix(self):
+        """
+        3x4 matrix taking homogeneous points (x, y, z, 1) to homogeneous pixel coordinates (origin top-left).
+
+        Composes the 3D projection of the axes with the affine data transform and the y flip of
+        get_pixel_coords, so u = (P @ p)[0] / (P @ p)[2] and v = (P @ p)[1] / (P @ p)[2] match project.
+        """
+        projection = self.ax.get_proj()[[0, 1, 3], :]
+        flip = np.array([[1.0, 0.0, 0.0], [0.0, -1.0, self.fig.bbox.height], [0.0, 0.0, 1.0]])
+        return flip @ self.ax.transData.get_affine().get_matrix() @ projection
+
+    def visible_region(self, zmin, zmax):
+        """
+        Bed area (xmin, ymin, xmax, ymax) holding everything between heights zmin and zmax that lands
+        on the canvas, or None when the view is not bounded there (a canvas corner looks above the horizon).
+
+        The rays through the canvas corners are intersected with the planes z = zmin and z = zmax; the
+        visible part of that slab lies within the convex hull of those 8 points, so their bounding box
+        is a conservative region for culling.
+        """
+        projection = self.projection_matrix()
+        width, height = self.fig.bbox.width, self.fig.bbox.height
+        points = []
+        for z in (zmin, zmax):
+            for u, v in ((0, 0), (width, 0), (0, height), (width, height)):
+                # Solve P @ (x, y, z, 1) = s * (u, v, 1) for x, y and the depth s
+                system = np.column_stack((projection[:, 0], projection[:, 1], -np.array([u, v, 1.0])))
+                try:
+                    x, y, depth = np.linalg.solve(system, -(projection[:, 2] * z + projection[:, 3]))
+                except np.linalg.LinAlgError:
+                    return None
+                if depth <= 0:
+                    return None
+                points.append((x, y))
+        xs, ys = zip(*points)
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def clear(self):
+        """Remove the lines and collections drawn by the previous render."""
+        for artist in list(self.ax.lines) + list(self.ax.collections):
+            artist.remove()
+        # Restart the color cycle so uncolored layers get the same colors on every render
+        self.ax.set_prop_cycle(None)
+
+    def save_png(self):
+        image = io.BytesIO()
+        self.fig.savefig(image, format='png', transparent=True, dpi=self.fig.dpi)
+        image.seek(0)
+        return image
+
+
+def output_size(scale):
+    """Pixel size of an overlay rendered at the calibrated scale."""
+    dpi = BASE_DPI * scale
+    return int(BASE_SIZE[0] * dpi), int(BASE_SIZE[1] * dpi)
+
+
+def camera_view(settings):
+    """
+    Cleared CameraView owned by the calling thread for the request's printer dimensions and slider values.
+
+    Views are kept in a small per-thread LRU cache keyed by (printer dims, slider values, output size),
+    so renders on different workers never share or close each other's figures.
+    """
+    cache = getattr(_worker_state, "views", None)
+    if cache is None:
+        cache = _worker_state.views = collections.OrderedDict()
+
+    scale = settings.slider_values[4]
+    key = (tuple(settings.printer_dims), tuple(settings.slider_values), output_size(scale))
+    view = cache.get(key)
+    metrics.cache("camera_view", view is not None)
+    if view is None:
+        view = CameraView(settings.printer_dims, settings.slider_values, dpi=BASE_DPI * scale)
+        cache[key] = view
+        while len(cache) > VIEW_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+        view.clear()
+    return view
+
+
+def render_toolpath(reader, settings, layer=-1):
+    """
+    Render layers [1, layer) of a parsed toolpath as a transparent PNG seen from the calibrated camera.
+
+    Args:
+    - reader: Parsed GcodeReader.
+    - settings: RenderSettings of the request.
+    - layer: Upper layer bound, -1 renders every layer.
+
+    Returns:
+    - Tuple of (PNG BytesIO at its final size on the snapshot, anchor pixel coordinates of the bed center,
+      ROI of the non-transparent pixels).
+    """
+    max_layer = reader.n_layers + 1
+    if layer == -1 or layer > max_layer:
+        layer = max_layer
+
+    view = camera_view(settings)
+
+    # Layers entirely off the canvas are neither simplified nor drawn
+    _, _, _, _, zmin, zmax = reader.xyzlimits
+    region = view.visible_region(zmin, zmax) if np.isfinite([zmin, zmax]).all() else None
+
+    # Simplify the toolpath to half a pixel of the overlay, the reader caches the simplified layers
+    # so drawing them below only builds artists
+    tolerance = 0.5 * view.mm_per_pixel
+    with metrics.stage("subpaths"):
+        for drawn_layer in range(1, layer):
+            if region is None or reader.layer_intersects(drawn_layer, *region):
+                reader.lod_layer_subpaths(drawn_layer, tolerance)
+    with metrics.stage("draw"):
+        reader.plot_layers(min_layer=1, max_layer=layer, color=settings.color, ax=view.ax, tolerance=tolerance,
+                           region=region)
+
+    # savefig rasterizes the figure and encodes the PNG in one call
+    with metrics.stage("png_encode"):
+        overlay_img = view.save_png()
+    with metrics.stage("roi"):
+        roi_coords = utils.find_non_transparent_roi(overlay_img)
+
+    overlay_img.seek(0)
+    return overlay_img, view.anchor, roi_coords
+
+
+# Projections of the last cameras asked for by browsers, shared by every thread
+PROJECTION_CACHE_SIZE = 32
+_projections = collections.OrderedDict()
+_projections_lock = threading.Lock()
+
+
+def camera_projection(settings):
+    """
+    Projection of the calibrated camera for browsers drawing the toolpath themselves.
+
+    Runs on the calling thread rather than on a RenderPool worker: configuring a CameraView takes
+    milliseconds and nothing is drawn, so a browser preview never waits behind server renders.
+
+    Returns:
+    - Tuple of (3x4 projection matrix, see CameraView.projection_matrix, anchor pixel coordinates
+      of the bed center, millimetres per overlay pixel).
+    """
+    key = (tuple(settings.printer_dims), tuple(settings.slider_values))
+    with _projections_lock:
+        projection = _projections.get(key)
+        if projection is not None:
+            _projections.move_to_end(key)
+    metrics.cache("camera_projection", projection is not None)
+    if projection is None:
+        # A view of its own, the per-thread views belong to the render workers
+        view = CameraView(settings.printer_dims, settings.slider_values, dpi=BASE_DPI * settings.slider_values[4])
+        projection = view.projection_matrix(), view.anchor, view.mm_per_pixel
+        with _projections_lock:
+            _projections[key] = projection
+            while len(_projections) > PROJECTION_CACHE_SIZE:
+                _projections.popitem(last=False)
+    return projection
+
+
+# Binary toolpath served to the browser, see toolpath_buffer
+TOOLPATH_MAGIC = b'HGTP'
+TOOLPATH_VERSION = 1
+TOOLPATH_HEADER = struct.Struct('<4s4I6f')
+
+
+def toolpath_buffer(reader, tolerance):
+    """
+    Simplified toolpath of a parsed G-code file packed for the browser.
+
+    Layout, little-endian:
+    - Header: magic b'HGTP', uint32 version, layer count, polyline count and vertex count,
+      float32 origin (x, y, z) and float32 step (x, y, z).
+    - uint32 layer bars: layers [1, k) are polylines [0, layer_bars[k - 1]).
+    - uint32 path bars: polyline i spans vertices [path_bars[i], path_bars[i + 1]).
+    - int16 x of every vertex, then every y, then every z, quantized over the toolpath bounds:
+      x = origin_x + (qx + 32768) * step_x.
+
+    Columns of small integers compress well, the buffer is meant to be served gzipped.
+
+    Args:
+    - reader: Parsed GcodeReader.
+    - tolerance: Simplification tolerance in millimetres, see GcodeReader.lod_vertices.
+    """
+    points, path_bars, layer_bars = reader.lod_vertices(tolerance)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+
+    if len(points):
+        origin = points.min(axis=0)
+        span = points.max(axis=0) - origin
+    else:
+        origin = span = np.zeros(3)
+    step = np.where(span > 0, span / 65535, 1.0)
+    quantized = (np.rint((points - origin) / step) - 32768).astype('<i2')
+
+    header = TOOLPATH_HEADER.pack(TOOLPATH_MAGIC, TOOLPATH_VERSION, len(layer_bars) - 1, len(path_bars) - 1,
+                                  len(points), *origin, *step)
+    return b''.join((header,
+                     np.asarray(layer_bars, dtype='<u4').tobytes(),
+                     np.asarray(path_bars, dtype='<u4').tobytes(),
+                     np.ascontiguousarray(quantized.T).tobytes()))
+
+
+def render_arrow(settings):
+    """Render the calibration arrow for the request's slider values, see utils.plot_arrow."""
+    view = camera_view(settings)
+    with metrics.stage("draw"):
+        utils.draw_arrow(view.ax, view.grid_limits)
+    with metrics.stage("png_encode"):
+        image = view.save_png()
+    return image, view.anchor
+
+
+def render_views(reader, settings, views, base_image, base_anchor, factor):
+    """
+    Draw the toolpath as seen from several candidate cameras onto thumbnails of the snapshot.
+
+    Nothing is rasterized by matplotlib: for each view the whole simplified toolpath is projected
+    in one vectorized step and drawn as polylines with PIL, which is cheap enough to preview
+    dozens of calibrations in one request.
+
+    Args:
+    - reader: Parsed GcodeReader, or None to only draw the bed outline.
+    - settings: RenderSettings of the request, its slider values are ignored.
+    - views: List of (elev, azim, roll, focal length, scale) tuples.
+    - base_image: Snapshot already resized to the thumbnail size.
+    - base_anchor: Bed center on the full-size snapshot.
+    - factor: Thumbnail size relative to the full-size snapshot.
+
+    Returns:
+    - List of RGB PIL thumbnails, one per view.
+    """
+    from PIL import ImageDraw
+
+    printer_length, printer_width, _ = settings.printer_dims
+    bed = np.array([(0, 0, 0), (printer_length, 0, 0), (printer_length, printer_width, 0),
+                    (0, printer_width, 0), (0, 0, 0)], dtype=float)
+
+    thumbnails = []
+    for view_values in views:
+        # One-off views are not put in the camera cache, they would evict the calibrated camera
+        view = CameraView(settings.printer_dims, view_values, dpi=BASE_DPI * view_values[4])
+        offset = np.subtract(base_anchor, view.anchor)
+
+        thumbnail = base_image.convert('RGB')
+        draw = ImageDraw.Draw(thumbnail)
+
+        if reader is not None:
+            # Simplify the toolpath to half a pixel of the thumbnail
+            points, path_bars, _ = reader.lod_vertices(0.5 * view.mm_per_pixel / factor)
+            pixels = (view.project(points) + offset) * factor
+            for left, right in zip(path_bars[:-1], path_bars[1:]):
+                draw.line(pixels[left:right].ravel().tolist(), fill=settings.color or 'white')
+
+        draw.line(((view.project(bed) + offset) * factor).ravel().tolist(), fill='blue')
+        thumbnails.append(thumbnail)
+    return thumbnails
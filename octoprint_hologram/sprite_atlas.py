@@ -0,0 +1,213 @@
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+import zipfile
+
+from octoprint_hologram import render
+
+
+def file_digest(path, block_size=1 << 20):
+    """SHA-1 of the content of a file."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as infile:
+        for block in iter(lambda: infile.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _lower_thread_priority():
+    # Linux applies niceness per thread, elsewhere the worker keeps the normal priority
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+
+class SpriteAtlas:
+    """
+    Cumulative overlays of G-code files pre-rendered for one camera, one zip file per atlas.
+
+    An atlas holds the overlay of layers [1, bound) for every bound at a fixed layer stride,
+    plus the whole toolpath, as the PNGs render.render_toolpath produces, with their anchor
+    and ROI in a meta.json. Atlases are keyed by the file content and every render setting,
+    so a repeat job or a reprint finds its overlays without rendering, and a recalibration
+    simply misses. They are built by a single low-priority worker thread and the least
+    recently used ones are removed when the folder grows over max_bytes.
+
+    Files are hashed by the worker too: lookups only know a file by its path, mtime and size,
+    and miss until the worker has resolved those to a digest, so scheduling a file whose atlas
+    already exists costs a hash in the background but never on the caller's thread.
+    """
+
+    def __init__(self, folder, stride=10, max_bytes=256 << 20, logger=None):
+        self.folder = folder
+        self.stride = max(1, int(stride))
+        self.max_bytes = max_bytes
+        self._logger = logger
+        self._digests = {}  # (path, mtime, size) -> content digest, filled by the worker
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._thread = None
+
+    @property
+    def pending(self):
+        """Number of atlases queued or being built."""
+        with self._lock:
+            return len(self._queued)
+
+    @staticmethod
+    def _identity(gcode_path):
+        """Cheap stand-in for the content of a file, valid until it is rewritten."""
+        stat = os.stat(gcode_path)
+        return gcode_path, stat.st_mtime_ns, stat.st_size
+
+    def resolve(self, gcode_path):
+        """Digest of a file, hashing it unless already known. Slow on large files, kept off the event thread."""
+        identity = self._identity(gcode_path)
+        with self._lock:
+            digest = self._digests.get(identity)
+        if digest is None:
+            digest = file_digest(gcode_path)
+            with self._lock:
+                self._digests[identity] = digest
+        return digest
+
+    def _params(self, settings):
+        return json.dumps([list(settings.printer_dims), list(settings.slider_values), settings.color,
+                           render.output_size(settings.slider_values[4]), self.stride])
+
+    def key(self, digest, settings):
+        """Name of the atlas of a file with content digest rendered with RenderSettings settings."""
+        return hashlib.sha1(f"{digest}{self._params(settings)}".encode("utf-8")).hexdigest()[:16]
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.zip")
+
+    def lookup(self, gcode_path, settings, layer=-1):
+        """
+        Pre-rendered overlay of layers [1, layer) of a file, or of the closest layer bound below it.
+
+        Returns:
+        - Tuple of (PNG BytesIO, anchor, ROI, rendered layer bound) like render.render_toolpath plus the
+          bound, or None when there is no atlas yet, the worker has not hashed the file yet or there is
+          no bound at or below layer.
+        """
+        with self._lock:
+            digest = self._digests.get(self._identity(gcode_path))
+        if digest is None:
+            return None
+        path = self._path(self.key(digest, settings))
+        try:
+            with zipfile.ZipFile(path) as atlas:
+                meta = json.loads(atlas.read("meta.json"))
+                bounds = meta["bounds"]
+                if layer == -1 or layer > bounds[-1]:
+                    layer = bounds[-1]
+                candidates = [bound for bound in bounds if bound <= layer]
+                if not candidates:
+                    return None
+                bound = candidates[-1]
+                image = io.BytesIO(atlas.read(f"{bound}.png"))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+        # Mark as recently used for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        entry = meta["layers"][str(bound)]
+        return image, tuple(meta["anchor"]), entry["roi"], bound
+
+    def schedule(self, gcode_path, settings, load_reader):
+        """Build the atlas of a file in the background unless it exists or is already queued."""
+        identity = self._identity(gcode_path)
+        job = (identity, self._params(settings))
+        with self._lock:
+            digest = self._digests.get(identity)
+            if job in self._queued or (digest is not None and os.path.exists(self._path(self.key(digest, settings)))):
+                return
+            self._queued.add(job)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="hologram-atlas", daemon=True)
+                self._thread.start()
+        self._queue.put((job, gcode_path, settings, load_reader))
+
+    def stop(self):
+        """Stop the worker after the atlas being built, dropping the queued ones."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self):
+        _lower_thread_priority()
+        while True:
+            job = self._queue.get()
+            if job is None:
+                with self._lock:
+                    self._queued.clear()
+                break
+            queued, gcode_path, settings, load_reader = job
+            try:
+                # Hashed here rather than on schedule, lookups miss until the digest is known
+                key = self.key(self.resolve(gcode_path), settings)
+                if not os.path.exists(self._path(key)):
+                    self.build(key, load_reader(gcode_path), settings)
+                    self.evict()
+            except Exception as e:
+                if self._logger:
+                    self._logger.error(f"Failed to build sprite atlas of {gcode_path}: {e}")
+            finally:
+                with self._lock:
+                    self._queued.discard(queued)
+
+    def build(self, key, reader, settings):
+        """Render every layer bound of a parsed toolpath into the atlas named key."""
+        n_layers = reader.n_layers
+        bounds = list(range(1 + self.stride, n_layers + 1, self.stride)) + [n_layers + 1]
+
+        os.makedirs(self.folder, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        meta = {"bounds": bounds, "n_layers": n_layers, "layers": {}}
+        try:
+            # PNGs are already compressed, they are stored as is
+            with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as atlas:
+                for bound in bounds:
+                    image, anchor, roi = render.render_toolpath(reader, settings, bound)
+                    atlas.writestr(f"{bound}.png", image.getvalue())
+                    meta["anchor"] = [float(v) for v in anchor]
+                    meta["layers"][str(bound)] = {"roi": [int(v) for v in roi]}
+                atlas.writestr("meta.json", json.dumps(meta))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self):
+        """Remove the least recently used atlases until the folder fits in max_bytes."""
+        if not os.path.isdir(self.folder):
+            return
+        atlases = []
+        for name in os.listdir(self.folder):
+            if name.endswith(".zip"):
+                path = os.path.join(self.folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                atlases.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in atlases)
+        for _, size, path in sorted(atlases):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -241,7 +241,182 @@ $(function() {
             });
         };
 
+        // Browser preview: the simplified toolpath is downloaded once as a binary buffer and drawn
+        // on a canvas over the webcam stream with the camera matrix of the calibration
+        self.settingsViewModel = parameters[0];
+        self.clientToolpath = null;
+        self.clientProjection = null;
+
+        self.webcamUrl = ko.pureComputed(function() {
+            var webcam = self.settingsViewModel.settings && self.settingsViewModel.settings.webcam;
+            return webcam && webcam.streamUrl ? webcam.streamUrl() : undefined;
+        });
+
+        // Decode the buffer served by /plugin/hologram/toolpath
+        self.parseToolpath = function(buffer) {
+            var header = new DataView(buffer, 0, 44);
+            var magic = String.fromCharCode.apply(null, new Uint8Array(buffer, 0, 4));
+            if (magic !== "HGTP" || header.getUint32(4, true) !== 1) {
+                throw new Error("Unsupported toolpath buffer");
+            }
+            var nLayers = header.getUint32(8, true);
+            var nPaths = header.getUint32(12, true);
+            var nPoints = header.getUint32(16, true);
+
+            var offset = 44;
+            var layerBars = new Uint32Array(buffer, offset, nLayers + 1);
+            offset += 4 * (nLayers + 1);
+            var pathBars = new Uint32Array(buffer, offset, nPaths + 1);
+            offset += 4 * (nPaths + 1);
+
+            var columns = [0, 1, 2].map(function(axis) {
+                var quantized = new Int16Array(buffer, offset + 2 * axis * nPoints, nPoints);
+                var origin = header.getFloat32(20 + 4 * axis, true);
+                var step = header.getFloat32(32 + 4 * axis, true);
+                var values = new Float32Array(nPoints);
+                for (var i = 0; i < nPoints; i++) {
+                    values[i] = origin + (quantized[i] + 32768) * step;
+                }
+                return values;
+            });
+            return { nLayers: nLayers, layerBars: layerBars, pathBars: pathBars, xs: columns[0], ys: columns[1], zs: columns[2] };
+        };
+
+        // Project the toolpath with a 3x4 matrix from get_projection and stroke it onto a canvas
+        self.drawToolpath = function(canvas, toolpath, projection) {
+            var ctx = canvas.getContext('2d');
+            ctx.clearRect(0, 0, canvas.width, canvas.height);
+            if (!toolpath || !projection) {
+                return;
+            }
+            var m = projection.matrix;
+            var xs = toolpath.xs, ys = toolpath.ys, zs = toolpath.zs, pathBars = toolpath.pathBars;
+            var lastPath = toolpath.layerBars[toolpath.nLayers];
+
+            ctx.beginPath();
+            for (var p = 0; p < lastPath; p++) {
+                for (var i = pathBars[p]; i < pathBars[p + 1]; i++) {
+                    var x = xs[i], y = ys[i], z = zs[i];
+                    var w = m[2][0] * x + m[2][1] * y + m[2][2] * z + m[2][3];
+                    var u = (m[0][0] * x + m[0][1] * y + m[0][2] * z + m[0][3]) / w;
+                    var v = (m[1][0] * x + m[1][1] * y + m[1][2] * z + m[1][3]) / w;
+                    if (i === pathBars[p]) {
+                        ctx.moveTo(u, v);
+                    } else {
+                        ctx.lineTo(u, v);
+                    }
+                }
+            }
+            ctx.strokeStyle = projection.color || 'white';
+            ctx.lineWidth = 1;
+            ctx.stroke();
+        };
+
+        self.fetchProjection = function(offsets, callback) {
+            var request = { command: "get_projection" };
+            (offsets || []).forEach(function(value, i) {
+                request["value" + (i + 1)] = value;
+            });
+            $.ajax({
+                url: API_BASEURL + "plugin/hologram",
+                type: "POST",
+                dataType: "json",
+                contentType: "application/json; charset=UTF-8",
+                data: JSON.stringify(request),
+                success: function(response) {
+                    self.clientProjection = response;
+                    callback(response);
+                },
+                error: function() {
+                    console.error("Failed to get the camera projection");
+                }
+            });
+        };
+
+        self.fetchToolpath = function(projection, callback) {
+            var tolerance = 0.5 * projection.mm_per_pixel;
+            fetch(`/plugin/hologram/toolpath?tolerance=${tolerance}`, { credentials: "same-origin" })
+                .then(function(response) {
+                    if (!response.ok) {
+                        throw new Error(response.statusText);
+                    }
+                    return response.arrayBuffer();
+                })
+                .then(function(buffer) {
+                    self.clientToolpath = self.parseToolpath(buffer);
+                    callback(self.clientToolpath);
+                })
+                .catch(function(error) {
+                    console.error("Failed to get the toolpath:", error);
+                    alert("Failed to get the toolpath please make sure you have selected a job");
+                });
+        };
+
+        self.drawInBrowser = function() {
+            var canvas = document.getElementById('client-render-canvas');
+            self.fetchProjection([], function(projection) {
+                self.fetchToolpath(projection, function(toolpath) {
+                    // Projected pixels are snapshot pixels, the canvas is scaled with the stream by CSS
+                    // even when the stream has another resolution than the snapshot
+                    canvas.width = projection.snapshot_size[0];
+                    canvas.height = projection.snapshot_size[1];
+                    self.drawToolpath(canvas, toolpath, projection);
+                });
+            });
+        };
+
+        // Redraw the toolpath preview of the settings for the current adjustments
+        self.updateClientPreview = function() {
+            if (!self.clientToolpath) {
+                return;
+            }
+            var offsets = self.sliderValues().map(function(value) { return value(); });
+            self.fetchProjection(offsets, function(projection) {
+                var canvas = document.getElementById('client-preview-canvas');
+                canvas.width = projection.snapshot_size[0];
+                canvas.height = projection.snapshot_size[1];
+                self.drawToolpath(canvas, self.clientToolpath, projection);
+            });
+        };
+
+        self.loadClientPreview = function() {
+            var offsets = self.sliderValues().map(function(value) { return value(); });
+            self.fetchProjection(offsets, function(projection) {
+                self.fetchToolpath(projection, function() {
+                    self.updateClientPreview();
+                });
+            });
+        };
+
+        // Statistics of the selected G-code file
+        self.jobStats = ko.observable();
+
+        self.fetchStats = function() {
+            $.ajax({
+                url: API_BASEURL + "plugin/hologram",
+                type: "POST",
+                dataType: "json",
+                contentType: "application/json; charset=UTF-8",
+                data: JSON.stringify({
+                    command: "get_stats"
+                }),
+                success: function(response) {
+                    self.jobStats(response);
+                },
+                error: function(xhr, status, error) {
+                    console.error("Failed to fetch job statistics:", status, error);
+                    alert("Failed to get job statistics please make sure you have selected a job");
+                }
+            });
+        };
+
         self.updateImage = function() {
+            // Once the toolpath is loaded the browser preview follows the adjustments, the server
+            // render of the arrow is only needed without it
+            if (self.clientToolpath) {
+                self.updateClientPreview();
+                return;
+            }
             $.ajax({
                 url: API_BASEURL + "plugin/hologram",
                 type: "POST",
@@ -264,6 +439,57 @@ $(function() {
             });
         };
 
+        // Contact sheet of candidate views around the current slider values
+        self.viewsSheetUrl = ko.observable();
+        self.previewOffsets = [];
+        self.previewColumns = 3;
+
+        self.previewViews = function() {
+            var step = 10;
+            var current = self.sliderValues().map(function(value) { return value(); });
+            self.previewOffsets = [];
+            [-step, 0, step].forEach(function(elevation) {
+                [-step, 0, step].forEach(function(azimuth) {
+                    self.previewOffsets.push([current[0] + elevation, current[1] + azimuth, current[2], current[3], current[4]]);
+                });
+            });
+
+            $.ajax({
+                url: API_BASEURL + "plugin/hologram",
+                type: "POST",
+                dataType: "json",
+                contentType: "application/json; charset=UTF-8",
+                data: JSON.stringify({
+                    command: "render_views",
+                    views: self.previewOffsets,
+                    relative: true,
+                    columns: self.previewColumns
+                }),
+                success: function(response) {
+                    self.viewsSheetUrl(response.image_data);
+                },
+                error: function() {
+                    console.error("Failed to render views");
+                }
+            });
+        };
+
+        // Pick the view under the cursor on the contact sheet
+        self.pickView = function(data, event) {
+            var rect = event.target.getBoundingClientRect();
+            var rows = Math.ceil(self.previewOffsets.length / self.previewColumns);
+            var column = Math.floor((event.clientX - rect.left) / rect.width * self.previewColumns);
+            var row = Math.floor((event.clientY - rect.top) / rect.height * rows);
+            var offsets = self.previewOffsets[row * self.previewColumns + column];
+            if (!offsets) {
+                return;
+            }
+            offsets.forEach(function(value, i) {
+                self.sliderValues()[i](value);
+            });
+            self.updateImage();
+        };
+
         self.sendOffSets = function() {
             $.ajax({
                 url: API_BASEURL + "plugin/hologram",
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+
+class MetricRingBuffer:
+    """
+    Fixed-capacity time series of monitoring metrics backed by a memory-mapped .npy file.
+
+    Each record holds a timestamp, a layer number and one float32 value per metric.
+    Once full, the oldest records are overwritten, so memory and disk usage stay
+    constant however long the print runs. The write counter lives in a second small
+    .npy file next to the data, which lets the history survive a restart.
+    """
+
+    def __init__(self, path, capacity=4096, metrics=("ssim", "render_time")):
+        self.path = path
+        self.capacity = capacity
+        self.metrics = tuple(metrics)
+        self.dtype = np.dtype([("timestamp", "f8"), ("layer", "i4")] + [(m, "f4") for m in self.metrics])
+        self._lock = threading.Lock()
+
+        counter_path = self._counter_path(path)
+        if os.path.exists(path) and os.path.exists(counter_path):
+            data = np.lib.format.open_memmap(path, mode="r+")
+            if data.dtype == self.dtype and data.shape == (capacity,):
+                self._data = data
+                self._written = np.lib.format.open_memmap(counter_path, mode="r+")
+                return
+            del data
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._data = np.lib.format.open_memmap(path, mode="w+", dtype=self.dtype, shape=(capacity,))
+        self._written = np.lib.format.open_memmap(counter_path, mode="w+", dtype=np.int64, shape=(1,))
+
+    @staticmethod
+    def _counter_path(path):
+        return os.path.splitext(path)[0] + ".count.npy"
+
+    def __len__(self):
+        return int(min(self._written[0], self.capacity))
+
+    def append(self, timestamp, layer, **values):
+        """Append a record, metrics missing from values are stored as NaN."""
+        with self._lock:
+            index = int(self._written[0] % self.capacity)
+            self._data[index] = (timestamp, layer) + tuple(values.get(m, np.nan) for m in self.metrics)
+            self._written[0] += 1
+
+    def clear(self):
+        with self._lock:
+            self._written[0] = 0
+
+    def flush(self):
+        with self._lock:
+            self._data.flush()
+            self._written.flush()
+
+    def records(self):
+        """Return a copy of the stored records, oldest first."""
+        with self._lock:
+            written = int(self._written[0])
+            if written <= self.capacity:
+                return np.array(self._data[:written])
+            head = written % self.capacity
+            return np.concatenate((self._data[head:], self._data[:head]))
+
+    def query(self, start=None, end=None, max_points=200):
+        """
+        Return the records with start <= timestamp <= end, averaged into at most max_points buckets.
+
+        Work is bounded by the buffer capacity, so charts cost the same at any point of a print.
+        Each bucket keeps the mean timestamp, the highest layer and the mean of every metric,
+        ignoring NaN values.
+        """
+        records = self.records()
+        timestamps = records["timestamp"]
+        left = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        right = len(records) if end is None else int(np.searchsorted(timestamps, end, side="right"))
+        records = records[left:right]
+
+        if len(records) <= max_points:
+            return records
+
+        # Split the range into max_points contiguous buckets of (almost) equal size
+        bounds = np.linspace(0, len(records), max_points + 1).astype(np.int64)[:-1]
+        counts = np.diff(np.append(bounds, len(records)))
+
+        result = np.empty(max_points, dtype=self.dtype)
+        result["timestamp"] = np.add.reduceat(records["timestamp"], bounds) / counts
+        result["layer"] = np.maximum.reduceat(records["layer"], bounds)
+        for metric in self.metrics:
+            values = records[metric]
+            valid = ~np.isnan(values)
+            sums = np.add.reduceat(np.where(valid, values, 0), bounds)
+            valid_counts = np.add.reduceat(valid.astype(np.int64), bounds)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                result[metric] = np.where(valid_counts > 0, sums / valid_counts, np.nan)
+        return result
+
+
+def job_buffer_path(folder, job_path):
+    """Path of the ring buffer file used for a print job inside folder."""
+    name = hashlib.sha1(job_path.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(folder, f"{name}.npy")
+
+
+def latest_buffer_path(folder):
+    """Path of the most recently written ring buffer inside folder, or None."""
+    if not os.path.isdir(folder):
+        return None
+    paths = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".npy") and not f.endswith(".count.npy")]
+    if not paths:
+        return None
+    return max(paths, key=os.path.getmtime)
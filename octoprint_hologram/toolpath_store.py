@@ -0,0 +1,93 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import Future
+
+from octoprint_hologram import gcode_reader
+
+
+class SharedToolpaths:
+    """
+    Parsed toolpaths kept as memory-mapped files inside a folder.
+
+    A G-code file is parsed once, straight into a columnar SegmentStore next to the other
+    plugin data; every GcodeReader handed out afterwards is attached to those files, so
+    renderers in this process and in worker processes share the same pages instead of each
+    holding (or unpickling) a copy of the segments, and only the layers drawn are read.
+    Entries are keyed by file path and modification time, and removed when their job is no
+    longer in use or when the plugin shuts down.
+
+    The lock only guards the bookkeeping: a file is parsed outside of it, callers asking for
+    the same file meanwhile wait for that parse alone, and other files or cleanups proceed.
+    """
+
+    def __init__(self, folder, workers=1):
+        self.folder = folder
+        self.workers = workers  # Processes parsing a file, see GcodeReader
+        self._lock = threading.Lock()
+        self._parsing = {}  # entry name -> Future of the parse in progress
+
+    def entry_path(self, gcode_path):
+        """Folder holding the arrays of a G-code file in its current version."""
+        key = f"{gcode_path}:{os.path.getmtime(gcode_path)}"
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.folder, name)
+
+    def get(self, gcode_path):
+        """Return a GcodeReader attached to the shared arrays of a file, parsing and publishing it if needed."""
+        path = self.entry_path(gcode_path)
+        name = os.path.basename(path)
+        with self._lock:
+            parse = self._parsing.get(name)
+            owner = parse is None and not os.path.isdir(path)
+            if owner:
+                parse = self._parsing[name] = Future()
+
+        if owner:
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                # Stream the segments to disk while parsing, the toolpath is never fully in memory
+                reader = gcode_reader.GcodeReader(gcode_path, store_path=f"{path}.tmp-{os.getpid()}",
+                                                   workers=self.workers)
+                reader.save_arrays(path)
+            except BaseException as e:
+                parse.set_exception(e)
+                raise
+            else:
+                parse.set_result(None)
+            finally:
+                with self._lock:
+                    del self._parsing[name]
+        elif parse is not None:
+            # Raises the error of the parse when it failed
+            parse.result()
+        return gcode_reader.GcodeReader.from_arrays(path)
+
+    def retain(self, gcode_paths):
+        """Remove the entries of every file except gcode_paths (paths that no longer exist are ignored)."""
+        keep = set()
+        for gcode_path in gcode_paths:
+            if gcode_path and os.path.exists(gcode_path):
+                keep.add(os.path.basename(self.entry_path(gcode_path)))
+        self._remove(lambda name: name not in keep)
+
+    def clear(self):
+        """Remove every entry, including leftovers of an interrupted write."""
+        self._remove(lambda name: True)
+
+    def _remove(self, predicate):
+        if not os.path.isdir(self.folder):
+            return
+        with self._lock:
+            for name in os.listdir(self.folder):
+                path = os.path.join(self.folder, name)
+                # Entries being parsed, and their temporary store, are left to their parse
+                if name.split(".tmp-")[0] in self._parsing:
+                    continue
+                if not os.path.isdir(path) or not predicate(name):
+                    continue
+                try:
+                    gcode_reader.remove_arrays(path)
+                except OSError:
+                    # Still mapped on platforms that lock open files, retried on the next cleanup
+                    pass
@@ -1,32 +1,80 @@
 import io
 import math
-import matplotlib; matplotlib.use('Agg')
-from matplotlib import pyplot as plt
-from mpl_toolkits.mplot3d import proj3d
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from PIL import Image
 import numpy as np
-from skimage.metrics import structural_similarity as ssim
-from skimage.io import imread
-from skimage.color import rgb2gray
-from scipy.optimize import basinhopping
+
+# matplotlib, PIL, scikit-image and scipy are imported inside the functions using them,
+# importing them here would add seconds to OctoPrint startup
 
 def get_pixel_coords(ax, x, y, z):
-    # Transform 3D point to 2D screen coordinates
-    x_proj, y_proj, _ = proj3d.proj_transform(x, y, z, ax.get_proj())
+    """Pixel coordinates (origin top-left) of one 3D point, see get_pixel_coords_array."""
+    pixel_x, pixel_y = get_pixel_coords_array(ax, [(x, y, z)])[0]
+    return (pixel_x, pixel_y)
+
+def get_pixel_coords_array(ax, points):
+    """
+    Pixel coordinates of an (N, 3) array of 3D points, projected in one call.
+
+    Returns:
+    - (N, 2) array of x, y pixel coordinates with the origin at the top-left of the figure.
+    """
+    from mpl_toolkits.mplot3d import proj3d
+
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+
+    # Transform 3D points to 2D screen coordinates
+    x_proj, y_proj, _ = proj3d.proj_transform(points[:, 0], points[:, 1], points[:, 2], ax.get_proj())
 
     # Get the pixel coordinates
-    pixel_coords = ax.transData.transform((x_proj, y_proj))
+    pixel_coords = ax.transData.transform(np.column_stack((x_proj, y_proj)))
 
     # Invert the y-component of pixel_coords
-    pixel_coords = (pixel_coords[0], ax.figure.bbox.height - pixel_coords[1])
+    pixel_coords[:, 1] = ax.figure.bbox.height - pixel_coords[:, 1]
 
     return pixel_coords
 
-def plot_arrow(grid_limits, elev, azim, roll, focal_length):
-    fig = plt.figure()
-    ax = fig.add_subplot(111, projection='3d')
+def bed_mm_per_pixel(ax, printer_length, printer_width):
+    """Approximate size of one rendered pixel in millimetres, measured along the bed diagonal."""
+    (x0, y0), (x1, y1) = get_pixel_coords_array(ax, [(0, 0, 0), (printer_length, printer_width, 0)])
+    diagonal_px = math.hypot(x1 - x0, y1 - y0)
+    if diagonal_px == 0:
+        return 1.0
+    return math.hypot(printer_length, printer_width) / diagonal_px
+
+def new_figure():
+    """Create a Figure with its own Agg canvas, independent of the global pyplot state."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
 
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig
+
+def configure_axes(ax, grid_limits, elev, azim, roll, focal_length):
+    """
+    Set up 3D axes to show the printer volume from a camera configuration.
+
+    Only depends on the printer dimensions and slider values, so a configured axes can be
+    reused for every render with the same camera.
+    """
+    # Calculate required aspect ratio for equal scaling
+    x_range = grid_limits[1] - grid_limits[0]
+    y_range = grid_limits[3] - grid_limits[2]
+    z_range = grid_limits[5] - grid_limits[4]
+    max_range = max(x_range, y_range, z_range)
+    ax.set_box_aspect([x_range/max_range, y_range/max_range, z_range/max_range])
+
+    # Set plot limits
+    ax.set_xlim([grid_limits[0], grid_limits[1]])
+    ax.set_ylim([grid_limits[2], grid_limits[3]])
+    ax.set_zlim([grid_limits[4], grid_limits[5]])
+
+    ax.set_axis_off()
+
+    ax.set_proj_type(proj_type='persp', focal_length=focal_length)
+    ax.view_init(elev=elev, azim=azim, roll=roll)
+
+def draw_arrow(ax, grid_limits):
+    """Draw the calibration arrow and the bed outline on configured axes."""
     # Define the coordinates of the arrow tail (center of the XY plane)
     x_tail, y_tail, z_tail = grid_limits[0] + 0.5 * (grid_limits[1] - grid_limits[0]), \
                              grid_limits[2] + 0.5 * (grid_limits[3] - grid_limits[2]), \
@@ -43,33 +91,23 @@ def plot_arrow(grid_limits, elev, azim, roll, focal_length):
     # Plot the arrow
     ax.quiver(x_tail, y_tail, z_tail, U, V, W, color='r', arrow_length_ratio=0.2, pivot='tail')
 
-    # Calculate required aspect ratio for equal scaling
-    x_range = grid_limits[1] - grid_limits[0]
-    y_range = grid_limits[3] - grid_limits[2]
-    z_range = grid_limits[5] - grid_limits[4]
-    max_range = max(x_range, y_range, z_range)
-    ax.set_box_aspect([x_range/max_range, y_range/max_range, z_range/max_range])
-
-    # Set plot limits
-    ax.set_xlim([grid_limits[0], grid_limits[1]])
-    ax.set_ylim([grid_limits[2], grid_limits[3]])
-    ax.set_zlim([grid_limits[4], grid_limits[5]])
-
     # Plot lines for xy limits
     ax.plot([grid_limits[0], grid_limits[1]], [grid_limits[2], grid_limits[2]], [grid_limits[4], grid_limits[4]], color='b')
     ax.plot([grid_limits[0], grid_limits[0]], [grid_limits[2], grid_limits[3]], [grid_limits[4], grid_limits[4]], color='b')
     ax.plot([grid_limits[1], grid_limits[1]], [grid_limits[2], grid_limits[3]], [grid_limits[4], grid_limits[4]], color='b')
     ax.plot([grid_limits[0], grid_limits[1]], [grid_limits[3], grid_limits[3]], [grid_limits[4], grid_limits[4]], color='b')
 
-    ax.set_axis_off()
+def plot_arrow(grid_limits, elev, azim, roll, focal_length, fig=None):
+    if fig is None:
+        fig = new_figure()
+    ax = fig.add_subplot(111, projection='3d')
 
-    ax.set_proj_type(proj_type='persp', focal_length=focal_length)
+    configure_axes(ax, grid_limits, elev, azim, roll, focal_length)
+    draw_arrow(ax, grid_limits)
 
     x_input = grid_limits[1]/2
     y_input = grid_limits[3]/2
     z_input = 0
-    
-    ax.view_init(elev=elev, azim=azim, roll=roll)
 
     pixel_coords = get_pixel_coords(ax, x_input, y_input, z_input)
 
@@ -77,52 +115,90 @@ def plot_arrow(grid_limits, elev, azim, roll, focal_length):
     fig.savefig(arrow_img, format='png', transparent=True)
     arrow_img.seek(0)
 
-    plt.close()
-    
     return arrow_img, pixel_coords
 
 def center_of_quadrilateral(points):
+    """Intersection of the diagonals of a quadrilateral given as 4 (x, y) points, see centers_of_quadrilaterals."""
     if len(points) != 4:
         raise ValueError("A quadrilateral must have exactly 4 points.")
-    
-    x1, y1 = points[0]
-    x2, y2 = points[2]
-    x3, y3 = points[1]
-    x4, y4 = points[3]
-    
-    # Slopes of the diagonals
-    m1 = (y2 - y1) / (x2 - x1)
-    m2 = (y4 - y3) / (x4 - x3)
-    
-    # Intercept of the lines
-    c1 = y1 - m1 * x1
-    c2 = y3 - m2 * x3
-    
-    # Calculate the intersection point
-    intersection_x = (c2 - c1) / (m1 - m2)
-    intersection_y = m1 * intersection_x + c1
-    
-    return (intersection_x, intersection_y)
 
-def overlay_images(base_path, overlay_path, base_anchor, overlay_anchor, scale):
-    # Load the overlay image and scale it, ensuring it is in RGBA mode
-    overlay_image_original = Image.open(overlay_path).convert("RGBA")
-    overlay_width_scaled, overlay_height_scaled = [int(scale * s) for s in overlay_image_original.size]
-    overlay_image_scaled = overlay_image_original.resize((overlay_width_scaled, overlay_height_scaled), Image.Resampling.LANCZOS)
-    
-    # Calculate the new position for the overlay image to align the anchor points after scaling
-    # The idea is to calculate the top-left position where the overlay image should be pasted
-    overlay_anchor_scaled = (overlay_anchor[0] * scale, overlay_anchor[1] * scale)
-    paste_x = base_anchor[0] - overlay_anchor_scaled[0]
-    paste_y = base_anchor[1] - overlay_anchor_scaled[1]
+    intersection_x, intersection_y = centers_of_quadrilaterals([points])[0]
+    if not (math.isfinite(intersection_x) and math.isfinite(intersection_y)):
+        raise ValueError("The diagonals of the quadrilateral do not intersect.")
+
+    return (float(intersection_x), float(intersection_y))
+
+def centers_of_quadrilaterals(quads):
+    """
+    Intersection of the diagonals (point 0 to 2 and point 1 to 3) of an (N, 4, 2) array of quadrilaterals.
+
+    Returns:
+    - (N, 2) array of centers, NaN or inf where the diagonals are parallel.
+    """
+    quads = np.asarray(quads, dtype=float).reshape(-1, 4, 2)
+    p1, p2, p3, p4 = quads[:, 0], quads[:, 2], quads[:, 1], quads[:, 3]
+
+    # Intersect p1 + t * (p2 - p1) with p3 + u * (p4 - p3), vertical diagonals included
+    d1 = p2 - p1
+    d2 = p4 - p3
+    offset = p3 - p1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (offset[:, 0] * d2[:, 1] - offset[:, 1] * d2[:, 0]) / (d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0])
+
+    return p1 + t[:, None] * d1
+
+def paste_offset(base_anchor, overlay_anchor):
+    """Top-left position at which an overlay is pasted so its anchor lands on the base anchor."""
+    return (int(round(base_anchor[0] - overlay_anchor[0])), int(round(base_anchor[1] - overlay_anchor[1])))
+
+def overlay_images(base_path, overlay_path, base_anchor, overlay_anchor):
+    from PIL import Image
+
+    # Load the overlay image, ensuring it is in RGBA mode. It is rendered at its final
+    # on-frame size, so it is pasted as is without resampling
+    overlay_image = Image.open(overlay_path).convert("RGBA")
+
+    # Calculate the top-left position where the overlay image should be pasted to align the anchor points
+    paste_x, paste_y = paste_offset(base_anchor, overlay_anchor)
 
     # Create a new image for the result to ensure transparency is handled correctly
     result_image = Image.new('RGBA', base_path.size)
     result_image.paste(base_path, (0, 0))  # Paste the base image first
-    result_image.paste(overlay_image_scaled, (int(paste_x), int(paste_y)), overlay_image_scaled)  # Paste the scaled overlay
-        
+    result_image.paste(overlay_image, (paste_x, paste_y), overlay_image)  # Paste the overlay
+
     return result_image
 
+def contact_sheet(images, columns=None, labels=None, spacing=4):
+    """
+    Arrange equally sized images in a grid.
+
+    Args:
+    - images: List of PIL images, all the size of the first one.
+    - columns: Number of columns, defaults to a roughly square grid.
+    - labels: Optional list of strings drawn in the top-left corner of each cell.
+    - spacing: Gap between cells in pixels.
+
+    Returns:
+    - RGB PIL image of the sheet.
+    """
+    from PIL import Image, ImageDraw
+
+    if columns is None:
+        columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    cell_width, cell_height = images[0].size
+
+    sheet = Image.new('RGB', (columns * cell_width + (columns - 1) * spacing,
+                              rows * cell_height + (rows - 1) * spacing))
+    draw = ImageDraw.Draw(sheet)
+    for i, image in enumerate(images):
+        x = (i % columns) * (cell_width + spacing)
+        y = (i // columns) * (cell_height + spacing)
+        sheet.paste(image.convert('RGB'), (x, y))
+        if labels is not None:
+            draw.text((x + 4, y + 2), labels[i], fill='yellow')
+    return sheet
+
 def translate_overlay_point(x_overlay, y_overlay, base_anchor, overlay_anchor, scale):
     """
     Translates a point from the overlay image to the final image, considering scaling and anchor point alignment.
@@ -136,43 +212,44 @@ def translate_overlay_point(x_overlay, y_overlay, base_anchor, overlay_anchor, s
     Returns:
     - Tuple of (x_final, y_final): The translated coordinates of the point on the final image.
     """
+    x_final, y_final = translate_overlay_points([(x_overlay, y_overlay)], base_anchor, overlay_anchor, scale)[0]
+    return (int(x_final), int(y_final))
+
+def translate_overlay_points(points, base_anchor, overlay_anchor, scale):
+    """
+    Translates an (N, 2) array of overlay points to the final image, see translate_overlay_point.
+
+    Returns:
+    - (N, 2) float array of coordinates on the final image, not truncated to integers.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
 
     # Adjust the scale to consider diagonal scaling
     scale_adjusted = math.sqrt(scale ** 2 / 2)
-    # scale_adjusted = scale
-
-    # Calculate the scaled anchor position
-    overlay_anchor_scaled_x = overlay_anchor[0] * scale_adjusted
-    overlay_anchor_scaled_y = overlay_anchor[1] * scale_adjusted
 
     # Calculate the displacement needed to align the overlay's scaled anchor with the base anchor
-    displacement_x = base_anchor[0] - overlay_anchor_scaled_x
-    displacement_y = base_anchor[1] - overlay_anchor_scaled_y
-
-    # Scale the point coordinates
-    x_overlay_scaled = x_overlay * scale_adjusted
-    y_overlay_scaled = y_overlay * scale_adjusted
-
-    # Translate the scaled point based on the overlay's displacement
-    x_final = displacement_x + x_overlay_scaled
-    y_final = displacement_y + y_overlay_scaled
+    displacement = np.asarray(base_anchor, dtype=float) - np.asarray(overlay_anchor, dtype=float) * scale_adjusted
 
-    return (int(x_final), int(y_final))
+    # Translate the scaled points based on the overlay's displacement
+    return displacement + points * scale_adjusted
 
 def calculate_ssim(image1, image2):
+    from skimage.metrics import structural_similarity as ssim
+    from skimage.color import rgb2gray
+
     # Convert PIL Images to numpy arrays
     image1_np = np.array(image1)
     image2_np = np.array(image2)
     
     # If the images have an alpha channel, discard it (assuming RGBA format)
-    if image1_np.shape[-1] == 4:
+    if image1_np.ndim == 3 and image1_np.shape[-1] == 4:
         image1_np = image1_np[..., :3]
-    if image2_np.shape[-1] == 4:
+    if image2_np.ndim == 3 and image2_np.shape[-1] == 4:
         image2_np = image2_np[..., :3]
 
-    # Convert the images to grayscale
-    image1_gray = rgb2gray(image1_np)
-    image2_gray = rgb2gray(image2_np)
+    # Convert the images to grayscale, 2D inputs are assumed to be grayscale already
+    image1_gray = rgb2gray(image1_np) if image1_np.ndim == 3 else image1_np
+    image2_gray = rgb2gray(image2_np) if image2_np.ndim == 3 else image2_np
 
     # Ensure data_range is specified for floating point image data
     data_range = max(image1_gray.max(), image2_gray.max()) - min(image1_gray.min(), image2_gray.min())
@@ -183,11 +260,57 @@ def calculate_ssim(image1, image2):
     # Return the SSIM index
     return ssim_index
 
+def roi_grayscale(image, roi, downscale=1.0):
+    """
+    Crops a PIL image to a region of interest, downsamples it and converts it to grayscale.
+
+    Args:
+    - image: The PIL image to crop.
+    - roi: Tuple of (min_x, min_y, max_x, max_y), inclusive pixel bounds.
+    - downscale: Factor applied to the cropped region (1.0 keeps full resolution).
+
+    Returns:
+    - 2D float32 array with values in [0, 1], using the same luminance weights as rgb2gray.
+    """
+    from PIL import Image
+
+    min_x, min_y, max_x, max_y = [int(v) for v in roi]
+    cropped = image.convert("RGB").crop((min_x, min_y, max_x + 1, max_y + 1))
+
+    if downscale != 1.0:
+        # Keep at least the 7x7 window used by structural_similarity
+        width = max(7, int(cropped.width * downscale))
+        height = max(7, int(cropped.height * downscale))
+        cropped = cropped.resize((width, height), Image.Resampling.BOX)
+
+    rgb = np.asarray(cropped, dtype=np.float32) / 255.0
+    return rgb @ np.array([0.2125, 0.7154, 0.0721], dtype=np.float32)
+
+def roi_on_base(roi, base_anchor, overlay_anchor, base_size):
+    """
+    Maps an ROI found on the overlay image to the base image it is pasted onto by overlay_images.
+
+    Returns:
+    - Tuple of (min_x, min_y, max_x, max_y) clipped to base_size, or None if the ROI falls outside the base image.
+    """
+    paste_x, paste_y = paste_offset(base_anchor, overlay_anchor)
+
+    min_x = max(0, int(roi[0]) + paste_x)
+    min_y = max(0, int(roi[1]) + paste_y)
+    max_x = min(base_size[0] - 1, int(roi[2]) + paste_x)
+    max_y = min(base_size[1] - 1, int(roi[3]) + paste_y)
+
+    if min_x >= max_x or min_y >= max_y:
+        return None
+    return (min_x, min_y, max_x, max_y)
+
 def normalize_data(value, min_value, max_value):
     normalized_value = (value - min_value) / (max_value - min_value)
     return normalized_value
 
 def find_non_transparent_roi(image_path):
+    from PIL import Image
+
     # Load the image
     image = Image.open(image_path)
     
@@ -221,13 +344,14 @@ def find_non_transparent_roi(image_path):
     return roi_coords
 
 def optimize_projection(converted_quad, printer_dimensions):
+    from scipy.optimize import basinhopping
+
     # Define bounds and initial parameters
     bounds = [(-30, 120), (-180, 180), (-15, 15), (0.075, 1), (0.2, 4)]
     initial_params = [90, -90, 0, 1, 1]
 
     # Set up the 3D plot
-    fig = plt.figure()
-    canvas = FigureCanvas(fig)
+    fig = new_figure()
     ax = fig.add_subplot(111, projection='3d')
     
     # Unpack printer dimensions
@@ -240,6 +364,16 @@ def optimize_projection(converted_quad, printer_dimensions):
     ax.set_ylim(0, printer_width)
     ax.set_zlim(0, printer_depth)
 
+    # Place the axes once: with fixed limits and box aspect their position does not depend on
+    # the view, so the projection matches the one of a drawn canvas without drawing it
+    ax.apply_aspect()
+
+    # Bed corners followed by the bed center, projected together on every evaluation
+    points = np.array([(0, printer_length, 0), (printer_width, printer_length, 0), (printer_width, 0, 0), (0, 0, 0),
+                       (printer_length/2, printer_width/2, 0)], dtype=float)
+    target = np.asarray(converted_quad, dtype=float)
+    base_anchor = np.array(center_of_quadrilateral(converted_quad))
+
     # Define the error computation function
     def compute_error(params):
         elevation, azimuth, roll, focal_length, scale = np.clip(params, [b[0] for b in bounds], [b[1] for b in bounds])
@@ -247,33 +381,15 @@ def optimize_projection(converted_quad, printer_dimensions):
         ax.set_proj_type(proj_type='persp', focal_length=focal_length)
         ax.view_init(elev=elevation, azim=azimuth, roll=roll)
 
-        canvas.draw()
-
-        # Compute pixel coordinates
-        corner_pixels = []
-        corners = [(0, printer_length, 0), (printer_width, printer_length, 0), (printer_width, 0, 0), (0, 0, 0)]
-        base_anchor = center_of_quadrilateral(converted_quad)
-        center_pixel = get_pixel_coords(ax, printer_length/2, printer_width/2, 0)
-
-        displacement_x = base_anchor[0] - center_pixel[0]
-        displacement_y = base_anchor[1] - center_pixel[1]
+        # Compute pixel coordinates, moved so the bed center lands on the base anchor
+        pixels = get_pixel_coords_array(ax, points)
+        corner_pixels = pixels[:4] + (base_anchor - pixels[4])
 
-        for corner in corners:
-            pixel = get_pixel_coords(ax, *corner)
-            x_final = displacement_x + pixel[0]
-            y_final = displacement_y + pixel[1]
-
-            scaled_x = base_anchor[0] + scale * (x_final - base_anchor[0])
-            scaled_y = base_anchor[1] + scale * (y_final - base_anchor[1])
-            scaled_point = (scaled_x, scaled_y)
-            corner_pixels.append(scaled_point)
+        # Scale around the base anchor
+        corner_pixels = base_anchor + scale * (corner_pixels - base_anchor)
 
         # Calculate the error metric (sum of squared distances)
-        error = 0
-        for cp, gq in zip(corner_pixels, converted_quad):
-            error += (cp[0] - gq[0])**2 + (cp[1] - gq[1])**2
-
-        return error
+        return float(np.sum((corner_pixels - target) ** 2))
 
     # Callback function to stop optimization when the error is less than 1
     def callback(x, f, accept):
@@ -284,8 +400,6 @@ def optimize_projection(converted_quad, printer_dimensions):
     minimizer_kwargs = {"method": "L-BFGS-B", "bounds": bounds}
     result = basinhopping(compute_error, initial_params, minimizer_kwargs=minimizer_kwargs, niter=5, stepsize=0.5, callback=callback)
     
-    plt.close(fig)
-    
     # Extract optimized parameters
     elevation, azimuth, roll, focal_length, scale = result.x
     return elevation, azimuth, roll, focal_length, scale
\ No newline at end of file
@@ -13,8 +13,6 @@ plugin_license = "AGPLv3"
 plugin_requires = ["Pillow",
                    "matplotlib",
                    "numpy",
-                   "pandas",
-                   "seaborn",
                    "scikit-image",
                    "scipy"]
 